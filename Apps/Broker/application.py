@@ -55,7 +55,7 @@ class BrokerAppln():
       self.logger.info("Broker app registered.")
       # Keep checking with the discovery service if we are ready to go
       self.logger.info("Waiting for all ready from discovery service.")
-      while(not self.mw_obj.is_ready()): time.sleep(random.uniform(0.0, 3.0)) # sleep between calls
+      self.mw_obj.is_ready() # blocks until discovery tells us we are ready
       self.logger.info("All sub and pub apps registered and ready.")
       time.sleep(random.uniform(1.5, 2.0)) # sleep for a bit to not overwhelm system
       # Now, find all publishers that are registered with discovery
@@ -91,6 +91,38 @@ def parseCmdLineArgs():
     "-c", "--config", default="Apps/Common/config.ini", 
     help="configuration file (default: Apps/Common/config.ini)"
   )
+  parser.add_argument(
+    "-f", "--forwarding", default="proxy", choices=["proxy", "loop"],
+    help="forward with zmq.proxy between XSUB/XPUB sockets or with a Python loop, default=proxy"
+  )
+  parser.add_argument(
+    "-s", "--shards", type=int, default=1,
+    help="number of workers (each on its own port from --port up) to spread the topics over, default=1"
+  )
+  parser.add_argument(
+    "--lvc", type=int, default=0,
+    help="publications of each topic to keep for late joining subscribers (0 = no last value cache), default=0"
+  )
+  parser.add_argument(
+    "--snapshot", default=None,
+    help="first port of the (per shard) last value snapshot endpoints, default=the port after the last shard port"
+  )
+  parser.add_argument(
+    "--capture", default=None,
+    help="endpoint to bind a PUB socket to that gets a copy of all traffic (e.g. tcp://*:5599), default=none"
+  )
+  parser.add_argument(
+    "--cache-ttl", type=float, default=30,
+    help="seconds the pub lookup is cached for, 0 looks up with discovery every time (default: 30)"
+  )
+  parser.add_argument(
+    "--cache-stale", type=float, default=300,
+    help="seconds past its ttl that the cached lookup is still used while it is refreshed (default: 300)"
+  )
+  parser.add_argument(
+    "--cache-file", default=None,
+    help="file to keep the cached lookup in across restarts (default: none)"
+  )
   parser.add_argument(
     "-l", "--loglevel", type=int, default=logging.INFO, 
     choices=[logging.DEBUG,logging.INFO,logging.WARNING,logging.ERROR,logging.CRITICAL], 
@@ -0,0 +1,84 @@
+###############################################
+# Author: Patrick Muradaz
+# Vanderbilt University
+# Purpose: Checks that the broker's capture endpoint gets a copy of the traffic
+# Semester: Spring 2023
+###############################################
+#
+# Every worker pushes a copy of what it forwards into the broker's capture
+# endpoint. These checks run a broker (without discovery) between a publisher
+# and a subscriber that wants each topic from the shard that carries it, and
+# make sure that a subscriber to the capture endpoint gets every topic: with one
+# shard and with several, both with the proxy and with the loop.
+#
+# Run with pytest, or on its own: python3 Apps/Broker/capture_test.py
+#
+# Import statements
+import sys, os, argparse, logging, threading, json, random, socket, time, zmq
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from Apps.Common.common import shard_of
+from Apps.Broker.middleware import BrokerMW
+
+logger = logging.getLogger("CaptureTest")
+topics = ["weather", "humidity", "airquality", "light", "pressure", "temperature"]
+
+"""the first of count ports in a row that are free to bind to"""
+def free_ports(count):
+    while True:
+        port = random.randint(20000, 60000 - count); sockets = []
+        # (a zmq socket lets go of its port in the background, so try them with plain sockets)
+        try:
+            for i in range(count):
+                sockets.append(socket.socket()); sockets[-1].bind(("127.0.0.1", port + i))
+            return port
+        except OSError: pass
+        finally:
+            for sock in sockets: sock.close()
+
+"""the command line arguments a broker would have been started with"""
+def broker_args(port, forwarding, shards, capture):
+    return argparse.Namespace(addr="127.0.0.1", port=str(port), discovery="127.0.0.1:1", forwarding=forwarding, shards=shards,
+                              lvc=0, snapshot=None, capture=capture, cache_ttl=0, cache_stale=0, cache_file=None)
+
+"""publish every topic through a broker and get the topics its capture endpoint passes on"""
+def captured_topics(forwarding, shards, wait=5):
+    context = zmq.Context.instance()
+    pub_port, broker_port, capture_port = free_ports(1), free_ports(shards), free_ports(1)
+    pub = context.socket(zmq.PUB); pub.bind(f"tcp://127.0.0.1:{pub_port}")
+    mw = BrokerMW(logger)
+    mw.configure(broker_args(broker_port, forwarding, shards, f"tcp://127.0.0.1:{capture_port}"))
+    # what sub_to_pubs does once discovery has told us where the pubs are (it forwards until we exit)
+    publishers = [json.dumps({"name": "pub", "ip": "127.0.0.1", "port": str(pub_port)})]
+    threading.Thread(target=mw.sub_to_pubs, args=(publishers,), daemon=True).start()
+    # a subscriber that wants each topic from its own shard (so that each shard forwards some of them)
+    sub = context.socket(zmq.SUB)
+    for topic in topics: sub.setsockopt(zmq.SUBSCRIBE, topic.encode())
+    for shard in range(shards): sub.connect(f"tcp://127.0.0.1:{broker_port + shard}")
+    capture = context.socket(zmq.SUB); capture.setsockopt(zmq.SUBSCRIBE, b"")
+    capture.connect(f"tcp://127.0.0.1:{capture_port}")
+    # keep publishing until the capture endpoint has had every topic (the subscriptions take a moment to get through)
+    captured = set(); deadline = time.monotonic() + wait
+    while captured != set(topics) and time.monotonic() < deadline:
+        for topic in topics: pub.send_multipart([topic.encode(), b"payload"])
+        while capture.poll(timeout=10):
+            # the proxy also captures the subscriptions it passes upstream (a single frame each)
+            frames = capture.recv_multipart()
+            if len(frames) > 1: captured.add(frames[0].decode())
+    for sock in (pub, sub, capture): sock.close(linger=0)
+    return captured
+
+"""a capture subscriber gets every topic from a broker with one shard"""
+def test_capture_one_shard():
+    for forwarding in ("proxy", "loop"): assert captured_topics(forwarding, 1) == set(topics), forwarding
+
+"""a capture subscriber gets every topic from a broker with several shards"""
+def test_capture_several_shards():
+    # the topics have to land on more than one shard for this to check anything
+    assert len(set(shard_of(topic, 3) for topic in topics)) > 1
+    for forwarding in ("proxy", "loop"): assert captured_topics(forwarding, 3) == set(topics), forwarding
+
+"""Main entry point"""
+if __name__ == "__main__":
+    test_capture_one_shard()
+    test_capture_several_shards()
+    print("Capture checks passed.")
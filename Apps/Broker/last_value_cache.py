@@ -0,0 +1,66 @@
+###############################################
+# Author: Patrick Muradaz
+# Vanderbilt University
+# Purpose: Last value cache for the broker
+# Semester: Spring 2023
+###############################################
+#
+# A subscriber that joins late otherwise sees nothing of a topic until it is
+# published again. The broker stamps each publication it forwards with a per
+# topic sequence number and keeps the last few publications of each topic, so
+# a subscriber can ask for a snapshot of its topics, subscribe to the live
+# stream, and use the sequence numbers to drop what the snapshot already gave
+# it (and to notice if anything went missing in between).
+#
+# The sequence numbers start over from 1 whenever the broker does, so each cache
+# also draws a random epoch when it starts. The sequence number frame is the
+# 8 byte epoch followed by the 8 byte sequence number (big endian), both on the
+# live stream and in snapshots, so a subscriber can tell a restarted broker's
+# publications from ones it already has and start over on the new epoch.
+#
+# Both the number of publications kept per topic and the number of topics are
+# bounded (the topic that was published least recently is dropped first).
+#
+# Import statements
+import sys, os, random
+from collections import OrderedDict, deque
+sys.path.append(os.getcwd())
+from Apps.Common.common import handle_exception
+
+"""Last Value Cache class"""
+class LastValueCache():
+
+  """constructor"""
+  def __init__(self, logger, depth=1, max_topics=1024):
+    self.logger = logger          # internal logger for print statements
+    self.depth = depth            # publications kept per topic
+    self.max_topics = max_topics  # topics kept (least recently published is dropped first)
+    self.epoch = random.getrandbits(64).to_bytes(8, "big") # tells the sequence numbers of this start from those of others
+    self.seqs = {}                # topic -> sequence number of its last publication
+    self.values = OrderedDict()   # topic -> deque of (sequence number frame, payload frame)
+
+  """stamp a publication of the given topic with its sequence number (returned as a
+  16 byte epoch and sequence number frame to send along with it) and keep it (the payload frame is not copied)"""
+  def stamp(self, topic, payload):
+    try:
+      seq = self.seqs.get(topic, 0) + 1
+      self.seqs[topic] = seq
+      seq_frame = self.epoch + seq.to_bytes(8, "big")
+      if topic not in self.values:
+        if len(self.values) >= self.max_topics: self.values.popitem(last=False)
+        self.values[topic] = deque(maxlen=self.depth)
+      else: self.values.move_to_end(topic)
+      self.values[topic].append((seq_frame, payload))
+      return seq_frame
+    except Exception as e: handle_exception(e)
+
+  """get the frames (topic, payload, sequence number for each publication, oldest first)
+  of everything we have for the given topics (all of them if none are given)"""
+  def snapshot(self, topics=None):
+    try:
+      frames = []
+      for topic in (topics or list(self.values)):
+        for seq_frame, payload in self.values.get(topic, ()): frames.extend([topic, payload, seq_frame])
+      self.logger.debug(f"LastValueCache::snapshot - {len(frames) // 3} publications")
+      return frames
+    except Exception as e: handle_exception(e)
@@ -11,12 +11,52 @@
 # both PUB and SUB sockets as it must work on behalf of the real publishers and 
 # subscribers. So this will have the logic of both publisher and subscriber middleware.
 #
+# By default the forwarding itself is done by zmq.proxy between an XSUB and an XPUB
+# socket, so messages never enter the Python interpreter (the proxy runs in libzmq
+# with the GIL released). An optional capture socket gets a copy of all the traffic
+# for sampling/metrics (each worker pushes its copy into one inproc PULL, which is
+# passed on to the capture endpoint; a PULL takes everything, so there is no
+# subscription to get right on the way). The old Python receive/send loop is kept as "loop" mode.
+#
+# The broker does not subscribe to everything upstream. The XPUB learns which topics
+# our subscribers want and we subscribe (and unsubscribe) upstream per topic, keeping
+# a reference count so a topic is only dropped when its last subscriber goes away.
+# The proxy gets this from libzmq (an XPUB only passes on the first subscribe and the
+# last unsubscribe of a topic); the loop gets every one of them and counts them itself.
+# So the publishers only send us (and we only forward) the topics someone wants.
+#
+# The broker can also be sharded across cores: each of N workers (threads, since
+# the proxy does not hold the GIL) has its own XSUB/XPUB pair and publishes on its
+# own port (port, port+1, ...). Discovery hands each subscriber the shard of each
+# of its topics, so a worker only ever gets subscriptions for, and thus only
+# receives the traffic of, the topics it owns.
+#
+# With a last value cache, each worker stamps every publication with a per topic
+# sequence number (as a third frame, after the epoch of this start of the cache) and keeps the last few of each topic, which
+# subscribers can fetch from the worker's snapshot ROUTER before switching over
+# to the live stream. The stamping has to be done in Python, so the loop is used.
+# A topic is also kept subscribed upstream after its last subscriber leaves, so
+# its last values are still current for the next one to join.
+#
+# Discovery gives us a registry change feed when we register, which we follow from
+# the main thread once the workers are running. Pubs that register later are
+# connected (and pubs that leave are disconnected) by each worker itself, since its
+# sockets belong to its thread: the changes are sent over an inproc PAIR, which the
+# loop polls and which steers the proxy (it is stopped, the change is applied, and
+# it is started again). If we miss a change, we look up all the pubs again.
+#
+# The lookup of all the pubs is cached (see Apps/Common/endpoint_cache.py), so a
+# restarted broker can get going without asking discovery, and the cache is kept
+# fresh in the background; if a refresh finds other pubs, the workers follow it.
+#
 # Import statements
-import sys, os, zmq, json
+import sys, os, zmq, json, logging, threading
 sys.path.append(os.getcwd())
 from Apps.Common.common import handle_exception, \
-  send_message, disseminate, register, is_ready
+  send_message, register, wait_until_ready
 from Apps.Common import discovery_pb2
+from Apps.Broker.last_value_cache import LastValueCache
+from Apps.Common.endpoint_cache import EndpointCache
 
 """Broker Middleware class"""
 class BrokerMW():
@@ -24,9 +64,22 @@ class BrokerMW():
   """constructor"""
   def __init__(self, logger):
     self.logger = logger  # internal logger for print statements
-    self.pub = None       # will be a ZMQ PUB socket for dissemination
-    self.sub = None       # will be a ZMQ SUB socket for listening to pubs
+    self.context = None   # the ZMQ context (shared by the workers so they can use inproc)
+    self.workers = []     # one {"sub", "pub", "capture", "snapshot", "lvc", "refs", "control", "steer"} per shard
+                          # (XSUB, XPUB, PUSH, ROUTER sockets, last value cache, topic -> subscriber count
+                          # and the worker's/our end of the PAIR that connection changes are sent over)
+    self.capture = None   # will be a ZMQ PULL/PUB pair that gets a copy of all traffic (if asked for)
+    self.forwarding = None # "proxy" (zmq.proxy between XSUB/XPUB) or "loop" (Python recv/send loop)
+    self.shards = None    # number of workers the topics are spread over
+    self.lvc_depth = None # publications of each topic kept for snapshots (0 = no last value cache)
+    self.snapshot_port = None # first port of the workers' snapshot ROUTERs (if we keep last values)
     self.req = None       # will be a ZMQ REQ socket to talk to Discov service
+    self.feed = None      # will be a ZMQ SUB socket for discovery's registry change feed (if we get one)
+    self.feed_addr = None # where discovery publishes its registry changes
+    self.feed_versions = {} # topic -> version of the last registry change we applied
+    self.pub_addrs = set() # the publishers our workers are connected to
+    self.endpoint_cache = None # our cache of the pub lookup (None looks up with discovery every time)
+    self.discovery = None # the IP addr:port of the discovery service (for the cache's refresher)
     self.poller = None    # used to wait on incoming replies
     self.addr = None      # our advertised IP address
     self.port = None      # port num where we are going to publish our topics
@@ -38,22 +91,59 @@ class BrokerMW():
       # First retrieve our advertised IP addr and the publication port num
       self.port = args.port
       self.addr = args.addr
+      self.discovery = args.discovery
+      if args.cache_ttl: self.endpoint_cache = EndpointCache(self.logger, args.cache_ttl, args.cache_stale, args.cache_file)
       # Now setup ZMQ
-      context = zmq.Context()  # returns a singleton object
+      self.context = zmq.Context()
       self.poller = zmq.Poller()
       # Now setup the sockets
-      self.req = context.socket(zmq.REQ)
-      self.pub = context.socket(zmq.PUB)
-      self.sub = context.socket(zmq.SUB)
+      self.req = self.context.socket(zmq.REQ)
+      # let us send a new request even if discovery never answered the last one
+      self.req.setsockopt(zmq.REQ_RELAXED, 1)
+      self.req.setsockopt(zmq.REQ_CORRELATE, 1)
+      self.forwarding = args.forwarding
+      self.shards = args.shards
+      self.lvc_depth = args.lvc
+      if self.lvc_depth:
+        # the snapshot ports come right after the ports we publish on unless told otherwise
+        self.snapshot_port = int(args.snapshot or int(self.port) + self.shards)
+        if self.forwarding == "proxy": self.logger.info("Publications are stamped for the last value cache, so forwarding with the loop.")
+        self.forwarding = "loop"
+      if args.capture:
+        # every worker pushes its copy into one inproc PULL that we pass on to the capture endpoint
+        self.capture = {"pull": self.context.socket(zmq.PULL), "pub": self.context.socket(zmq.PUB)}
+        self.capture["pull"].bind("inproc://capture")
+        self.capture["pub"].bind(args.capture)
+        self.logger.debug(f"BrokerMW::configure - capture bound to: {args.capture}")
       self.poller.register(self.req, zmq.POLLIN)
       connect_str = "tcp://" + args.discovery
       self.logger.debug(f"BrokerMW::configure - connected to: {connect_str}")
       self.req.connect(connect_str)
-      bind_string = f"tcp://{self.addr}:{self.port}"
-      self.logger.debug(f"BrokerMW::configure - bound to: {bind_string}")
-      self.pub.bind(bind_string)
-      # Finally, subscribe to any/all topics
-      self.sub.subscribe("")
+      for shard in range(self.shards): self.workers.append(self.make_worker(shard))
+    except Exception as e: handle_exception(e)
+
+  """make the sockets of the worker that serves the given shard (on our port + shard)"""
+  def make_worker(self, shard):
+    try:
+      self.logger.debug("BrokerMW::make_worker")
+      worker = {"sub": self.context.socket(zmq.XSUB), "pub": self.context.socket(zmq.XPUB),
+                "capture": None, "snapshot": None, "lvc": None, "refs": {},
+                "control": self.context.socket(zmq.PAIR), "steer": self.context.socket(zmq.PAIR)}
+      # the loop does its own reference counting so it needs to see every (un)subscribe
+      if self.forwarding == "loop": worker["pub"].setsockopt(zmq.XPUB_VERBOSER, 1)
+      worker["steer"].bind(f"inproc://steer-{shard}")
+      worker["control"].connect(f"inproc://steer-{shard}")
+      bind_string = f"tcp://{self.addr}:{int(self.port) + shard}"
+      self.logger.debug(f"BrokerMW::make_worker - bound to: {bind_string}")
+      worker["pub"].bind(bind_string)
+      if self.capture:
+        worker["capture"] = self.context.socket(zmq.PUSH)
+        worker["capture"].connect("inproc://capture")
+      if self.lvc_depth:
+        worker["lvc"] = LastValueCache(self.logger, depth=self.lvc_depth)
+        worker["snapshot"] = self.context.socket(zmq.ROUTER)
+        worker["snapshot"].bind(f"tcp://{self.addr}:{self.snapshot_port + shard}")
+      return worker
     except Exception as e: handle_exception(e)
 
   """register with the discovery service using the common function"""
@@ -63,24 +153,26 @@ class BrokerMW():
       # build the request message
       register_req = discovery_pb2.RegisterReq()
       register(self.logger, register_req.BROKER, 
-               name, self.addr, self.port, self.req)
+               name, self.addr, self.port, self.req, shards=self.shards, snapshot_port=self.snapshot_port)
       # now go to our event loop to receive a response to this request
       return self.event_loop()
     except Exception as e: handle_exception(e)
 
-  """check if the discovery service gives the green light to proceed"""
-  def is_ready(self):
+  """wait for the discovery service to give the green light to proceed
+  (returns False if it has not after timeout seconds, None waits for as long as it takes)"""
+  def is_ready(self, timeout=None):
     try:
       self.logger.debug("BrokerMW::is_ready")
-      is_ready(self.logger, self.req)
-      # now go to our event loop to receive a response to this request
-      return self.event_loop()
+      return wait_until_ready(self.logger, self.req, self.event_loop, timeout)
     except Exception as e: handle_exception(e)
 
-  """locate all of the registered publishers"""
-  def locate_pubs(self):
+  """locate all of the registered publishers (from our cache unless told otherwise)"""
+  def locate_pubs(self, cached=True):
     try:
       self.logger.debug("BrokerMW::locate_pubs")
+      if self.endpoint_cache and cached:
+        publishers = self.endpoint_cache.get(self.endpoint_cache.key())
+        if publishers != None: return publishers
       # build the request message
       disc_req = discovery_pb2.DiscoveryReq()
       getpubs_msg = discovery_pb2.LookupAllPubsReq()
@@ -90,6 +182,7 @@ class BrokerMW():
       send_message(self.req, disc_req)
       # now go to our event loop to receive a response to this request
       publishers = self.event_loop()
+      if self.endpoint_cache: self.endpoint_cache.put(self.endpoint_cache.key(), publishers)
       return publishers
     except Exception as e: handle_exception(e)
 
@@ -97,37 +190,169 @@ class BrokerMW():
   def sub_to_pubs(self, pubs):
     try:
       self.logger.debug("BrokerMW::sub_to_pubs")
-      # Subscribe to each publisher
+      # follow the changes from here on (pubs that come and go once we are forwarding)
+      if self.feed_addr:
+        self.feed = self.context.socket(zmq.SUB)
+        self.feed.setsockopt(zmq.SUBSCRIBE, b"")
+        self.feed.connect(self.feed_addr)
+        self.logger.info(f"Following registry changes on: {self.feed_addr}")
+      # Subscribe (every worker) to each publisher
       for pub in pubs:
         p = json.loads(pub)
         pub_addr = f"tcp://{p['ip']}:{p['port']}"
-        self.sub.connect(pub_addr)
+        if pub_addr in self.pub_addrs: continue
+        for worker in self.workers: worker["sub"].connect(pub_addr)
+        self.pub_addrs.add(pub_addr)
         self.logger.info(f"Subscribed to publisher: {pub_addr}")
       # Then listen from messages from our subscriptions
       self.listen_to_pubs()
     except Exception as e: handle_exception(e)
   
-  """listen to all of our subscribed publishers"""
+  """listen to all of our subscribed publishers (each worker on its own thread)"""
   def listen_to_pubs(self):
     try:
       self.logger.debug("BrokerMW::listen_to_pubs")
+      # the sockets are handed over to the worker threads here and not touched by us again
+      threads = [threading.Thread(target=self.run_worker, args=(worker,), daemon=True) for worker in self.workers]
+      for thread in threads: thread.start()
+      self.logger.info(f"Forwarding with {len(threads)} worker(s) ({self.forwarding}).")
+      # pass the captured traffic on from a thread of its own (only returns if the context is terminated)
+      if self.capture: threading.Thread(target=zmq.proxy, args=(self.capture["pull"], self.capture["pub"]), daemon=True).start()
+      # keep our workers' connections up to date with the registry
+      if self.feed or self.endpoint_cache: self.follow_registry()
+      for thread in threads: thread.join()
+    except Exception as e: handle_exception(e)
+
+  """forward between the given worker's sockets"""
+  def run_worker(self, worker):
+    try:
+      self.logger.debug("BrokerMW::run_worker")
+      # let libzmq do the forwarding (this only returns once we are told to change our connections)
+      while self.forwarding == "proxy":
+        zmq.proxy_steerable(worker["sub"], worker["pub"], worker["capture"], worker["control"])
+        self.change_connections(worker, worker["control"].recv_json())
+      debug = self.logger.isEnabledFor(logging.DEBUG)
+      poller = zmq.Poller()
+      poller.register(worker["sub"], zmq.POLLIN)
+      poller.register(worker["pub"], zmq.POLLIN)
+      poller.register(worker["control"], zmq.POLLIN)
+      if worker["snapshot"]: poller.register(worker["snapshot"], zmq.POLLIN)
       while True:
-        # receive and disseminate messages from the publishers
-        message_bytes = self.sub.recv_multipart()
-        message = str(message_bytes[0], 'UTF-8')
-        self.logger.info(f"Passing on message from publisher: {message}")
-        disseminate(self.logger, self.pub, message)
+        events = dict(poller.poll())
+        # pass on subscriptions from our subscribers to the publishers
+        if worker["pub"] in events: self.pass_on_subscription(worker, worker["pub"].recv())
+        if worker["control"] in events: self.change_connections(worker, worker["control"].recv_json())
+        if worker["snapshot"] in events: self.send_snapshot(worker)
+        if worker["sub"] not in events: continue
+        # receive and pass on the frames from the publishers as they are (no copying or decoding)
+        frames = worker["sub"].recv_multipart(copy=False)
+        if worker["lvc"]: frames.append(worker["lvc"].stamp(frames[0].bytes, frames[1]))
+        worker["pub"].send_multipart(frames, copy=False)
+        if worker["capture"]: worker["capture"].send_multipart(frames, copy=False)
+        if debug: self.logger.debug(f"BrokerMW::run_worker - passed on: {frames[0].bytes}")
+    except Exception as e: handle_exception(e)
+
+  """connect the given worker to (and disconnect it from) the given publishers (from its own thread)"""
+  def change_connections(self, worker, changes):
+    try:
+      self.logger.debug(f"BrokerMW::change_connections - {changes}")
+      for pub_addr in changes["connect"]: worker["sub"].connect(pub_addr)
+      for pub_addr in changes["disconnect"]: worker["sub"].disconnect(pub_addr)
+    except Exception as e: handle_exception(e)
+
+  """keep our workers connected to the registered pubs, applying the changes from discovery's feed
+  as they come and following what the cache's background refresh finds (from the main thread)"""
+  def follow_registry(self):
+    try:
+      self.logger.debug("BrokerMW::follow_registry")
+      poller = zmq.Poller()
+      if self.feed: poller.register(self.feed, zmq.POLLIN)
+      if self.endpoint_cache:
+        poller.register(self.endpoint_cache.start(self.context, self.discovery), zmq.POLLIN)
+      while True:
+        events = dict(poller.poll())
+        if self.feed in events: self.apply_change()
+        if self.endpoint_cache and self.endpoint_cache.changed in events:
+          pubs = self.endpoint_cache.get(self.endpoint_cache.recv_changed())
+          if pubs != None: self.update_workers(set(f"tcp://{p['ip']}:{p['port']}" for p in map(json.loads, pubs)))
+    except Exception as e: handle_exception(e)
+
+  """apply a change from discovery's registry change feed to our workers' connections
+  (if we missed one of the topic's changes, we look up all of the pubs again)"""
+  def apply_change(self):
+    try:
+      self.logger.debug("BrokerMW::apply_change")
+      change = discovery_pb2.RegistryChange()
+      change.ParseFromString(self.feed.recv_multipart()[-1])
+      last = self.feed_versions.get(change.topic)
+      self.feed_versions[change.topic] = change.version
+      pub_addr = f"tcp://{change.publisher.ip}:{change.publisher.port}"
+      if last != None and change.version != last + 1:
+        self.logger.warning(f"Missed registry changes of topic: {change.topic}, looking up the pubs again")
+        return self.update_workers(set(f"tcp://{p['ip']}:{p['port']}" for p in map(json.loads, self.locate_pubs(cached=False))))
+      if self.endpoint_cache: self.endpoint_cache.apply(change)
+      # the feed has a change for each topic of a pub, only the first one does anything
+      if change.op == discovery_pb2.RegistryChange.REMOVE: return self.update_workers(self.pub_addrs - {pub_addr})
+      # a pub that registered again somewhere else is moved over to its new address
+      prev_addr = f"tcp://{change.previous.ip}:{change.previous.port}"
+      moved = {prev_addr} if change.op == discovery_pb2.RegistryChange.UPDATE and prev_addr != pub_addr else set()
+      self.update_workers((self.pub_addrs - moved) | {pub_addr})
+    except Exception as e: handle_exception(e)
+
+  """connect our workers to the given pubs (and disconnect them from the ones not given)"""
+  def update_workers(self, pub_addrs):
+    try:
+      changes = {"connect": sorted(pub_addrs - self.pub_addrs), "disconnect": sorted(self.pub_addrs - pub_addrs)}
+      if not changes["connect"] and not changes["disconnect"]: return
+      for worker in self.workers:
+        # stop the worker's proxy so that it picks up the change
+        if self.forwarding == "proxy": worker["steer"].send(b"TERMINATE")
+        worker["steer"].send_json(changes)
+      for addr in changes["connect"]: self.logger.info(f"Subscribed to publisher: {addr}")
+      for addr in changes["disconnect"]: self.logger.info(f"Unsubscribed from publisher: {addr}")
+      self.pub_addrs = pub_addrs
+    except Exception as e: handle_exception(e)
+
+  """count a (un)subscribe from one of the given worker's subscribers and (un)subscribe
+  upstream if it is the first subscriber of the topic (or the last one to leave)"""
+  def pass_on_subscription(self, worker, msg):
+    try:
+      # an XPUB hands us the subscription as a 1 (subscribe) or 0 (unsubscribe) byte and then the topic
+      subscribe, topic, refs = msg[0] == 1, msg[1:], worker["refs"]
+      if subscribe: refs[topic] = refs.get(topic, 0) + 1
+      elif topic in refs: refs[topic] -= 1
+      else: return # an unsubscribe for a topic nobody subscribed to
+      # keep getting the topic if we keep its last values (the next subscriber will want them)
+      if not subscribe and worker["lvc"] and refs[topic] == 0: return
+      if refs[topic] == 0: del refs[topic]
+      if refs.get(topic, 0) == int(subscribe):
+        worker["sub"].send(msg)
+        self.logger.info(f"{'Subscribed' if subscribe else 'Unsubscribed'} upstream to topic: {topic.decode('utf-8')}")
+    except Exception as e: handle_exception(e)
+
+  """answer a snapshot request (a frame per topic wanted, none for all of them) with the number of
+  last values the given worker has of those topics and then a topic, payload and sequence number frame each"""
+  def send_snapshot(self, worker):
+    try:
+      self.logger.debug("BrokerMW::send_snapshot")
+      frames = worker["snapshot"].recv_multipart()
+      # the envelope is everything up to and including the empty delimiter frame
+      split = frames.index(b"") + 1
+      envelope, topics = frames[:split], frames[split:]
+      values = worker["lvc"].snapshot(topics)
+      worker["snapshot"].send_multipart(envelope + [str(len(values) // 3).encode()] + values, copy=False)
     except Exception as e: handle_exception(e)
 
   """run event loop where we expect to receive replies to sent requests"""
-  def event_loop(self):
+  def event_loop(self, timeout=None):
     try:
       self.logger.debug("BrokerMW::event_loop - run the event loop")
       while True:
-        # poll for events. We give it an infinite timeout.
+        # poll for events. We give it an infinite timeout unless told otherwise.
         # The return value is a socket to event mask mapping
-        events = dict(self.poller.poll())
+        events = dict(self.poller.poll(timeout=timeout))
         if self.req in events: return self.handle_reply()
+        if timeout != None: return None # nothing came back in time
     except Exception as e: handle_exception(e)
              
   """handle an incoming reply"""
@@ -143,7 +368,8 @@ class BrokerMW():
       if disc_resp.msg_type == discovery_pb2.REGISTER:
         if disc_resp.register_resp.result == discovery_pb2.RegisterResp().Result.FAILURE:
           raise Exception(disc_resp.register_resp.fail_reason) # return register error
-        else: return disc_resp.register_resp.result # return response to register
+        self.feed_addr = disc_resp.register_resp.feed or None # where to follow the registry changes (if anywhere)
+        return disc_resp.register_resp.result # return response to register
       elif disc_resp.msg_type == discovery_pb2.ISREADY:
         return disc_resp.is_ready.reply # return response to is_ready request
       elif disc_resp.msg_type == discovery_pb2.LOOKUP_ALL_PUBS:
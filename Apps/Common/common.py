@@ -9,7 +9,7 @@
 # This file contains any declarations that are common to all middleware entities
 #
 # import statements
-import json, hashlib
+import json, hashlib, time, logging
 from Apps.Common import discovery_pb2
 
 """handle the given exception"""
@@ -39,16 +39,40 @@ def dump(logger, app, ip, port, name=None, iters=None,
 """format and return the given array of publishers"""
 def format_pubs(pubs):
     try:
-      formatted_pubs = []; pub_names = []
+      formatted_pubs = []; pub_names = set()
       for pub in pubs:
           try: publisher = {"name": pub.id.name, "ip": pub.id.ip, "port": pub.id.port}
           except: publisher = {"name": pub.name, "ip": pub.ip, "port": pub.port}
           if publisher["name"] not in pub_names:
               formatted_pubs.append(json.dumps(publisher))
-              pub_names.append(publisher["name"])
+              pub_names.add(publisher["name"])
       return formatted_pubs
     except Exception as e: handle_exception(e)
 
+"""get the broker shard that carries the given topic (the same everywhere, unlike python's hash())"""
+def shard_of(topic, shards):
+    try: return hash_func(32, topic) % shards
+    except Exception as e: handle_exception(e)
+
+"""format and return the broker endpoints to use for the given topics (one per shard that
+carries any of them, along with those topics) or just the broker if it is not sharded
+(along with where to get a snapshot of the last values, if the broker keeps them)"""
+def format_broker(broker, topiclist):
+    try:
+      try: broker = broker.id
+      except: pass
+      def endpoint(name, shard):
+          entry = {"name": name, "ip": broker.ip, "port": str(int(broker.port) + shard)}
+          if broker.snapshot_port: entry["snapshot"] = str(int(broker.snapshot_port) + shard)
+          return entry
+      if broker.shards <= 1: return [json.dumps(endpoint(broker.name, 0))]
+      shard_topics = {}
+      for topic in sorted(set(topiclist)):
+          shard_topics.setdefault(shard_of(topic, broker.shards), []).append(topic)
+      return [json.dumps(dict(endpoint(f"{broker.name}-{shard}", shard), topics=topics))
+              for shard, topics in sorted(shard_topics.items())]
+    except Exception as e: handle_exception(e)
+
 """send the given message on the given socket"""
 def send_message(socket, message):
     try:
@@ -57,7 +81,7 @@ def send_message(socket, message):
     except Exception as e: handle_exception(e)
 
 """register with the discovery service"""
-def register(logger, role, name, addr, port, req, topiclist=None):
+def register(logger, role, name, addr, port, req, topiclist=None, shards=None, snapshot_port=None, lease=None):
   try:
     logger.debug("Common::register")
     # build the request message
@@ -68,29 +92,91 @@ def register(logger, role, name, addr, port, req, topiclist=None):
     register_req.id.name = name
     register_req.id.ip = addr
     register_req.id.port = port
+    if shards: register_req.id.shards = shards
+    if snapshot_port: register_req.id.snapshot_port = str(snapshot_port)
+    if lease: register_req.lease_ms = int(lease * 1000)
     disc_req.msg_type = discovery_pb2.REGISTER
     disc_req.register_req.CopyFrom(register_req)
     # send the message
     send_message(req, disc_req)
   except Exception as e: handle_exception(e)
 
-"""check if the discovery service gives the green light to proceed"""
-def is_ready(logger, req):
+"""deregister with the discovery service (so that whoever follows its registry change feed lets go of us)"""
+def deregister(logger, role, name, addr, port, req, topiclist=None):
+  try:
+    logger.debug("Common::deregister")
+    # build the request message (the same as the one we registered with)
+    disc_req = discovery_pb2.DiscoveryReq()
+    register_req = discovery_pb2.RegisterReq()
+    register_req.role = role
+    if topiclist: register_req.topiclist.extend(topiclist)
+    register_req.id.name = name
+    register_req.id.ip = addr
+    register_req.id.port = port
+    disc_req.msg_type = discovery_pb2.DEREGISTER
+    disc_req.register_req.CopyFrom(register_req)
+    # send the message
+    send_message(req, disc_req)
+  except Exception as e: handle_exception(e)
+
+"""build the registry changes (one per topic, each with the next version of that topic)
+for the given publisher being added to, removed from or registered again (from previous) in the registry"""
+def registry_changes(op, publisher, topics, versions, previous=None):
+    try:
+      changes = []
+      for topic in topics:
+          versions[topic] = versions.get(topic, 0) + 1
+          change = discovery_pb2.RegistryChange()
+          change.op = op; change.topic = topic; change.version = versions[topic]
+          change.publisher.name = publisher.name
+          change.publisher.ip = publisher.ip
+          change.publisher.port = publisher.port
+          if previous: change.previous.name = previous.name; change.previous.ip = previous.ip; change.previous.port = previous.port
+          changes.append(change)
+      return changes
+    except Exception as e: handle_exception(e)
+
+"""publish the given registry changes on a change feed (the topic and the change go in their own frames)"""
+def publish_changes(logger, feed, changes):
+    try:
+      for change in changes:
+          logger.debug(f"Common::publish_changes - {change.topic} v{change.version}: {change.op} {change.publisher.name}")
+          feed.send_multipart([change.topic.encode("utf-8"), change.SerializeToString()])
+    except Exception as e: handle_exception(e)
+
+"""check if the discovery service gives the green light to proceed
+(discovery holds on to the request for up to wait seconds if we are not ready yet)"""
+def is_ready(logger, req, wait=0):
   try:
     logger.debug("Common::is_ready")
     # build the request message
     disc_req = discovery_pb2.DiscoveryReq()
     isready_msg = discovery_pb2.IsReadyReq()
+    isready_msg.wait_ms = int(wait * 1000)
     disc_req.msg_type = discovery_pb2.ISREADY
     disc_req.is_ready.CopyFrom(isready_msg)
     # send the message
     send_message(req, disc_req)
   except Exception as e: handle_exception(e)
 
-"""disseminate the data on our pub socket"""
-def disseminate(logger, pub, data):
-    logger.debug(f"Common::disseminate - {data}")
-    try: pub.send_string(data)
+"""block until discovery gives the green light (True), or until timeout seconds pass (False).
+Each request is held by discovery for up to max_wait seconds, so we are told the moment we are ready."""
+def wait_until_ready(logger, req, event_loop, timeout=None, max_wait=10):
+  try:
+    logger.debug("Common::wait_until_ready")
+    deadline = None if timeout == None else time.time() + timeout
+    while True:
+      wait = max_wait if deadline == None else max(0, min(max_wait, deadline - time.time()))
+      is_ready(logger, req, wait)
+      # discovery answers by the end of the wait, so only give up on it a little after that
+      if event_loop(timeout=int(wait * 1000) + 5000): return True
+      if deadline != None and time.time() >= deadline: return False
+  except Exception as e: handle_exception(e)
+
+"""disseminate a publication on our pub socket (the topic and the payload bytes go in their own frames)"""
+def disseminate(logger, pub, topic, payload):
+    if logger.isEnabledFor(logging.DEBUG): logger.debug(f"Common::disseminate - {topic}: {payload}")
+    try: pub.send_multipart([topic, payload], copy=False)
     except Exception as e: handle_exception(e)
 
 """get the hash for a value"""
@@ -107,3 +193,12 @@ def hash_func(bits_hash, value):
         hash_val = int.from_bytes(hash_digest[:num_bytes], "big")
         return hash_val
     except Exception as e: handle_exception(e)
+
+"""check if the value falls between start and end on the ring (wrapping around zero)"""
+def in_range(value, start, end, include_end=False):
+    try:
+        if include_end and value == end: return True
+        # a normal interval, or one that wraps past the top of the ring
+        if start < end: return start < value < end
+        else: return value > start or value < end
+    except Exception as e: handle_exception(e)
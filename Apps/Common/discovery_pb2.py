@@ -13,7 +13,7 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0f\x64iscovery.proto\"=\n\x02ID\x12\x0f\n\x07node_id\x18\x01 \x01(\x03\x12\x0c\n\x04name\x18\x02 \x01(\t\x12\n\n\x02ip\x18\x03 \x01(\t\x12\x0c\n\x04port\x18\x04 \x01(\t\"\x93\x01\n\x0bRegisterReq\x12\x1f\n\x04role\x18\x01 \x01(\x0e\x32\x11.RegisterReq.Role\x12\x11\n\ttopiclist\x18\x02 \x03(\t\x12\x0f\n\x02id\x18\x03 \x01(\x0b\x32\x03.ID\"?\n\x04Role\x12\r\n\tPUBLISHER\x10\x00\x12\x0e\n\nSUBSCRIBER\x10\x01\x12\n\n\x06\x42ROKER\x10\x02\x12\x0c\n\x08\x44HT_NODE\x10\x03\"\xdb\x01\n\x0cRegisterResp\x12$\n\x06result\x18\x01 \x01(\x0e\x32\x14.RegisterResp.Result\x12\x13\n\x0b\x66\x61il_reason\x18\x02 \x01(\t\x12\x33\n\x0eneighbor_nodes\x18\x03 \x01(\x0b\x32\x1b.RegisterResp.NeighborNodes\x1a\x37\n\rNeighborNodes\x12\x13\n\x0bpredecessor\x18\x01 \x01(\t\x12\x11\n\tsuccessor\x18\x02 \x01(\t\"\"\n\x06Result\x12\x0b\n\x07SUCCESS\x10\x00\x12\x0b\n\x07\x46\x41ILURE\x10\x01\"\xba\x01\n\tLocateReq\x12\x15\n\x08new_node\x18\x01 \x01(\x0b\x32\x03.ID\x12(\n\ntopic_info\x18\x02 \x01(\x0b\x32\x14.LocateReq.TopicInfo\x12\x15\n\rstart_node_id\x18\x03 \x01(\x03\x1aU\n\tTopicInfo\x12\r\n\x05topic\x18\x01 \x01(\t\x12\x12\n\ntopic_hash\x18\x02 \x01(\x03\x12\x13\n\x06\x61pp_id\x18\x03 \x01(\x0b\x32\x03.ID\x12\x10\n\x08\x61pp_type\x18\x04 \x01(\t\"\x9f\x01\n\nLocateResp\x12/\n\rlocation_info\x18\x01 \x01(\x0b\x32\x18.LocateResp.LocationInfo\x12\x17\n\npublishers\x18\x02 \x03(\x0b\x32\x03.ID\x12\x0f\n\x07success\x18\x03 \x01(\x08\x1a\x36\n\x0cLocationInfo\x12\x13\n\x0bpredecessor\x18\x01 \x01(\t\x12\x11\n\tsuccessor\x18\x02 \x01(\t\"Q\n\tUpdateReq\x12\x15\n\x08new_node\x18\x01 \x01(\x0b\x32\x03.ID\x12\x16\n\x0ewhich_neighbor\x18\x02 \x01(\t\x12\x15\n\rstart_node_id\x18\x03 \x01(\x03\"\x0c\n\nIsReadyReq\"\x1c\n\x0bIsReadyResp\x12\r\n\x05reply\x18\x01 \x01(\x08\"6\n\x13LookupPubByTopicReq\x12\x0c\n\x04name\x18\x01 \x01(\t\x12\x11\n\ttopiclist\x18\x02 \x03(\t\"*\n\x14LookupPubByTopicResp\x12\x12\n\npublishers\x18\x01 \x03(\t\"\x12\n\x10LookupAllPubsReq\"\'\n\x11LookupAllPubsResp\x12\x12\n\npublishers\x18\x01 \x03(\t\"\x90\x02\n\x0c\x44iscoveryReq\x12\x1b\n\x08msg_type\x18\x01 \x01(\x0e\x32\t.MsgTypes\x12$\n\x0cregister_req\x18\x02 \x01(\x0b\x32\x0c.RegisterReqH\x00\x12\x1f\n\x08is_ready\x18\x03 \x01(\x0b\x32\x0b.IsReadyReqH\x00\x12&\n\x06topics\x18\x04 \x01(\x0b\x32\x14.LookupPubByTopicReqH\x00\x12%\n\x08pubs_req\x18\x05 \x01(\x0b\x32\x11.LookupAllPubsReqH\x00\x12 \n\nlocate_req\x18\x06 \x01(\x0b\x32\n.LocateReqH\x00\x12 \n\nupdate_req\x18\x07 \x01(\x0b\x32\n.UpdateReqH\x00\x42\t\n\x07\x43ontent\"\xf5\x01\n\rDiscoveryResp\x12\x1b\n\x08msg_type\x18\x01 \x01(\x0e\x32\t.MsgTypes\x12&\n\rregister_resp\x18\x02 \x01(\x0b\x32\r.RegisterRespH\x00\x12 \n\x08is_ready\x18\x03 \x01(\x0b\x32\x0c.IsReadyRespH\x00\x12%\n\x04resp\x18\x04 \x01(\x0b\x32\x15.LookupPubByTopicRespH\x00\x12\'\n\tpubs_resp\x18\x05 \x01(\x0b\x32\x12.LookupAllPubsRespH\x00\x12\"\n\x0blocate_resp\x18\x06 \x01(\x0b\x32\x0b.LocateRespH\x00\x42\t\n\x07\x43ontent*\xd0\x01\n\x08MsgTypes\x12\x0b\n\x07UNKNOWN\x10\x00\x12\x0c\n\x08REGISTER\x10\x01\x12\x0b\n\x07ISREADY\x10\x02\x12\x17\n\x13LOOKUP_PUB_BY_TOPIC\x10\x03\x12\x13\n\x0fLOOKUP_ALL_PUBS\x10\x04\x12\x13\n\x0fLOCATE_NEW_NODE\x10\x05\x12\x15\n\x11LOCATE_HASH_TABLE\x10\x06\x12\x1c\n\x18LOCATE_PUB_BY_TOPIC_HASH\x10\x07\x12\x13\n\x0fLOCATE_ALL_PUBS\x10\x08\x12\x0f\n\x0bUPDATE_NODE\x10\tb\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0f\x64iscovery.proto\"d\n\x02ID\x12\x0f\n\x07node_id\x18\x01 \x01(\x03\x12\x0c\n\x04name\x18\x02 \x01(\t\x12\n\n\x02ip\x18\x03 \x01(\t\x12\x0c\n\x04port\x18\x04 \x01(\t\x12\x0e\n\x06shards\x18\x05 \x01(\x03\x12\x15\n\rsnapshot_port\x18\x06 \x01(\t\"\xa5\x01\n\x0bRegisterReq\x12\x1f\n\x04role\x18\x01 \x01(\x0e\x32\x11.RegisterReq.Role\x12\x11\n\ttopiclist\x18\x02 \x03(\t\x12\x0f\n\x02id\x18\x03 \x01(\x0b\x32\x03.ID\x12\x10\n\x08lease_ms\x18\x04 \x01(\x03\"?\n\x04Role\x12\r\n\tPUBLISHER\x10\x00\x12\x0e\n\nSUBSCRIBER\x10\x01\x12\n\n\x06\x42ROKER\x10\x02\x12\x0c\n\x08\x44HT_NODE\x10\x03\"\xfb\x01\n\x0cRegisterResp\x12$\n\x06result\x18\x01 \x01(\x0e\x32\x14.RegisterResp.Result\x12\x13\n\x0b\x66\x61il_reason\x18\x02 \x01(\t\x12\x33\n\x0eneighbor_nodes\x18\x03 \x01(\x0b\x32\x1b.RegisterResp.NeighborNodes\x12\x0c\n\x04\x66\x65\x65\x64\x18\x04 \x01(\t\x12\x10\n\x08lease_ms\x18\x05 \x01(\x03\x1a\x37\n\rNeighborNodes\x12\x13\n\x0bpredecessor\x18\x01 \x01(\t\x12\x11\n\tsuccessor\x18\x02 \x01(\t\"\"\n\x06Result\x12\x0b\n\x07SUCCESS\x10\x00\x12\x0b\n\x07\x46\x41ILURE\x10\x01\"\x9d\x02\n\tLocateReq\x12\x15\n\x08new_node\x18\x01 \x01(\x0b\x32\x03.ID\x12(\n\ntopic_info\x18\x02 \x01(\x0b\x32\x14.LocateReq.TopicInfo\x12\x15\n\rstart_node_id\x18\x03 \x01(\x03\x12\x11\n\ttarget_id\x18\x04 \x01(\x03\x12)\n\x0btopic_infos\x18\x05 \x03(\x0b\x32\x14.LocateReq.TopicInfo\x12\x13\n\x0bhanding_off\x18\x06 \x01(\x08\x1a\x65\n\tTopicInfo\x12\r\n\x05topic\x18\x01 \x01(\t\x12\x12\n\ntopic_hash\x18\x02 \x01(\x03\x12\x13\n\x06\x61pp_id\x18\x03 \x01(\x0b\x32\x03.ID\x12\x10\n\x08\x61pp_type\x18\x04 \x01(\t\x12\x0e\n\x06remove\x18\x05 \x01(\x08\"\xd6\x01\n\nLocateResp\x12/\n\rlocation_info\x18\x01 \x01(\x0b\x32\x18.LocateResp.LocationInfo\x12\x17\n\npublishers\x18\x02 \x03(\x0b\x32\x03.ID\x12\x0f\n\x07success\x18\x03 \x01(\x08\x12\x11\n\x04node\x18\x04 \x01(\x0b\x32\x03.ID\x12\x11\n\treg_count\x18\x05 \x01(\x03\x12\x0f\n\x07partial\x18\x06 \x01(\x08\x1a\x36\n\x0cLocationInfo\x12\x13\n\x0bpredecessor\x18\x01 \x01(\t\x12\x11\n\tsuccessor\x18\x02 \x01(\t\"Q\n\tUpdateReq\x12\x15\n\x08new_node\x18\x01 \x01(\x0b\x32\x03.ID\x12\x16\n\x0ewhich_neighbor\x18\x02 \x01(\t\x12\x15\n\rstart_node_id\x18\x03 \x01(\x03\"\xa6\x01\n\x0eRegistryChange\x12\x1e\n\x02op\x18\x01 \x01(\x0e\x32\x12.RegistryChange.Op\x12\x16\n\tpublisher\x18\x02 \x01(\x0b\x32\x03.ID\x12\r\n\x05topic\x18\x03 \x01(\t\x12\x0f\n\x07version\x18\x04 \x01(\x03\x12\x15\n\x08previous\x18\x05 \x01(\x0b\x32\x03.ID\"%\n\x02Op\x12\x07\n\x03\x41\x44\x44\x10\x00\x12\n\n\x06REMOVE\x10\x01\x12\n\n\x06UPDATE\x10\x02\"I\n\x0eRegistryUpdate\x12 \n\x07\x63hanges\x18\x01 \x03(\x0b\x32\x0f.RegistryChange\x12\x15\n\rstart_node_id\x18\x02 \x01(\x03\"\x1c\n\tHeartbeat\x12\x0f\n\x02id\x18\x01 \x01(\x0b\x32\x03.ID\"m\n\nHandoffReq\x12\r\n\x05start\x18\x01 \x01(\x03\x12\x0b\n\x03\x65nd\x18\x02 \x01(\x03\x12\r\n\x05\x61\x66ter\x18\x03 \x01(\x03\x12\x0e\n\x06resume\x18\x04 \x01(\x08\x12\x13\n\x0bmax_entries\x18\x05 \x01(\x05\x12\x0f\n\x07release\x18\x06 \x01(\x08\"\xaf\x01\n\x0bHandoffResp\x12%\n\x07\x65ntries\x18\x01 \x03(\x0b\x32\x14.LocateReq.TopicInfo\x12,\n\x08versions\x18\x02 \x03(\x0b\x32\x1a.HandoffResp.VersionsEntry\x12\x0c\n\x04last\x18\x03 \x01(\x03\x12\x0c\n\x04\x64one\x18\x04 \x01(\x08\x1a/\n\rVersionsEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\r\n\x05value\x18\x02 \x01(\x03:\x02\x38\x01\"\x1d\n\nIsReadyReq\x12\x0f\n\x07wait_ms\x18\x01 \x01(\x03\"\x1c\n\x0bIsReadyResp\x12\r\n\x05reply\x18\x01 \x01(\x08\"6\n\x13LookupPubByTopicReq\x12\x0c\n\x04name\x18\x01 \x01(\t\x12\x11\n\ttopiclist\x18\x02 \x03(\t\"*\n\x14LookupPubByTopicResp\x12\x12\n\npublishers\x18\x01 \x03(\t\"\x12\n\x10LookupAllPubsReq\"\'\n\x11LookupAllPubsResp\x12\x12\n\npublishers\x18\x01 \x03(\t\"\x95\x03\n\x0c\x44iscoveryReq\x12\x1b\n\x08msg_type\x18\x01 \x01(\x0e\x32\t.MsgTypes\x12$\n\x0cregister_req\x18\x02 \x01(\x0b\x32\x0c.RegisterReqH\x00\x12\x1f\n\x08is_ready\x18\x03 \x01(\x0b\x32\x0b.IsReadyReqH\x00\x12&\n\x06topics\x18\x04 \x01(\x0b\x32\x14.LookupPubByTopicReqH\x00\x12%\n\x08pubs_req\x18\x05 \x01(\x0b\x32\x11.LookupAllPubsReqH\x00\x12 \n\nlocate_req\x18\x06 \x01(\x0b\x32\n.LocateReqH\x00\x12 \n\nupdate_req\x18\x07 \x01(\x0b\x32\n.UpdateReqH\x00\x12*\n\x0fregistry_update\x18\t \x01(\x0b\x32\x0f.RegistryUpdateH\x00\x12\x1f\n\theartbeat\x18\n \x01(\x0b\x32\n.HeartbeatH\x00\x12\"\n\x0bhandoff_req\x18\x0b \x01(\x0b\x32\x0b.HandoffReqH\x00\x12\x12\n\nrequest_id\x18\x08 \x01(\x03\x42\t\n\x07\x43ontent\"\xaf\x02\n\rDiscoveryResp\x12\x1b\n\x08msg_type\x18\x01 \x01(\x0e\x32\t.MsgTypes\x12&\n\rregister_resp\x18\x02 \x01(\x0b\x32\r.RegisterRespH\x00\x12 \n\x08is_ready\x18\x03 \x01(\x0b\x32\x0c.IsReadyRespH\x00\x12%\n\x04resp\x18\x04 \x01(\x0b\x32\x15.LookupPubByTopicRespH\x00\x12\'\n\tpubs_resp\x18\x05 \x01(\x0b\x32\x12.LookupAllPubsRespH\x00\x12\"\n\x0blocate_resp\x18\x06 \x01(\x0b\x32\x0b.LocateRespH\x00\x12$\n\x0chandoff_resp\x18\x08 \x01(\x0b\x32\x0c.HandoffRespH\x00\x12\x12\n\nrequest_id\x18\x07 \x01(\x03\x42\t\n\x07\x43ontent*\xbd\x02\n\x08MsgTypes\x12\x0b\n\x07UNKNOWN\x10\x00\x12\x0c\n\x08REGISTER\x10\x01\x12\x0b\n\x07ISREADY\x10\x02\x12\x17\n\x13LOOKUP_PUB_BY_TOPIC\x10\x03\x12\x13\n\x0fLOOKUP_ALL_PUBS\x10\x04\x12\x13\n\x0fLOCATE_NEW_NODE\x10\x05\x12\x15\n\x11LOCATE_HASH_TABLE\x10\x06\x12\x1c\n\x18LOCATE_PUB_BY_TOPIC_HASH\x10\x07\x12\x13\n\x0fLOCATE_ALL_PUBS\x10\x08\x12\x0f\n\x0bUPDATE_NODE\x10\t\x12\x14\n\x10LOCATE_SUCCESSOR\x10\n\x12\x14\n\x10LOCATE_REG_COUNT\x10\x0b\x12\x0e\n\nDEREGISTER\x10\x0c\x12\x13\n\x0fREGISTRY_CHANGE\x10\r\x12\r\n\tHEARTBEAT\x10\x0e\x12\x0b\n\x07HANDOFF\x10\x0f\x62\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
@@ -21,44 +21,60 @@ _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'discovery_pb2', _globals)
 if _descriptor._USE_C_DESCRIPTORS == False:
 
   DESCRIPTOR._options = None
-  _globals['_MSGTYPES']._serialized_start=1617
-  _globals['_MSGTYPES']._serialized_end=1825
+  _globals['_HANDOFFRESP_VERSIONSENTRY']._options = None
+  _globals['_HANDOFFRESP_VERSIONSENTRY']._serialized_options = b'8\001'
+  _globals['_MSGTYPES']._serialized_start=2631
+  _globals['_MSGTYPES']._serialized_end=2948
   _globals['_ID']._serialized_start=19
-  _globals['_ID']._serialized_end=80
-  _globals['_REGISTERREQ']._serialized_start=83
-  _globals['_REGISTERREQ']._serialized_end=230
-  _globals['_REGISTERREQ_ROLE']._serialized_start=167
-  _globals['_REGISTERREQ_ROLE']._serialized_end=230
-  _globals['_REGISTERRESP']._serialized_start=233
-  _globals['_REGISTERRESP']._serialized_end=452
-  _globals['_REGISTERRESP_NEIGHBORNODES']._serialized_start=361
-  _globals['_REGISTERRESP_NEIGHBORNODES']._serialized_end=416
-  _globals['_REGISTERRESP_RESULT']._serialized_start=418
-  _globals['_REGISTERRESP_RESULT']._serialized_end=452
-  _globals['_LOCATEREQ']._serialized_start=455
-  _globals['_LOCATEREQ']._serialized_end=641
-  _globals['_LOCATEREQ_TOPICINFO']._serialized_start=556
-  _globals['_LOCATEREQ_TOPICINFO']._serialized_end=641
-  _globals['_LOCATERESP']._serialized_start=644
-  _globals['_LOCATERESP']._serialized_end=803
-  _globals['_LOCATERESP_LOCATIONINFO']._serialized_start=749
-  _globals['_LOCATERESP_LOCATIONINFO']._serialized_end=803
-  _globals['_UPDATEREQ']._serialized_start=805
-  _globals['_UPDATEREQ']._serialized_end=886
-  _globals['_ISREADYREQ']._serialized_start=888
-  _globals['_ISREADYREQ']._serialized_end=900
-  _globals['_ISREADYRESP']._serialized_start=902
-  _globals['_ISREADYRESP']._serialized_end=930
-  _globals['_LOOKUPPUBBYTOPICREQ']._serialized_start=932
-  _globals['_LOOKUPPUBBYTOPICREQ']._serialized_end=986
-  _globals['_LOOKUPPUBBYTOPICRESP']._serialized_start=988
-  _globals['_LOOKUPPUBBYTOPICRESP']._serialized_end=1030
-  _globals['_LOOKUPALLPUBSREQ']._serialized_start=1032
-  _globals['_LOOKUPALLPUBSREQ']._serialized_end=1050
-  _globals['_LOOKUPALLPUBSRESP']._serialized_start=1052
-  _globals['_LOOKUPALLPUBSRESP']._serialized_end=1091
-  _globals['_DISCOVERYREQ']._serialized_start=1094
-  _globals['_DISCOVERYREQ']._serialized_end=1366
-  _globals['_DISCOVERYRESP']._serialized_start=1369
-  _globals['_DISCOVERYRESP']._serialized_end=1614
+  _globals['_ID']._serialized_end=119
+  _globals['_REGISTERREQ']._serialized_start=122
+  _globals['_REGISTERREQ']._serialized_end=287
+  _globals['_REGISTERREQ_ROLE']._serialized_start=224
+  _globals['_REGISTERREQ_ROLE']._serialized_end=287
+  _globals['_REGISTERRESP']._serialized_start=290
+  _globals['_REGISTERRESP']._serialized_end=541
+  _globals['_REGISTERRESP_NEIGHBORNODES']._serialized_start=450
+  _globals['_REGISTERRESP_NEIGHBORNODES']._serialized_end=505
+  _globals['_REGISTERRESP_RESULT']._serialized_start=507
+  _globals['_REGISTERRESP_RESULT']._serialized_end=541
+  _globals['_LOCATEREQ']._serialized_start=544
+  _globals['_LOCATEREQ']._serialized_end=829
+  _globals['_LOCATEREQ_TOPICINFO']._serialized_start=728
+  _globals['_LOCATEREQ_TOPICINFO']._serialized_end=829
+  _globals['_LOCATERESP']._serialized_start=832
+  _globals['_LOCATERESP']._serialized_end=1046
+  _globals['_LOCATERESP_LOCATIONINFO']._serialized_start=992
+  _globals['_LOCATERESP_LOCATIONINFO']._serialized_end=1046
+  _globals['_UPDATEREQ']._serialized_start=1048
+  _globals['_UPDATEREQ']._serialized_end=1129
+  _globals['_REGISTRYCHANGE']._serialized_start=1132
+  _globals['_REGISTRYCHANGE']._serialized_end=1298
+  _globals['_REGISTRYCHANGE_OP']._serialized_start=1261
+  _globals['_REGISTRYCHANGE_OP']._serialized_end=1298
+  _globals['_REGISTRYUPDATE']._serialized_start=1300
+  _globals['_REGISTRYUPDATE']._serialized_end=1373
+  _globals['_HEARTBEAT']._serialized_start=1375
+  _globals['_HEARTBEAT']._serialized_end=1403
+  _globals['_HANDOFFREQ']._serialized_start=1405
+  _globals['_HANDOFFREQ']._serialized_end=1514
+  _globals['_HANDOFFRESP']._serialized_start=1517
+  _globals['_HANDOFFRESP']._serialized_end=1692
+  _globals['_HANDOFFRESP_VERSIONSENTRY']._serialized_start=1645
+  _globals['_HANDOFFRESP_VERSIONSENTRY']._serialized_end=1692
+  _globals['_ISREADYREQ']._serialized_start=1694
+  _globals['_ISREADYREQ']._serialized_end=1723
+  _globals['_ISREADYRESP']._serialized_start=1725
+  _globals['_ISREADYRESP']._serialized_end=1753
+  _globals['_LOOKUPPUBBYTOPICREQ']._serialized_start=1755
+  _globals['_LOOKUPPUBBYTOPICREQ']._serialized_end=1809
+  _globals['_LOOKUPPUBBYTOPICRESP']._serialized_start=1811
+  _globals['_LOOKUPPUBBYTOPICRESP']._serialized_end=1853
+  _globals['_LOOKUPALLPUBSREQ']._serialized_start=1855
+  _globals['_LOOKUPALLPUBSREQ']._serialized_end=1873
+  _globals['_LOOKUPALLPUBSRESP']._serialized_start=1875
+  _globals['_LOOKUPALLPUBSRESP']._serialized_end=1914
+  _globals['_DISCOVERYREQ']._serialized_start=1917
+  _globals['_DISCOVERYREQ']._serialized_end=2322
+  _globals['_DISCOVERYRESP']._serialized_start=2325
+  _globals['_DISCOVERYRESP']._serialized_end=2628
 # @@protoc_insertion_point(module_scope)
@@ -0,0 +1,196 @@
+###############################################
+# Author: Patrick Muradaz
+# Vanderbilt University
+# Purpose: Client side cache of pub lookups
+# Semester: Spring 2023
+###############################################
+#
+# Subscribers and brokers look up their pubs with discovery, which in the DHT
+# means hops around the ring. The cache keeps the answer to each lookup for a
+# while so that doing the same lookup again (or, with a file to keep it in,
+# again after a restart) does not have to go to discovery at all.
+#
+# An answer is fresh for ttl seconds. After that it is still handed out for up
+# to stale more seconds, but it is refreshed in the background: a refresher
+# thread (with a REQ socket of its own, as sockets stay with their thread) looks
+# up every answer that is past its ttl and, if the pubs changed, lets the owner
+# of the cache know over an inproc PAIR so it can update its connections.
+# Registry changes from discovery's feed are applied to the cached answers as
+# they come, and a refreshed answer is only kept if no change came in while it
+# was being looked up (just like discovery's own lookup cache).
+#
+# Import statements
+import sys, os, zmq, json, time, threading
+sys.path.append(os.getcwd())
+from Apps.Common.common import handle_exception
+from Apps.Common import discovery_pb2
+
+"""Endpoint Cache class"""
+class EndpointCache():
+
+  """constructor"""
+  def __init__(self, logger, ttl=30, stale=300, path=None):
+    self.logger = logger  # internal logger for print statements
+    self.ttl = ttl        # seconds an answer is used without looking it up again
+    self.stale = stale    # seconds past its ttl that an answer is still used (while it is refreshed)
+    self.path = path      # file the answers are kept in across restarts (if any)
+    self.entries = {}     # lookup key -> {"pubs": [json pub entries], "fetched": time it was looked up}
+    self.version = 0      # bumped on every registry change applied to the answers
+    self.lock = threading.Lock() # the refresher thread updates the answers too
+    self.wake = threading.Event() # wakes the refresher early (a stale answer was handed out)
+    self.changed = None   # our end of the PAIR that the refresher sends the keys of changed answers on
+    self.lookup_timeout = 5000 # ms the refresher waits on discovery before trying again later
+    self.hits = 0         # lookups answered with a fresh answer
+    self.stale_hits = 0   # lookups answered with a stale answer
+    self.misses = 0       # lookups that had to go to discovery
+    if self.path and os.path.exists(self.path): self.load()
+
+  """get the cache key for a lookup of the given topics (the same topics in any
+  order/repetition share a key) or of all of the pubs if no topics are given"""
+  def key(self, topiclist=None):
+    try:
+      if topiclist == None: return ("ALL",)
+      return ("TOPICS",) + tuple(sorted(set(topiclist)))
+    except Exception as e: handle_exception(e)
+
+  """get the answer for the given key (None if it has to be looked up)"""
+  def get(self, key):
+    try:
+      with self.lock:
+        entry = self.entries.get(key)
+        age = time.time() - entry["fetched"] if entry else None
+        if entry == None or age >= self.ttl + self.stale: self.misses += 1; pubs = None
+        elif age < self.ttl: self.hits += 1; pubs = list(entry["pubs"])
+        else:
+          # hand out what we have and let the refresher look it up again
+          self.stale_hits += 1; pubs = list(entry["pubs"])
+          self.wake.set()
+      self.logger.debug(f"EndpointCache::get - hits: {self.hits}; stale: {self.stale_hits}; misses: {self.misses}")
+      return pubs
+    except Exception as e: handle_exception(e)
+
+  """store the answer for the given key (unless a registry change came in since version,
+  None stores it no matter what) and say whether it differs from what we had"""
+  def put(self, key, pubs, version=None):
+    try:
+      with self.lock:
+        if version != None and version != self.version: return False
+        old = self.entries.get(key)
+        self.entries[key] = {"pubs": list(pubs), "fetched": time.time()}
+      if self.path: self.save()
+      return old == None or sorted(old["pubs"]) != sorted(pubs)
+    except Exception as e: handle_exception(e)
+
+  """apply a change from discovery's registry change feed to the answers that cover its topic"""
+  def apply(self, change):
+    try:
+      pub = json.dumps({"name": change.publisher.name, "ip": change.publisher.ip, "port": change.publisher.port})
+      with self.lock:
+        self.version += 1
+        for key, entry in self.entries.items():
+          if key[0] != "ALL" and change.topic not in key[1:]: continue
+          pubs = [p for p in entry["pubs"] if json.loads(p)["name"] != change.publisher.name]
+          if change.op != discovery_pb2.RegistryChange.REMOVE: pubs.append(pub)
+          entry["pubs"] = pubs
+      if self.path: self.save()
+    except Exception as e: handle_exception(e)
+
+  """start refreshing the answers in the background (looking them up with the discovery
+  service at the given address, under the given name), returning the PAIR to poll for changes"""
+  def start(self, context, discovery, name=""):
+    try:
+      self.logger.debug("EndpointCache::start")
+      self.changed = context.socket(zmq.PAIR)
+      self.changed.bind(f"inproc://endpoint-cache-{id(self)}")
+      thread = threading.Thread(target=self.refresh, args=(context, discovery, name), daemon=True)
+      thread.start()
+      return self.changed
+    except Exception as e: handle_exception(e)
+
+  """look up the answers that are past their ttl again whenever one is due (on the refresher thread)"""
+  def refresh(self, context, discovery, name):
+    try:
+      self.logger.debug("EndpointCache::refresh")
+      req = context.socket(zmq.REQ)
+      # let us send a new request even if discovery never answered the last one
+      req.setsockopt(zmq.REQ_RELAXED, 1)
+      req.setsockopt(zmq.REQ_CORRELATE, 1)
+      req.connect("tcp://" + discovery)
+      changed = context.socket(zmq.PAIR)
+      changed.connect(f"inproc://endpoint-cache-{id(self)}")
+      while True:
+        self.wake.wait(timeout=self.next_due())
+        self.wake.clear()
+        with self.lock:
+          now = time.time()
+          due = [key for key, entry in self.entries.items() if now - entry["fetched"] >= self.ttl]
+        for key in due:
+          version = self.version
+          pubs = self.lookup(req, key, name)
+          # try again a little later if discovery did not answer
+          if pubs == None: time.sleep(1); continue
+          if self.put(key, pubs, version):
+            self.logger.info(f"Refreshed lookup changed: {key}")
+            changed.send_json(list(key))
+    except Exception as e: handle_exception(e)
+
+  """get the seconds until the next answer is past its ttl"""
+  def next_due(self):
+    try:
+      with self.lock:
+        if not self.entries: return self.ttl
+        oldest = min(entry["fetched"] for entry in self.entries.values())
+      return max(0, min(self.ttl, oldest + self.ttl - time.time()))
+    except Exception as e: handle_exception(e)
+
+  """look up the answer for the given key with discovery on the given REQ socket (None if it did not answer in time)"""
+  def lookup(self, req, key, name):
+    try:
+      self.logger.debug(f"EndpointCache::lookup - {key}")
+      # build the request message
+      disc_req = discovery_pb2.DiscoveryReq()
+      if key[0] == "ALL":
+        disc_req.msg_type = discovery_pb2.LOOKUP_ALL_PUBS
+        disc_req.pubs_req.CopyFrom(discovery_pb2.LookupAllPubsReq())
+      else:
+        disc_req.msg_type = discovery_pb2.LOOKUP_PUB_BY_TOPIC
+        disc_req.topics.name = name
+        disc_req.topics.topiclist.extend(key[1:])
+      req.send(disc_req.SerializeToString())
+      if not req.poll(timeout=self.lookup_timeout): return None
+      disc_resp = discovery_pb2.DiscoveryResp()
+      disc_resp.ParseFromString(req.recv())
+      if disc_resp.msg_type == discovery_pb2.LOOKUP_ALL_PUBS: return list(disc_resp.pubs_resp.publishers)
+      return list(disc_resp.resp.publishers)
+    except Exception as e: handle_exception(e)
+
+  """get the key of an answer that the refresher found to have changed (when our PAIR has one waiting)"""
+  def recv_changed(self):
+    try: return tuple(self.changed.recv_json())
+    except Exception as e: handle_exception(e)
+
+  """write the answers to our file (next to it first so a reader never sees half of it)"""
+  def save(self):
+    try:
+      # both threads save, so hold on to the lock until the file is in place
+      with self.lock:
+        entries = [{"key": list(key), "pubs": entry["pubs"], "fetched": entry["fetched"]} for key, entry in self.entries.items()]
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path + ".tmp", "w") as f: json.dump(entries, f)
+        os.replace(self.path + ".tmp", self.path)
+    except Exception as e: handle_exception(e)
+
+  """read the answers kept in our file (a file we cannot read is ignored)"""
+  def load(self):
+    try:
+      try:
+        with open(self.path) as f: entries = json.load(f)
+      except ValueError: return self.logger.warning(f"Ignoring unreadable lookup cache: {self.path}")
+      for entry in entries: self.entries[tuple(entry["key"])] = {"pubs": entry["pubs"], "fetched": entry["fetched"]}
+      self.logger.info(f"Loaded {len(self.entries)} cached lookup(s) from: {self.path}")
+    except Exception as e: handle_exception(e)
+
+  """get the hit/miss counters"""
+  def stats(self):
+    try: return {"hits": self.hits, "stale_hits": self.stale_hits, "misses": self.misses, "entries": len(self.entries)}
+    except Exception as e: handle_exception(e)
@@ -0,0 +1,81 @@
+###############################################
+# Author: Patrick Muradaz
+# Vanderbilt University
+# Purpose: Keeps the lease of a registration with discovery alive
+# Semester: Spring 2023
+###############################################
+#
+# A registration with a lease is dropped by discovery (and subscribers/brokers
+# let go of us through its change feed) unless it hears from us before the lease
+# is up. So we send a heartbeat a few times per lease, from a thread of our own
+# (with a REQ socket of its own, as sockets stay with their thread) so that it
+# keeps going no matter how busy the app is. If discovery no longer knows us (our
+# lease ran out anyway, or discovery was restarted) we register again.
+#
+# Import statements
+import sys, os, zmq, threading
+sys.path.append(os.getcwd())
+from Apps.Common.common import handle_exception, register
+from Apps.Common import discovery_pb2
+
+"""Heartbeat class"""
+class Heartbeat():
+
+  """constructor"""
+  def __init__(self, logger, role, name, addr, port, topiclist, lease):
+    self.logger = logger    # internal logger for print statements
+    self.role = role        # our role in the registration
+    self.name = name        # the name we registered under
+    self.addr = addr        # the IP address we registered
+    self.port = port        # the port we registered
+    self.topiclist = topiclist # the topics we registered
+    self.lease = lease      # seconds our registration lasts without a heartbeat
+    self.interval = lease / 3 # seconds between heartbeats (so one or two can get lost)
+    self.stopped = threading.Event() # set once we should stop
+    self.thread = None      # the thread the heartbeats are sent from
+
+  """start sending heartbeats to the discovery service at the given address"""
+  def start(self, context, discovery):
+    try:
+      self.logger.debug("Heartbeat::start")
+      self.thread = threading.Thread(target=self.run, args=(context, discovery), daemon=True)
+      self.thread.start()
+    except Exception as e: handle_exception(e)
+
+  """stop sending heartbeats (before deregistering, or we would register again)"""
+  def stop(self):
+    try:
+      self.logger.debug("Heartbeat::stop")
+      self.stopped.set()
+      if self.thread: self.thread.join()
+    except Exception as e: handle_exception(e)
+
+  """send a heartbeat every interval until we are stopped (on our own thread)"""
+  def run(self, context, discovery):
+    try:
+      req = context.socket(zmq.REQ)
+      # let us send a new request even if discovery never answered the last one
+      req.setsockopt(zmq.REQ_RELAXED, 1)
+      req.setsockopt(zmq.REQ_CORRELATE, 1)
+      req.setsockopt(zmq.LINGER, 0)
+      req.connect("tcp://" + discovery)
+      while not self.stopped.wait(self.interval):
+        # build the heartbeat message
+        disc_req = discovery_pb2.DiscoveryReq()
+        disc_req.msg_type = discovery_pb2.HEARTBEAT
+        disc_req.heartbeat.id.name = self.name
+        disc_req.heartbeat.id.ip = self.addr
+        disc_req.heartbeat.id.port = self.port
+        req.send(disc_req.SerializeToString())
+        if not req.poll(timeout=int(self.interval * 1000)):
+          self.logger.warning("No answer to our heartbeat from discovery")
+          continue
+        disc_resp = discovery_pb2.DiscoveryResp()
+        disc_resp.ParseFromString(req.recv())
+        if disc_resp.register_resp.result == discovery_pb2.RegisterResp().Result.FAILURE:
+          self.logger.warning(f"Our lease is gone ({disc_resp.register_resp.fail_reason}), registering again")
+          register(self.logger, self.role, self.name, self.addr, self.port, req,
+                   topiclist=self.topiclist, lease=self.lease)
+          if req.poll(timeout=int(self.interval * 1000)): req.recv()
+      req.close()
+    except Exception as e: handle_exception(e)
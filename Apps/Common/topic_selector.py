@@ -13,6 +13,10 @@
 # since we are going to publish or subscribe to a random sampling of topics,
 # we need this package
 import random
+# numpy lets us generate a whole batch of publications at once (without it
+# we fall back to generating them one at a time)
+try: import numpy as np
+except ImportError: np = None
 
 # define a helper class to hold all the topics that we support in our system
 class TopicSelector():
@@ -25,6 +29,24 @@ class TopicSelector():
   topiclist = ["weather", "humidity", "airquality", "light", "pressure", \
                "temperature", "sound", "altitude", "location"]
 
+  # how the values of each topic are generated: a choice from a list,
+  # a uniform float or a uniform int (both ends included)
+  generators = {
+    "weather": ("choice", ["sunny", "cloudy", "rainy", "foggy", "icy"]),
+    "humidity": ("uniform", 10.0, 100.0),
+    "airquality": ("choice", ["good", "smog", "poor"]),
+    "light": ("choice", ["450", "800", "1100", "1600"]), # in lumens
+    "pressure": ("randint", 870, 1084), # in millibars(lowest recorded to highest recorded)
+    "temperature": ("randint", -100, 100), # in fahrenheit
+    "sound": ("randint", 30, 95), # in decibels
+    "altitude": ("randint", 0, 40000), # in feet
+    "location": ("choice", ["America", "Europe", "Asia", "Africa", "Australia"]),
+  }
+
+  # the seed makes the (bulk) generated publications repeatable
+  def __init__(self, seed=None):
+    self.rng = np.random.default_rng(seed) if np else None
+
   # return a random subset of topics from this list, which becomes our interest
   # A publisher or subscriber application logic will invoke this method to get their
   # interest. 
@@ -37,26 +59,20 @@ class TopicSelector():
 
   # generate a publication on a given topic
   def gen_publication(self, topic):
-    if(topic == "weather"):
-      return random.choice(["sunny", "cloudy", "rainy", "foggy", "icy"])
-    elif(topic == "humidity"):
-      return str(random.uniform(10.0, 100.0))
-    elif(topic == "airquality"):
-      return random.choice(["good", "smog", "poor"])
-    elif(topic == "light"):
-      # in lumens
-      return random.choice(["450", "800", "1100", "1600"])
-    elif(topic == "pressure"):
-      # in millibars(lowest recorded to highest recorded)
-      return str(random.randint(870, 1084))
-    elif(topic == "temperature"):
-      # in fahrenheit
-      return str(random.randint(-100, 100))
-    elif(topic == "sound"):
-      # in decibels
-      return str(random.randint(30, 95))
-    elif(topic == "altitude"):
-      # in feet
-      return str(random.randint(0, 40000))
-    elif(topic == "location"):
-      return random.choice(["America", "Europe", "Asia", "Africa", "Australia"])
+    kind, *params = self.generators[topic]
+    if kind == "choice": return random.choice(params[0])
+    elif kind == "uniform": return str(random.uniform(*params))
+    else: return str(random.randint(*params))
+
+  # generate n publications on a given topic at once, ready to send (encoded, and
+  # padded or cut to size bytes if a size is given)
+  def gen_publications(self, topic, n, size=None):
+    if not self.rng:
+      payloads = [self.gen_publication(topic).encode('utf-8') for _ in range(n)]
+      return [payload.ljust(size)[:size] for payload in payloads] if size else payloads
+    kind, *params = self.generators[topic]
+    if kind == "choice": values = np.array(params[0], dtype="S")[self.rng.integers(0, len(params[0]), n)]
+    elif kind == "uniform": values = self.rng.uniform(*params, n).astype("S")
+    else: values = self.rng.integers(params[0], params[1], n, endpoint=True).astype("S")
+    if size: values = np.char.ljust(values, size).astype(f"S{size}")
+    return values.tolist()
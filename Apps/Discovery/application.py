@@ -125,7 +125,21 @@ def parseCmdLineArgs():
     help="configuration file (default: Apps/Common/config.ini)"
   )
   parser.add_argument(
-    "-l", "--loglevel", type=int, default=logging.INFO, 
+    "--state-dir", default=None,
+    help="directory to keep a log and snapshots of our registry in, so that a restart " +
+      "picks up where we left off (default: none, the registry is lost on restart)"
+  )
+  parser.add_argument(
+    "--snapshot-every", type=int, default=1000,
+    help="registry changes logged before the log is compacted into a snapshot (default: 1000)"
+  )
+  parser.add_argument(
+    "--fsync", action="store_true",
+    help="sync every logged registry change to disk, so that it survives the machine going " +
+      "down and not just us (default: off)"
+  )
+  parser.add_argument(
+    "-l", "--loglevel", type=int, default=logging.INFO,
     choices=[
       logging.DEBUG,logging.INFO,logging.WARNING,
       logging.ERROR,logging.CRITICAL
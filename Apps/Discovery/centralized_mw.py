@@ -5,12 +5,22 @@
 # Semester: Spring 2023
 ###############################################
 #
+# With a state directory, every change to the registry is written to a log
+# before it is applied, and the log is compacted into a snapshot every so often
+# (see registry_log.py). A restarted discovery service reads both back and picks
+# up where it left off: pubs/subs do not have to register again, the feed comes
+# back on the same port (so its followers reconnect on their own) with the
+# topic versions where they were, and leased pubs get a fresh lease to check in.
+#
 # Import statements
-import zmq, json, sys, os
+import zmq, json, sys, os, time
 sys.path.append(os.getcwd())
-from Apps.Common.common import \
-  handle_exception, format_pubs, send_message
+from Apps.Common.common import handle_exception, \
+  format_pubs, format_broker, registry_changes, publish_changes
 from Apps.Common import discovery_pb2
+from Apps.Discovery.lookup_cache import LookupCache
+from Apps.Discovery.timer_wheel import TimerWheel
+from Apps.Discovery.registry_log import RegistryLog
 
 """Discovery Middleware class"""
 class CentralizedMW():
@@ -19,7 +29,11 @@ class CentralizedMW():
     def __init__(self, logger, dissemination):
         self.dissemination = dissemination  # direct or via broker
         self.logger = logger      # internal logger for print statements
-        self.rep = None           # will be a ZMQ REP socket for discovery
+        self.router = None        # will be a ZMQ ROUTER socket for discovery
+        self.feed = None          # will be a ZMQ PUB socket for the registry change feed
+        self.feed_addr = None     # where subscribers/brokers connect to follow the feed
+        self.feed_versions = {}   # topic -> version of its last registry change
+        self.lookup_cache = None  # serialized responses to pub lookups (dropped when the registry changes)
         self.poller = None        # used to wait on incoming replies
         self.addr = None          # our advertised IP address
         self.port = None          # port num where we listen for pubs/subs
@@ -27,8 +41,16 @@ class CentralizedMW():
         self.numsubs = None       # number of subscribers to expect in the system
         self.pubs = None          # the array of publishers that are registering
         self.subs = None          # the array of subscribers that are registering
+        self.pub_entries = {}     # pub name -> serialized pub entry (as sent in lookup responses)
+        self.topic_index = {}     # topic -> {pub name -> serialized pub entry} for every pub on that topic
+        self.pub_topics = {}      # pub name -> the topics it is indexed under
         self.broker = None        # the broker to use if we are using that approach
         self.ready_sent = 0       # number of ready replys sent (will match pubs/subs)
+        self.ready_waiters = []   # pubs/subs holding an ISREADY open until we are ready (or their wait is up)
+        self.leases = {}          # pub name -> registration of every pub with a lease
+        self.lease_timers = None  # timer wheel with a timer per lease (pushed back on every heartbeat)
+        self.registry_log = None  # write-ahead log (and snapshots) of the registry, if we keep one
+        self.recovered = []       # the (kind, payload) records read back from the log on startup
 
     """configure/initialize"""
     def configure(self, args):
@@ -40,12 +62,29 @@ class CentralizedMW():
             # now set up ZMQ
             context = zmq.Context()  # Next get the ZMQ context (singleton object)
             self.poller = zmq.Poller()  # get the ZMQ poller object
-            # set up the REP socket
-            self.rep = context.socket(zmq.REP)
-            self.poller.register(self.rep, zmq.POLLIN)
+            # set up the ROUTER socket (so that ISREADY requests can be held until we are ready)
+            self.router = context.socket(zmq.ROUTER)
+            self.poller.register(self.router, zmq.POLLIN)
             bind_string = f"tcp://{self.addr}:{self.port}"
             self.logger.debug(f"CentralizedMW::configure - bound to: {bind_string}")
-            self.rep.bind(bind_string)  # bind to the REP socket
+            self.router.bind(bind_string)  # bind to the ROUTER socket
+            # read back the registry we had before a restart (it is applied once we listen)
+            if args.state_dir:
+                self.registry_log = RegistryLog(self.logger, os.path.join(args.state_dir, f"discovery-{self.port}"),
+                                                args.snapshot_every, args.fsync)
+                self.recovered = self.registry_log.recover()
+            # set up the PUB socket that registry changes go out on (on the port we had before, or whatever port is free)
+            self.feed = context.socket(zmq.PUB)
+            self.feed_addr = None
+            for kind, payload in self.recovered:
+                if kind == "feed": self.feed_addr = payload.decode()
+            try: self.feed.bind(self.feed_addr)
+            except (zmq.ZMQError, TypeError):
+                self.feed_addr = f"tcp://{self.addr}:{self.feed.bind_to_random_port(f'tcp://{self.addr}')}"
+            self.log_record("feed", self.feed_addr.encode())
+            self.logger.debug(f"CentralizedMW::configure - registry changes published on: {self.feed_addr}")
+            self.lookup_cache = LookupCache(self.logger)
+            self.lease_timers = TimerWheel(time.monotonic())
         except Exception as e: handle_exception(e)
 
     """register with the discovery service"""
@@ -54,113 +93,320 @@ class CentralizedMW():
             self.logger.debug("CentralizedMW::listen")
             self.pubs = pubs; self.subs = subs
             self.numpubs = numpubs; self.numsubs = numsubs
+            self.restore(self.recovered); self.recovered = []
             
             while True:
-                # poll for events. We give it an infinite timeout.
-                # The return value is a socket to event mask mapping
-                events = dict(self.poller.poll())
-                if self.rep in events: self.handle_message()
+                # poll for events. We wake up every second to answer ISREADYs whose wait is up
+                # (or sooner to check on the leases). The return value is a socket to event mask mapping
+                timeout = self.lease_timers.timeout(time.monotonic())
+                events = dict(self.poller.poll(timeout=1000 if timeout == None else min(1000, int(timeout * 1000) + 1)))
+                if self.router in events: self.handle_message()
+                self.expire_leases()
+                self.answer_is_ready()
+                self.compact_registry_log()
         except Exception as e: handle_exception(e)
 
     """handle an incoming message"""
     def handle_message(self):
         try:
             self.logger.debug("CentralizedMW::handle_message")
-            # let us first receive all the bytes
-            bytesRcvd = self.rep.recv()
+            # let us first receive all the frames (all but the last one say who to reply to)
+            frames = self.router.recv_multipart()
+            requester = frames[:-1]
             # now use protobuf to deserialize the bytes
             disc_req = discovery_pb2.DiscoveryReq()
-            disc_req.ParseFromString(bytesRcvd)
+            disc_req.ParseFromString(frames[-1])
             # Depending on the message type, the contents of the msg will differ
-            if (disc_req.msg_type == discovery_pb2.ISREADY): self.handle_is_ready()
-            elif (disc_req.msg_type == discovery_pb2.REGISTER): self.handle_register(disc_req.register_req)
-            elif (disc_req.msg_type == discovery_pb2.LOOKUP_ALL_PUBS): self.handle_pub_lookup(disc_req, return_all_pubs=True)
-            elif (disc_req.msg_type == discovery_pb2.LOOKUP_PUB_BY_TOPIC): self.handle_pub_lookup(disc_req, return_all_pubs=False)
+            if (disc_req.msg_type == discovery_pb2.ISREADY): self.handle_is_ready(requester, disc_req.is_ready.wait_ms)
+            elif (disc_req.msg_type == discovery_pb2.REGISTER): self.handle_register(requester, disc_req.register_req)
+            elif (disc_req.msg_type == discovery_pb2.DEREGISTER): self.handle_deregister(requester, disc_req.register_req)
+            elif (disc_req.msg_type == discovery_pb2.HEARTBEAT): self.handle_heartbeat(requester, disc_req.heartbeat)
+            elif (disc_req.msg_type == discovery_pb2.LOOKUP_ALL_PUBS): self.handle_pub_lookup(requester, disc_req, return_all_pubs=True)
+            elif (disc_req.msg_type == discovery_pb2.LOOKUP_PUB_BY_TOPIC): self.handle_pub_lookup(requester, disc_req, return_all_pubs=False)
             else: raise Exception("Unrecognized response message")
         except Exception as e: handle_exception(e)
 
-    """gives a green signal to proceed"""
-    def handle_is_ready(self):
+    """send a reply (a response message or an already serialized one) back to whoever sent us the request"""
+    def reply(self, requester, disc_resp):
+        try:
+            buf2send = disc_resp if isinstance(disc_resp, bytes) else disc_resp.SerializeToString()
+            self.router.send_multipart(requester + [buf2send])
+        except Exception as e: handle_exception(e)
+
+    """gives a green signal to proceed (holding on to the request for up to wait_ms until we are ready)"""
+    def handle_is_ready(self, requester, wait_ms):
         try:
             self.logger.debug("CentralizedMW::handle_is_ready")
-            # buiild the response message
-            disc_resp = discovery_pb2.DiscoveryResp()
-            isreadyresp_msg = discovery_pb2.IsReadyResp()
-            if len(self.pubs) == self.numpubs and len(self.subs) == self.numsubs:
-                if self.dissemination == "Direct" or (self.dissemination == "Broker" and self.broker):
-                    isreadyresp_msg.reply = True
+            self.ready_waiters.append({"requester": requester, "until": time.time() + wait_ms / 1000})
+            self.answer_is_ready()
+        except Exception as e: handle_exception(e)
+
+    """answer the pubs/subs waiting on an ISREADY (those that are not ready yet keep waiting until their wait is up)"""
+    def answer_is_ready(self):
+        try:
+            if not self.ready_waiters: return
+            # pubs that show up after the expected ones (to scale up) are followed through the change feed
+            ready = len(self.pubs) >= self.numpubs and len(self.subs) >= self.numsubs and \
+                (self.dissemination == "Direct" or (self.dissemination == "Broker" and self.broker != None))
+            waiters = self.ready_waiters; self.ready_waiters = []
+            for waiter in waiters:
+                if not ready and time.time() < waiter["until"]:
+                    self.ready_waiters.append(waiter); continue
+                # buiild the response message
+                disc_resp = discovery_pb2.DiscoveryResp()
+                isreadyresp_msg = discovery_pb2.IsReadyResp()
+                isreadyresp_msg.reply = ready
+                if ready:
                     self.logger.info("All ready message sent.")
                     self.ready_sent += 1
-                else: isreadyresp_msg.reply = False
-            else: isreadyresp_msg.reply = False
-            disc_resp.msg_type = discovery_pb2.ISREADY
-            disc_resp.is_ready.CopyFrom(isreadyresp_msg)
-            # send the message
-            send_message(self.rep, disc_resp)
+                disc_resp.msg_type = discovery_pb2.ISREADY
+                disc_resp.is_ready.CopyFrom(isreadyresp_msg)
+                # send the message
+                self.reply(waiter["requester"], disc_resp)
         except Exception as e: handle_exception(e)
 
     """handle a registration with the discovery service"""
-    def handle_register(self, register_req):
+    def handle_register(self, requester, register_req):
         try:
             self.logger.debug("CentralizedMW::handle_register")
             id = register_req.id; req_id = f"{id.name} - {id.ip}:{id.port}"
             self.logger.info(f"New registration request from: {req_id}")
 
+            # it goes in the log before it goes anywhere else
+            self.log_record("register", register_req.SerializeToString())
+            previous = self.apply_register(register_req)
             if (register_req.role == discovery_pb2.RegisterReq().Role.PUBLISHER):
-                self.logger.debug("CentralizedMW::handle_message - handle pub register")
-                self.pubs.append(register_req)
-            elif (register_req.role == discovery_pb2.RegisterReq().Role.SUBSCRIBER):
-                self.logger.debug("CentralizedMW::handle_message - handle sub register")
-                self.subs.append(register_req)
-            elif (register_req.role == discovery_pb2.RegisterReq().Role.BROKER):
-                self.logger.debug("CentralizedMW::handle_message - handle broker register")
-                self.broker = register_req
-            else: raise Exception("Unrecognized result message")
+                op = discovery_pb2.RegistryChange.UPDATE if previous else discovery_pb2.RegistryChange.ADD
+                self.publish_change(op, register_req, previous)
 
             # build the response message
             disc_resp = discovery_pb2.DiscoveryResp()
             register_resp = discovery_pb2.RegisterResp()
             register_resp.result = register_resp.Result.SUCCESS
+            if register_req.role == discovery_pb2.RegisterReq().Role.PUBLISHER: register_resp.lease_ms = register_req.lease_ms
+            # direct subscribers (and the broker) keep up with the pubs through the change feed
+            if register_req.role == discovery_pb2.RegisterReq().Role.BROKER or \
+                (register_req.role == discovery_pb2.RegisterReq().Role.SUBSCRIBER and self.dissemination == "Direct"):
+                register_resp.feed = self.feed_addr
             disc_resp.msg_type = discovery_pb2.REGISTER
             disc_resp.register_resp.CopyFrom(register_resp)
             # send the message
-            send_message(self.rep, disc_resp)
+            self.reply(requester, disc_resp)
             self.logger.info(f"Registration request handled successfully.")
+            # this may have been the registration that everyone is waiting on
+            self.answer_is_ready()
+        except Exception as e: handle_exception(e)
+
+    """handle a deregistration (only pubs are taken out of the registry, the readiness counts stay as they are)"""
+    def handle_deregister(self, requester, register_req):
+        try:
+            self.logger.debug("CentralizedMW::handle_deregister")
+            id = register_req.id
+            self.logger.info(f"Deregistration request from: {id.name} - {id.ip}:{id.port}")
+            self.log_record("deregister", register_req.SerializeToString())
+            if self.apply_deregister(register_req):
+                self.publish_change(discovery_pb2.RegistryChange.REMOVE, register_req)
+            # build the response message
+            disc_resp = discovery_pb2.DiscoveryResp()
+            disc_resp.msg_type = discovery_pb2.DEREGISTER
+            disc_resp.register_resp.result = discovery_pb2.RegisterResp().Result.SUCCESS
+            # send the message
+            self.reply(requester, disc_resp)
+        except Exception as e: handle_exception(e)
+
+    """renew the lease of a pub (failing if we do not know it, so that it registers again)"""
+    def handle_heartbeat(self, requester, heartbeat):
+        try:
+            self.logger.debug("CentralizedMW::handle_heartbeat")
+            disc_resp = discovery_pb2.DiscoveryResp()
+            disc_resp.msg_type = discovery_pb2.HEARTBEAT
+            pub = self.leases.get(heartbeat.id.name)
+            if pub:
+                self.lease_timers.schedule(pub.id.name, time.monotonic() + pub.lease_ms / 1000)
+                disc_resp.register_resp.result = discovery_pb2.RegisterResp().Result.SUCCESS
+                disc_resp.register_resp.lease_ms = pub.lease_ms
+            else:
+                disc_resp.register_resp.result = discovery_pb2.RegisterResp().Result.FAILURE
+                disc_resp.register_resp.fail_reason = "no lease for: " + heartbeat.id.name
+            self.reply(requester, disc_resp)
+        except Exception as e: handle_exception(e)
+
+    """drop the pubs whose leases ran out (they are taken out of lookups and the feed lets go of them)"""
+    def expire_leases(self):
+        try:
+            for name in self.lease_timers.advance(time.monotonic()):
+                pub = self.leases[name]
+                self.logger.info(f"Lease expired for: {name} - {pub.id.ip}:{pub.id.port}")
+                self.log_record("deregister", pub.SerializeToString())
+                if self.apply_deregister(pub):
+                    self.publish_change(discovery_pb2.RegistryChange.REMOVE, pub)
+        except Exception as e: handle_exception(e)
+
+    """apply a registration to the registry (when it comes in, and when it is read back from the log),
+    returning the registration it replaced if the pub was still registered under the same name"""
+    def apply_register(self, register_req):
+        try:
+            if (register_req.role == discovery_pb2.RegisterReq().Role.PUBLISHER):
+                self.logger.debug("CentralizedMW::handle_message - handle pub register")
+                name = register_req.id.name
+                # a pub that registers again (after a restart or a lost lease) takes the place of its old registration
+                i = next((i for i, pub in enumerate(self.pubs) if pub.id.name == name), None)
+                previous = self.pubs[i] if i != None else None
+                if i == None: self.pubs.append(register_req)
+                else: self.pubs[i] = register_req
+                registered = self.unindex_pub(name)
+                self.index_pub(register_req)
+                self.lookup_cache.invalidate()
+                # the pub stays registered for as long as it keeps up its heartbeats
+                if register_req.lease_ms:
+                    self.leases[name] = register_req
+                    self.lease_timers.schedule(name, time.monotonic() + register_req.lease_ms / 1000)
+                elif self.leases.pop(name, None): self.lease_timers.cancel(name)
+                return previous if registered else None
+            elif (register_req.role == discovery_pb2.RegisterReq().Role.SUBSCRIBER):
+                self.logger.debug("CentralizedMW::handle_message - handle sub register")
+                self.subs.append(register_req)
+            elif (register_req.role == discovery_pb2.RegisterReq().Role.BROKER):
+                self.logger.debug("CentralizedMW::handle_message - handle broker register")
+                self.broker = register_req
+                self.lookup_cache.invalidate()
+            else: raise Exception("Unrecognized result message")
+        except Exception as e: handle_exception(e)
+
+    """apply a deregistration (or an expired lease) to the registry (True if the pub was taken out of it)"""
+    def apply_deregister(self, register_req):
+        try:
+            name = register_req.id.name
+            if self.leases.pop(name, None): self.lease_timers.cancel(name)
+            if register_req.role != discovery_pb2.RegisterReq().Role.PUBLISHER or not self.unindex_pub(name): return False
+            self.lookup_cache.invalidate()
+            return True
+        except Exception as e: handle_exception(e)
+
+    """publish the change of a pub's registration on the feed (a change for each of its topics, and
+    for an update, a removal for each of the topics of its previous registration that it dropped)"""
+    def publish_change(self, op, pub, previous=None):
+        try:
+            self.logger.debug("CentralizedMW::publish_change")
+            changes = []
+            if previous:
+                dropped = [topic for topic in previous.topiclist if topic not in pub.topiclist]
+                changes = registry_changes(discovery_pb2.RegistryChange.REMOVE, previous.id, dropped, self.feed_versions)
+            changes += registry_changes(op, pub.id, pub.topiclist, self.feed_versions, previous.id if previous else None)
+            self.log_record("versions", json.dumps({change.topic: change.version for change in changes}).encode())
+            publish_changes(self.logger, self.feed, changes)
         except Exception as e: handle_exception(e)
 
     """responds with all of the requested pubs"""
-    def handle_pub_lookup(self, disc_req, return_all_pubs):
+    def handle_pub_lookup(self, requester, disc_req, return_all_pubs):
         try:
             self.logger.debug("CentralizedMW::handle_pub_lookup")
+            # answer straight from the cache if nothing has been registered since we last built this response
+            key = self.lookup_cache.key(disc_req, return_all_pubs)
+            buf2send = self.lookup_cache.get(key)
+            if buf2send != None: return self.reply(requester, buf2send)
             # build the response message
             disc_resp = discovery_pb2.DiscoveryResp()
             if return_all_pubs: 
                 pubs_msg = discovery_pb2.LookupAllPubsResp()
-                pubs_msg.publishers.extend(format_pubs(self.pubs))
+                pubs_msg.publishers.extend(self.pub_entries.values())
                 disc_resp.msg_type = discovery_pb2.LOOKUP_ALL_PUBS
                 disc_resp.pubs_resp.CopyFrom(pubs_msg)
             else:
                 matching_pubs_msg = discovery_pb2.LookupPubByTopicResp()  
-                if self.dissemination == "Broker": matching_pubs_msg.publishers.extend(format_pubs([self.broker]))
+                if self.dissemination == "Broker": matching_pubs_msg.publishers.extend(format_broker(self.broker, disc_req.topics.topiclist))
                 else: matching_pubs_msg.publishers.extend(self.get_matching_pubs(disc_req.topics))
                 disc_resp.msg_type = discovery_pb2.LOOKUP_PUB_BY_TOPIC
                 disc_resp.resp.CopyFrom(matching_pubs_msg)
-            # send the message
-            send_message(self.rep, disc_resp)
+            # send the message (and keep it for the next identical lookup)
+            buf2send = disc_resp.SerializeToString()
+            self.lookup_cache.put(key, buf2send, self.lookup_cache.version)
+            self.reply(requester, buf2send)
+        except Exception as e: handle_exception(e)
+
+    """add a registering pub to the topic index (serializing its entry once, up front)"""
+    def index_pub(self, pub):
+        try:
+          self.logger.debug("CentralizedMW::index_pub")
+          publisher = {"name": pub.id.name, "ip": pub.id.ip, "port": pub.id.port}
+          self.pub_entries[pub.id.name] = json.dumps(publisher)
+          self.pub_topics[pub.id.name] = list(dict.fromkeys(pub.topiclist))
+          for topic in pub.topiclist:
+              self.topic_index.setdefault(topic, {})[pub.id.name] = self.pub_entries[pub.id.name]
+        except Exception as e: handle_exception(e)
+
+    """take a deregistering pub out of the topic index (False if it was not in there)"""
+    def unindex_pub(self, name):
+        try:
+          self.logger.debug("CentralizedMW::unindex_pub")
+          if self.pub_entries.pop(name, None) == None: return False
+          # only the pub's own topics have it in the index
+          for topic in self.pub_topics.pop(name, []):
+              self.topic_index[topic].pop(name, None)
+              if not self.topic_index[topic]: del self.topic_index[topic]
+          return True
         except Exception as e: handle_exception(e)
 
     """gets all of the pubs that match the topiclist"""
     def get_matching_pubs(self, topics):
         try:
           self.logger.debug("CentralizedMW::get_matching_pubs")
-          # First, set up the topiclist and matching_pubs variables
-          topiclist = list(topics.topiclist); matching_pubs = []
-          # Check each pub to see if it matches the topiclist
-          for pub in self.pubs:
-              for topic in topiclist:
-                  if topic in pub.topiclist:
-                      # If the publisher matches the topiclist, add it to matches
-                      publisher = {"name": pub.id.name, "ip": pub.id.ip, "port": pub.id.port}
-                      matching_pubs.append(json.dumps(publisher)); break
-          return matching_pubs
+          # Look up each topic in the index, keeping one entry per pub
+          matching_pubs = {}
+          for topic in topics.topiclist:
+              matching_pubs.update(self.topic_index.get(topic, {}))
+          return list(matching_pubs.values())
+        except Exception as e: handle_exception(e)
+
+    """append a record to the registry log (if we keep one) before the change it records is applied"""
+    def log_record(self, kind, payload):
+        try:
+            if self.registry_log: self.registry_log.append(kind, payload)
+        except Exception as e: handle_exception(e)
+
+    """compact the registry log into a snapshot when it is time (between requests, once
+    every change that has been logged has also been applied)"""
+    def compact_registry_log(self):
+        try:
+            if self.registry_log and self.registry_log.due(): self.registry_log.compact(self.snapshot_records())
+        except Exception as e: handle_exception(e)
+
+    """get the records that rebuild the registry as it is now (for a snapshot)"""
+    def snapshot_records(self):
+        try:
+            records = [("feed", self.feed_addr.encode()), ("versions", json.dumps(self.feed_versions).encode())]
+            # every registration counts towards readiness (even those of pubs that have left since)
+            records.extend(("pub", pub.SerializeToString()) for pub in self.pubs)
+            records.extend(("sub", sub.SerializeToString()) for sub in self.subs)
+            if self.broker: records.append(("broker", self.broker.SerializeToString()))
+            # and the pubs that are still around go back in the index as they are
+            records.extend(("entry", json.dumps({"name": name, "entry": entry, "topics": self.pub_topics.get(name, [])}).encode())
+                           for name, entry in self.pub_entries.items())
+            records.extend(("lease", pub.SerializeToString()) for pub in self.leases.values())
+            return records
+        except Exception as e: handle_exception(e)
+
+    """apply the records read back from the registry log (a snapshot's and then the log's)"""
+    def restore(self, records):
+        try:
+            self.logger.debug("CentralizedMW::restore")
+            for kind, payload in records:
+                if kind in ("register", "deregister", "pub", "sub", "broker", "lease"):
+                    register_req = discovery_pb2.RegisterReq(); register_req.ParseFromString(payload)
+                if kind == "register": self.apply_register(register_req)
+                elif kind == "deregister": self.apply_deregister(register_req)
+                elif kind == "versions": self.feed_versions.update(json.loads(payload))
+                elif kind == "pub": self.pubs.append(register_req)
+                elif kind == "sub": self.subs.append(register_req)
+                elif kind == "broker": self.broker = register_req
+                elif kind == "entry":
+                    pub = json.loads(payload)
+                    self.pub_entries[pub["name"]] = pub["entry"]
+                    self.pub_topics[pub["name"]] = pub["topics"]
+                    for topic in pub["topics"]: self.topic_index.setdefault(topic, {})[pub["name"]] = pub["entry"]
+                elif kind == "lease":
+                    # a leased pub gets a whole lease from now to check back in with us
+                    self.leases[register_req.id.name] = register_req
+                    self.lease_timers.schedule(register_req.id.name, time.monotonic() + register_req.lease_ms / 1000)
+            if records: self.logger.info(f"Restored {len(self.pubs)} pub(s), {len(self.subs)} sub(s) and {len(self.pub_entries)} indexed pub(s)")
         except Exception as e: handle_exception(e)
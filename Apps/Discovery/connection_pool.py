@@ -0,0 +1,130 @@
+###############################################
+# Author: Patrick Muradaz
+# Vanderbilt University
+# Purpose: Pool of long-lived connections to other DHT nodes
+# Semester: Spring 2023
+###############################################
+#
+# Every DHT node talks to a small, stable set of other nodes (its neighbors
+# and the nodes in its finger table). Rather than paying for a new socket and
+# TCP handshake on every hop, we keep one DEALER socket per node address open
+# and reuse it. DEALER (unlike REQ) lets us have many requests in flight on the
+# same connection, and does not get stuck if a reply never shows up, so a
+# socket that times out is closed and rebuilt on next use. Replies are picked
+# up by the middleware's poller and matched to requests by request_id.
+#
+# Closing a socket throws away the replies to everything else in flight on it,
+# so we keep count of the requests waiting on each connection: a timed out
+# request only gets its socket closed once nothing else is waiting on it, and
+# busy connections are never evicted. Each socket also gets a generation, so the
+# late timeout of a request sent on an old socket leaves its replacement alone.
+#
+# Import statements
+import zmq, time, sys, os
+from collections import OrderedDict
+sys.path.append(os.getcwd())
+from Apps.Common.common import handle_exception
+
+"""Connection Pool class"""
+class ConnectionPool():
+
+    """constructor"""
+    def __init__(self, logger, context, poller, timeout=30000, idle_timeout=300, max_size=64):
+        self.logger = logger              # internal logger for print statements
+        self.context = context            # the ZMQ context to create sockets from
+        self.poller = poller              # the shared poller the sockets get registered with
+        self.timeout = timeout            # ms to wait for a reply before the node is marked unhealthy
+        self.idle_timeout = idle_timeout  # seconds a connection can go unused before it is closed
+        self.max_size = max_size          # max open connections (least recently used is closed first)
+        self.connections = OrderedDict()  # "ip:port" -> {"socket", "last_used"}
+        self.failures = {}                # "ip:port" -> number of requests in a row that went unanswered
+        self.generation = 0               # bumped for every socket we open
+
+    """get the pooled socket for the given node (connecting to it if needed)"""
+    def get(self, node):
+        try:
+            key = f"{node.ip}:{node.port}"
+            self.evict_idle()
+            if key not in self.connections:
+                # make room for the new connection if we are at capacity (the least recently used one
+                # that nothing is waiting on, we go over capacity for a while if they are all busy)
+                if len(self.connections) >= self.max_size:
+                    lru = next((lru for lru, conn in self.connections.items() if not conn["in_flight"]), None)
+                    if lru: self.close(lru)
+                socket = self.context.socket(zmq.DEALER)
+                socket.setsockopt(zmq.LINGER, 0)
+                socket.connect(f"tcp://{key}")
+                self.poller.register(socket, zmq.POLLIN)
+                self.generation += 1
+                self.connections[key] = {"socket": socket, "last_used": time.time(), "in_flight": 0, "generation": self.generation}
+                self.logger.debug(f"ConnectionPool::get - connected to: {key}")
+            self.connections.move_to_end(key)
+            self.connections[key]["last_used"] = time.time()
+            return self.connections[key]["socket"]
+        except Exception as e: handle_exception(e)
+
+    """send a serialized message to the given node (the reply arrives on the same socket) and get
+    the (ip:port, generation) of the connection it went out on, to say how the request went"""
+    def send(self, node, buf2send):
+        try:
+            socket = self.get(node)
+            # the empty frame makes a DEALER look like a REQ to the other side
+            socket.send_multipart([b"", buf2send])
+            conn = self.connections[f"{node.ip}:{node.port}"]
+            conn["in_flight"] += 1
+            return (f"{node.ip}:{node.port}", conn["generation"])
+        except Exception as e: handle_exception(e)
+
+    """get the connection a request went out on (None if it has been closed since)"""
+    def connection(self, sent_on):
+        try:
+            conn = self.connections.get(sent_on[0])
+            return conn if conn and conn["generation"] == sent_on[1] else None
+        except Exception as e: handle_exception(e)
+
+    """record that a request that went out on the given connection was answered"""
+    def succeeded(self, sent_on):
+        try:
+            self.failures[sent_on[0]] = 0
+            conn = self.connection(sent_on)
+            if conn: conn["in_flight"] -= 1
+        except Exception as e: handle_exception(e)
+
+    """record that a request that went out on the given connection was not answered in time
+    (and drop the connection, unless other requests are still waiting on it)"""
+    def failed(self, sent_on):
+        try:
+            key = sent_on[0]
+            self.failures[key] = self.failures.get(key, 0) + 1
+            self.logger.warning(f"ConnectionPool::failed - no reply from {key} ({self.failures[key]} failures)")
+            conn = self.connection(sent_on)
+            if conn == None: return
+            conn["in_flight"] -= 1
+            # closing the socket also throws away any reply that shows up late
+            if not conn["in_flight"]: self.close(key)
+        except Exception as e: handle_exception(e)
+
+    """close connections that have not been used in a while (and that nothing is waiting on)"""
+    def evict_idle(self):
+        try:
+            now = time.time()
+            idle = [key for key, conn in self.connections.items()
+                    if now - conn["last_used"] > self.idle_timeout and not conn["in_flight"]]
+            for key in idle: self.close(key)
+        except Exception as e: handle_exception(e)
+
+    """close the connection to the given "ip:port" and stop polling it"""
+    def close(self, key):
+        try:
+            conn = self.connections.pop(key, None)
+            if conn:
+                self.logger.debug(f"ConnectionPool::close - closing: {key}")
+                self.poller.unregister(conn["socket"])
+                conn["socket"].close()
+        except Exception as e: handle_exception(e)
+
+    """close every connection in the pool"""
+    def close_all(self):
+        try:
+            for key in list(self.connections): self.close(key)
+        except Exception as e: handle_exception(e)
@@ -5,12 +5,51 @@
 # Semester: Spring 2023
 ###############################################
 #
+# Every DHT node serves pubs/subs and other DHT nodes on a single ROUTER socket.
+# Requests that need another node's help are forwarded without blocking: the
+# forwarded request is tagged with a request_id and parked in our pending table
+# along with a callback that finishes the work once the reply comes back. This
+# lets a node keep serving while many lookups/registrations are in flight.
+#
+# Every node also publishes a registry change feed. The node that owns a topic
+# hash numbers the changes to the pubs of that topic (a version per topic) as it
+# stores or drops them, and passes them around the ring so that every node puts
+# them on its own feed. The subs/brokers that registered with a node follow its
+# feed to connect to (and let go of) pubs as they come and go.
+#
+# A pub's lease is kept by the node it registered with (which is also the node
+# it sends its heartbeats to). When the lease runs out, that node has the owners
+# of the pub's topics drop it, just as if the pub had deregistered.
+#
+# With a state directory, every change to our part of the registry (and to our
+# place in the ring) is written to a log before it is applied, and the log is
+# compacted into a snapshot every so often (see registry_log.py). A restarted
+# node reads both back and goes straight back to its old neighbors with its
+# hash table as it was, instead of joining the ring (and being registered with)
+# all over again. This assumes the ring has not changed around us in between.
+#
+# A node that joins the ring takes over the hashes between its predecessor and
+# itself from its successor. Once it has joined, it has its successor hand over
+# the hash table entries of that range (and the feed versions of their topics)
+# in chunks, asking for each chunk after the last hash it got. A chunk that does
+# not arrive is asked for again, and the last hash that arrived is logged, so a
+# handoff picks up where it left off (even after a restart). Entries that were
+# registered with us (or dropped by us) while the handoff was going on are not
+# overwritten by the older ones handed over. Until a hash has been handed over,
+# lookups for it get the pubs our successor still has for it added to ours. Once
+# everything is in, the successor drops the range.
+#
 # Import statements
-import zmq, sys, os
+import zmq, json, sys, os, time
 sys.path.append(os.getcwd())
 from Apps.Common.common import handle_exception, \
-    format_pubs, send_message, hash_func
+    format_pubs, format_broker, send_message, hash_func, in_range, \
+    registry_changes, publish_changes
 from Apps.Common import discovery_pb2
+from Apps.Discovery.connection_pool import ConnectionPool
+from Apps.Discovery.lookup_cache import LookupCache
+from Apps.Discovery.timer_wheel import TimerWheel
+from Apps.Discovery.registry_log import RegistryLog
 from Visualization.DHT_vis_util import write_vis_command
 
 """Discovery Middleware class"""
@@ -20,22 +59,45 @@ class DistributedMW():
     def __init__(self, logger, dissemination):
         self.dissemination = dissemination # direct or via broker
         self.logger = logger       # internal logger for print statements
-        self.rep = None            # will be a ZMQ REP socket for discovery
+        self.router = None         # will be a ZMQ ROUTER socket for discovery
+        self.feed = None           # will be a ZMQ PUB socket for the registry change feed
+        self.feed_addr = None      # where subscribers/brokers connect to follow the feed
+        self.feed_versions = {}    # topic -> version of its last registry change (for the topics we own)
         self.req = None            # will be a ZMQ REQ socket for DHT discovery
         self.poller = None         # used to wait on incoming replies
+        self.neighbor_pool = None  # long-lived connections to our neighbors and fingers
+        self.lookup_cache = None   # serialized responses to pub lookups (dropped when the registry changes)
+        self.pending = {}          # request_id -> callback and send info for requests forwarded to other nodes
+        self.last_request_id = 0   # the request_id given to the last request we forwarded
+        self.next_finger = 1       # the next finger to refresh
+        self.last_fix = 0          # the last time we refreshed a finger
+        self.deadlines = []        # gathers that give up on their missing results at a set time
+        self.lookup_timeout = 5    # seconds to wait on the owners of a subscriber's topics
         self.known_node = None     # the IP and port of the known DHT node
         self.bits_hash = None      # the number of bits that we use when hashing
         self.node_id = None        # the ID of this node in the DHT ring
         self.predecessor = None    # the info for our predecessor node
         self.successor = None      # the info for our successor node
+        self.finger_table = None   # finger i is the successor of (node_id + 2^i) on the ring
         self.addr = None           # our advertised IP address
         self.port = None           # port num where we listen for pubs/subs
         self.numpubs = None        # number of publishers to expect in the system
         self.numsubs = None        # number of subscribers to expect in the system
         self.hash_table = None     # the hash table that is used in DHT mode
         self.broker = None         # the broker to use if we are using that approach
-        self.reg_count = 0         # number of pubs/subs registered (eventually consistent across DHT)
+        self.reg_count = 0         # number of pubs/subs registered through this node
+        self.ring_count = None     # the last total of reg_counts across the ring (and when we counted it)
+        self.ready_ttl = 1         # seconds that the ring total is trusted for before recounting
+        self.ready_waiters = []    # pubs/subs holding an ISREADY open until we are ready (or their wait is up)
+        self.counting = False      # whether a count is on its way around the ring right now
         self.ready_sent = 0        # number of ready replys sent (will match pubs/subs)
+        self.leases = {}           # pub name -> registration of every pub with a lease that registered with us
+        self.lease_timers = None   # timer wheel with a timer per lease (pushed back on every heartbeat)
+        self.registry_log = None   # write-ahead log (and snapshots) of our part of the registry, if we keep one
+        self.recovered = []        # the (kind, payload) records read back from the log on startup
+        self.handoff = None        # the handoff of our range from our successor, while it is going on
+        self.handoff_chunk = 500   # hash table entries per handoff chunk
+        self.handoff_retries = 5   # times a handoff chunk is asked for before giving up on it
 
     """configure/initialize"""
     def configure(self, args):
@@ -48,18 +110,37 @@ class DistributedMW():
             # now set up ZMQ
             context = zmq.Context()  # Next get the ZMQ context (singleton object)
             self.poller = zmq.Poller() # get the ZMQ poller object
-            # set up the REP socket
-            self.rep = context.socket(zmq.REP) # Now acquire the REP socket
-            self.poller.register(self.rep, zmq.POLLIN) # register the REP socket incoming events
+            # set up the ROUTER socket
+            self.router = context.socket(zmq.ROUTER) # Now acquire the ROUTER socket
+            self.poller.register(self.router, zmq.POLLIN) # register the ROUTER socket incoming events
             bind_string = f"tcp://{self.addr}:{self.port}"
             self.logger.debug(f"DistributedMW::configure - bound to: {bind_string}")
-            self.rep.bind(bind_string) # bind to the REP socket
+            self.router.bind(bind_string) # bind to the ROUTER socket
+            # read back the registry we had before a restart (it is applied once we listen)
+            if args.state_dir:
+                self.registry_log = RegistryLog(self.logger, os.path.join(args.state_dir, f"discovery-{self.port}"),
+                                                args.snapshot_every, args.fsync)
+                self.recovered = self.registry_log.recover()
+            # set up the PUB socket that registry changes go out on (on the port we had before, or whatever port is free)
+            self.feed = context.socket(zmq.PUB)
+            self.feed_addr = None
+            for kind, payload in self.recovered:
+                if kind == "feed": self.feed_addr = payload.decode()
+            try: self.feed.bind(self.feed_addr)
+            except (zmq.ZMQError, TypeError):
+                self.feed_addr = f"tcp://{self.addr}:{self.feed.bind_to_random_port(f'tcp://{self.addr}')}"
+            self.log_record("feed", self.feed_addr.encode())
+            self.logger.debug(f"DistributedMW::configure - registry changes published on: {self.feed_addr}")
             # set up the REQ socket
             self.req = context.socket(zmq.REQ) # Now acquire the REQ socket
             self.poller.register(self.req, zmq.POLLIN) # register REQ socket for incoming events
             connect_str = "tcp://" + self.known_node # connect to the given known DHT node
             self.logger.debug(f"DistributedMW::configure - connected to: {connect_str}")
-            self.req.connect(connect_str)      
+            self.req.connect(connect_str)
+            # set up the pool of connections to other DHT nodes
+            self.neighbor_pool = ConnectionPool(self.logger, context, self.poller)
+            self.lookup_cache = LookupCache(self.logger)
+            self.lease_timers = TimerWheel(time.monotonic())
         except Exception as e: handle_exception(e)
 
 # ======================================== CORE FUNCTIONS ======================================== #
@@ -73,6 +154,17 @@ class DistributedMW():
             node_id = hash_func(self.bits_hash, to_hash)
             next_id = hash_func(self.bits_hash, self.known_node)
             result = {"node_id": node_id}
+            self.node_id = node_id
+            self.finger_table = [None] * self.bits_hash
+            # go straight back to our old neighbors if we are restarting (they still have us in the ring)
+            ring = None
+            for kind, payload in self.recovered:
+                if kind == "ring": ring = json.loads(payload)
+            if ring:
+                self.logger.info("Rejoining the DHT ring with our old neighbors...")
+                self.format_neighbors(ring["predecessor"], ring["successor"])
+                result["predecessor"] = ring["predecessor"]; result["successor"] = ring["successor"]
+                return result
             # determine if we are the fist node in the ring
             address = f"{self.addr}:{self.port}"
             if self.known_node == address: return result
@@ -93,6 +185,10 @@ class DistributedMW():
             result["predecessor"] = res.predecessor
             result["successor"] = res.successor
             self.format_neighbors(res.predecessor, res.successor)
+            self.log_ring()
+            # our successor has the entries of the range we just took over
+            self.handoff = {"start": self.predecessor.node_id, "end": node_id, "after": None}
+            self.log_record("handoff", json.dumps(self.handoff).encode())
             self.logger.debug(f"DistributedMW::register_dht - res from known node: {result}")
             return result
         except Exception as e: handle_exception(e)
@@ -103,13 +199,24 @@ class DistributedMW():
             self.logger.debug(f"DistributedMW::listen")
             self.node_id = node_id; self.hash_table = hash_table
             self.numpubs = numpubs; self.numsubs = numsubs
-            
+            self.restore(self.recovered); self.recovered = []
+            # now that we know our place in the ring, fill in our finger table
+            if self.successor: self.build_finger_table()
+            if self.handoff: self.request_handoff()
+
             while True:
                 self.logger.debug("DistributedMW::listen - LISTENING")
-                # poll for events. We give it an infinite timeout.
+                # poll for events. We wake up every second (or at the next deadline) to expire requests and fix fingers.
                 # The return value is a socket to event mask mapping
-                events = dict(self.poller.poll())
-                if self.rep in events: self.handle_message()
+                events = dict(self.poller.poll(timeout=self.poll_timeout()))
+                for socket in events:
+                    if socket == self.router: self.handle_message()
+                    elif socket != self.req: self.handle_neighbor_reply(socket)
+                self.expire_pending_requests()
+                self.expire_leases()
+                self.check_readiness()
+                self.fix_fingers()
+                self.compact_registry_log()
         except Exception as e: handle_exception(e)
 
 # ======================================== CORE HELPERS ======================================== #
@@ -117,123 +224,254 @@ class DistributedMW():
     def handle_message(self):
         try:
             self.logger.debug("DistributedMW::handle_message")
-            # let us first receive all the bytes
-            bytesRcvd = self.rep.recv()
+            # let us first receive all the frames (all but the last one say who to reply to)
+            frames = self.router.recv_multipart()
             # now use protobuf to deserialize the bytes
             disc_req = discovery_pb2.DiscoveryReq()
-            disc_req.ParseFromString(bytesRcvd)
+            disc_req.ParseFromString(frames[-1])
+            requester = {"envelope": frames[:-1], "request_id": disc_req.request_id}
             self.logger.debug(f"DistributedMW::listen - disc req: {disc_req}")
             # Depending on the message type, the contents of the msg will differ
-            if disc_req.msg_type == discovery_pb2.ISREADY: self.handle_is_ready()
-            elif disc_req.msg_type == discovery_pb2.REGISTER: self.handle_register(disc_req.register_req)
+            if disc_req.msg_type == discovery_pb2.ISREADY: self.handle_is_ready(requester, disc_req.is_ready.wait_ms)
+            elif disc_req.msg_type == discovery_pb2.REGISTER: self.handle_register(requester, disc_req.register_req)
+            elif disc_req.msg_type == discovery_pb2.DEREGISTER: self.handle_deregister(requester, disc_req.register_req)
+            elif disc_req.msg_type == discovery_pb2.HEARTBEAT: self.handle_heartbeat(requester, disc_req.heartbeat)
+            elif disc_req.msg_type == discovery_pb2.HANDOFF: self.handle_handoff(requester, disc_req.handoff_req)
+            elif disc_req.msg_type == discovery_pb2.REGISTRY_CHANGE:
+                # let the sender get on with it, the rest of the ring does not need to hold it up
+                self.respond_to_registry_update(requester)
+                self.announce_changes(disc_req.registry_update.changes, disc_req.registry_update.start_node_id)
             elif disc_req.msg_type == discovery_pb2.LOOKUP_PUB_BY_TOPIC:
                 write_vis_command('Visualization/commands.txt', 'request', disc_req.topics.name, self.node_id, 'Lookup Topic Pubs')
-                self.handle_pub_lookup(disc_req, return_all_pubs=False)
-            elif disc_req.msg_type == discovery_pb2.LOOKUP_ALL_PUBS: 
-                self.handle_pub_lookup(disc_req, return_all_pubs=True)
+                self.handle_pub_lookup(requester, disc_req, return_all_pubs=False)
+            elif disc_req.msg_type == discovery_pb2.LOOKUP_ALL_PUBS:
+                self.handle_pub_lookup(requester, disc_req, return_all_pubs=True)
             elif disc_req.msg_type == discovery_pb2.LOCATE_NEW_NODE:
                 new_node = disc_req.locate_req.new_node
-                location_info = self.determine_node_location(new_node)
-                self.handle_locate_request(location_info=location_info)
+                self.determine_node_location(new_node, lambda location_info:
+                    self.handle_locate_request(requester, location_info=location_info))
             elif disc_req.msg_type == discovery_pb2.LOCATE_HASH_TABLE:
-                topic = disc_req.locate_req.topic_info.topic
-                topic_hash = disc_req.locate_req.topic_info.topic_hash
-                app_id = disc_req.locate_req.topic_info.app_id
-                app_type = disc_req.locate_req.topic_info.app_type
-                success = self.determine_topic_location(topic, topic_hash, app_id, app_type)
-                self.handle_locate_request(success=success)
+                # a batch of topic hashes (older nodes send a single topic_info instead)
+                topic_infos = list(disc_req.locate_req.topic_infos) or [disc_req.locate_req.topic_info]
+                self.determine_topic_locations(topic_infos, lambda success:
+                    self.handle_locate_request(requester, success=bool(success)))
             elif disc_req.msg_type == discovery_pb2.LOCATE_PUB_BY_TOPIC_HASH:
                 topic_hash = disc_req.locate_req.topic_info.topic_hash
                 start_node_id = disc_req.locate_req.start_node_id
-                matching_pubs = self.get_pubs_matching_topic(topic_hash, start_node_id)
-                self.handle_locate_request(matching_pubs=matching_pubs)
+                self.get_pubs_matching_topic(topic_hash, start_node_id, lambda matching_pubs:
+                    self.handle_locate_request(requester, matching_pubs=matching_pubs or []),
+                    handing_off=disc_req.locate_req.handing_off)
             elif disc_req.msg_type == discovery_pb2.LOCATE_ALL_PUBS:
                 start_node_id = disc_req.locate_req.start_node_id
-                all_pubs = self.get_all_pubs(start_node_id)
-                self.handle_locate_request(all_pubs=all_pubs)
+                self.get_all_pubs(start_node_id, lambda all_pubs, complete=True:
+                    self.handle_locate_request(requester, all_pubs=all_pubs or [], partial=not complete))
+            elif disc_req.msg_type == discovery_pb2.LOCATE_SUCCESSOR:
+                target_id = disc_req.locate_req.target_id
+                self.find_successor(target_id, lambda node:
+                    self.handle_locate_request(requester, node=node))
+            elif disc_req.msg_type == discovery_pb2.LOCATE_REG_COUNT:
+                start_node_id = disc_req.locate_req.start_node_id
+                self.count_registrations(start_node_id, lambda reg_count:
+                    self.handle_locate_request(requester, reg_count=reg_count))
             elif disc_req.msg_type == discovery_pb2.UPDATE_NODE:
                 new_node = disc_req.update_req.new_node
                 start_node_id = disc_req.update_req.start_node_id
                 which_neighbor = disc_req.update_req.which_neighbor
-                if new_node.node_id: self.update_neighbor(which_neighbor, new_node)
-                elif new_node.name: self.register_broker(new_node, start_node_id)
-                elif start_node_id: self.update_reg_count(start_node_id)
+                # the sender waits on us, so let them know once we (and the rest of the ring) are done
+                done = lambda: self.respond_to_register(requester, None)
+                if new_node.node_id: self.update_neighbor(which_neighbor, new_node); done()
+                elif new_node.name: self.register_broker(new_node, start_node_id, done)
                 else: raise Exception("Unrecognized response message")
-                if self.node_id != start_node_id: self.respond_to_register(None)
             else: raise Exception("Unrecognized response message")
         except Exception as e: handle_exception(e)
 
-    """gives a green signal to proceed"""
-    def handle_is_ready(self):
+    """send a reply (a response message or an already serialized one) back to whoever sent us the request"""
+    def reply(self, requester, disc_resp):
+        try:
+            buf2send = disc_resp if isinstance(disc_resp, bytes) else disc_resp.SerializeToString()
+            # protobuf merges concatenated messages, so the request_id can just be tacked on the end
+            if requester["request_id"]:
+                buf2send += discovery_pb2.DiscoveryResp(request_id=requester["request_id"]).SerializeToString()
+            self.router.send_multipart(requester["envelope"] + [buf2send])
+        except Exception as e: handle_exception(e)
+
+    """gives a green signal to proceed (holding on to the request for up to wait_ms until we are ready)"""
+    def handle_is_ready(self, requester, wait_ms):
         try:
             self.logger.debug("DistributedMW::handle_is_ready")
-            # build the response message
-            disc_resp = discovery_pb2.DiscoveryResp()
-            isreadyresp_msg = discovery_pb2.IsReadyResp()
-            self.logger.debug(f"DistributedMW::handle_is_ready - rc: {self.reg_count}; np: {self.numpubs}; ns: {self.numsubs}")
-            if self.reg_count == self.numpubs + self.numsubs:
-                if self.dissemination == "Direct" or (self.dissemination == "Broker" and self.broker):
-                    isreadyresp_msg.reply = True
-                    self.logger.debug("DistributedMW::handle_is_ready - Ready message sent.")
+            self.ready_waiters.append({"requester": requester, "until": time.time() + wait_ms / 1000})
+            self.check_readiness()
+        except Exception as e: handle_exception(e)
+
+    """answer the pubs/subs waiting on an ISREADY if we can (recounting the ring when our count gets old)"""
+    def check_readiness(self):
+        try:
+            # if a count is already on its way around the ring, the waiting pubs/subs get their answer from it
+            if not self.ready_waiters or self.counting: return
+            # a recent count is good enough, otherwise add up the reg_counts of every node in one pass
+            if self.ring_count and time.time() - self.ring_count["counted"] < self.ready_ttl:
+                self.answer_is_ready(self.ring_count["reg_count"])
+            else:
+                def counted(reg_count):
+                    self.counting = False
+                    # a registration somewhere on the ring may have changed the answer to a lookup
+                    if self.ring_count and self.ring_count["reg_count"] != reg_count: self.lookup_cache.invalidate()
+                    self.ring_count = {"reg_count": reg_count, "counted": time.time()}
+                    self.answer_is_ready(reg_count)
+                self.counting = True
+                self.count_registrations(self.node_id, counted)
+        except Exception as e: handle_exception(e)
+
+    """answer the pubs/subs waiting on an ISREADY given the ring-wide reg_count
+    (those that are not ready yet keep waiting until their wait is up)"""
+    def answer_is_ready(self, reg_count):
+        try:
+            self.logger.debug(f"DistributedMW::answer_is_ready - rc: {reg_count}; np: {self.numpubs}; ns: {self.numsubs}")
+            # pubs that show up after the expected ones (to scale up) are followed through the change feed
+            ready = reg_count >= self.numpubs + self.numsubs and \
+                (self.dissemination == "Direct" or (self.dissemination == "Broker" and self.broker != None))
+            waiters = self.ready_waiters; self.ready_waiters = []
+            for waiter in waiters:
+                if not ready and time.time() < waiter["until"]:
+                    self.ready_waiters.append(waiter); continue
+                # build the response message
+                disc_resp = discovery_pb2.DiscoveryResp()
+                isreadyresp_msg = discovery_pb2.IsReadyResp()
+                isreadyresp_msg.reply = ready
+                if ready:
+                    self.logger.debug("DistributedMW::answer_is_ready - Ready message sent.")
                     self.ready_sent += 1
-                    if self.ready_sent >= self.numpubs + self.numsubs: 
+                    if self.ready_sent >= self.numpubs + self.numsubs:
                         self.logger.info("All ready messages sent!")
-                else: isreadyresp_msg.reply = False
-            else: isreadyresp_msg.reply = False
-            disc_resp.msg_type = discovery_pb2.ISREADY
-            disc_resp.is_ready.CopyFrom(isreadyresp_msg)
-            # send the message
-            send_message(self.rep, disc_resp)
+                disc_resp.msg_type = discovery_pb2.ISREADY
+                disc_resp.is_ready.CopyFrom(isreadyresp_msg)
+                # send the message
+                self.reply(waiter["requester"], disc_resp)
         except Exception as e: handle_exception(e)
 
     """handle a registration with the discovery service"""
-    def handle_register(self, register_req):
+    def handle_register(self, requester, register_req):
         try:
             self.logger.debug("DistributedMW::handle_register")
             id = register_req.id; req_id = f"{id.name} - {id.ip}:{id.port}"
             self.logger.info(f"New registration request from: {req_id}")
-            dht_info = None
+            # direct subscribers (and the broker) keep up with the pubs through our change feed
+            feed = register_req.role == discovery_pb2.RegisterReq().Role.BROKER or \
+                (register_req.role == discovery_pb2.RegisterReq().Role.SUBSCRIBER and self.dissemination == "Direct")
+            # the pub stays registered for as long as it keeps up its heartbeats (to us)
+            lease_ms = register_req.lease_ms if register_req.role == discovery_pb2.RegisterReq().Role.PUBLISHER else 0
+            if lease_ms:
+                self.log_record("lease", register_req.SerializeToString())
+                self.leases[id.name] = register_req
+                self.lease_timers.schedule(id.name, time.monotonic() + lease_ms / 1000)
+            # respond once the rest of the ring has done its part
+            def done(dht_info=None):
+                self.respond_to_register(requester, dht_info, self.feed_addr if feed else None, lease_ms)
+                self.logger.info(f"Registration request handled successfully.")
 
             if register_req.role == discovery_pb2.RegisterReq().Role.PUBLISHER:
                 write_vis_command('Visualization/commands.txt', 'configure', id.name, id.name, "publisher")
                 write_vis_command('Visualization/commands.txt', 'request', id.name, self.node_id, 'Register Publisher')
-                self.register_topic_hashes(register_req, app_type="PUB")
+                self.register_topic_hashes(register_req, "PUB", done)
             elif register_req.role == discovery_pb2.RegisterReq().Role.SUBSCRIBER:
                 write_vis_command('Visualization/commands.txt', 'configure', id.name, id.name, "subscriber")
                 write_vis_command('Visualization/commands.txt', 'request', id.name, self.node_id, 'Register Subscriber')
-                self.register_topic_hashes(register_req, app_type="SUB")
+                self.register_topic_hashes(register_req, "SUB", done)
             elif register_req.role == discovery_pb2.RegisterReq().Role.BROKER:
-                self.register_broker(register_req.id, self.node_id)
+                self.register_broker(register_req.id, self.node_id, done)
             elif register_req.role == discovery_pb2.RegisterReq().Role.DHT_NODE:
-                dht_info = self.handle_dht_register(register_req.id)
+                self.handle_dht_register(register_req.id, done)
             else: raise Exception("Unrecognized result message")
-            self.respond_to_register(dht_info)
-            self.logger.info(f"Registration request handled successfully.")
+        except Exception as e: handle_exception(e)
+
+    """handle a deregistration (only pubs are taken out of the hash table, the reg_counts stay as they are)"""
+    def handle_deregister(self, requester, register_req):
+        try:
+            self.logger.debug("DistributedMW::handle_deregister")
+            id = register_req.id
+            self.logger.info(f"Deregistration request from: {id.name} - {id.ip}:{id.port}")
+            if id.name in self.leases:
+                self.log_record("lease_end", id.name.encode())
+                self.leases.pop(id.name); self.lease_timers.cancel(id.name)
+            # respond once the owners of its topics have dropped the pub
+            def done(success=None):
+                disc_resp = discovery_pb2.DiscoveryResp()
+                disc_resp.msg_type = discovery_pb2.DEREGISTER
+                disc_resp.register_resp.result = discovery_pb2.RegisterResp().Result.SUCCESS
+                self.reply(requester, disc_resp)
+            if register_req.role == discovery_pb2.RegisterReq().Role.PUBLISHER:
+                self.determine_topic_locations(self.topic_infos(register_req, "PUB", remove=True), done)
+            else: done()
+        except Exception as e: handle_exception(e)
+
+    """renew the lease of a pub (failing if we do not know it, so that it registers again)"""
+    def handle_heartbeat(self, requester, heartbeat):
+        try:
+            self.logger.debug("DistributedMW::handle_heartbeat")
+            disc_resp = discovery_pb2.DiscoveryResp()
+            disc_resp.msg_type = discovery_pb2.HEARTBEAT
+            pub = self.leases.get(heartbeat.id.name)
+            if pub:
+                self.lease_timers.schedule(pub.id.name, time.monotonic() + pub.lease_ms / 1000)
+                disc_resp.register_resp.result = discovery_pb2.RegisterResp().Result.SUCCESS
+                disc_resp.register_resp.lease_ms = pub.lease_ms
+            else:
+                disc_resp.register_resp.result = discovery_pb2.RegisterResp().Result.FAILURE
+                disc_resp.register_resp.fail_reason = "no lease for: " + heartbeat.id.name
+            self.reply(requester, disc_resp)
+        except Exception as e: handle_exception(e)
+
+    """have the owners of their topics drop the pubs whose leases ran out (which also takes them
+    out of lookups and the feeds let go of them)"""
+    def expire_leases(self):
+        try:
+            for name in self.lease_timers.advance(time.monotonic()):
+                pub = self.leases.pop(name)
+                self.logger.info(f"Lease expired for: {name} - {pub.id.ip}:{pub.id.port}")
+                self.log_record("lease_end", name.encode())
+                self.determine_topic_locations(self.topic_infos(pub, "PUB", remove=True), lambda success: None)
         except Exception as e: handle_exception(e)
 
     """responds with all of the requested pubs"""
-    def handle_pub_lookup(self, disc_req, return_all_pubs):
+    def handle_pub_lookup(self, requester, disc_req, return_all_pubs):
         try:
             self.logger.debug(f"DistributedMW::handle_pub_lookup")
+            # answer straight from the cache if nothing has been registered since we last built this response
+            key = self.lookup_cache.key(disc_req, return_all_pubs)
+            buf2send = self.lookup_cache.get(key)
+            if buf2send != None: return self.reply(requester, buf2send)
+            version = self.lookup_cache.version
             # build the response message
             disc_resp = discovery_pb2.DiscoveryResp()
-            if return_all_pubs: 
-                pubs_msg = discovery_pb2.LookupAllPubsResp()
-                pubs_msg.publishers.extend(self.get_all_pubs(self.node_id))
-                disc_resp.msg_type = discovery_pb2.LOOKUP_ALL_PUBS
-                disc_resp.pubs_resp.CopyFrom(pubs_msg)
+            if return_all_pubs:
+                def send_all_pubs(all_pubs, complete=True):
+                    pubs_msg = discovery_pb2.LookupAllPubsResp()
+                    pubs_msg.publishers.extend(format_pubs(all_pubs or []))
+                    disc_resp.msg_type = discovery_pb2.LOOKUP_ALL_PUBS
+                    disc_resp.pubs_resp.CopyFrom(pubs_msg)
+                    buf2send = disc_resp.SerializeToString()
+                    # an answer that is missing the pubs of nodes that timed out is not kept
+                    if complete: self.lookup_cache.put(key, buf2send, version)
+                    self.reply(requester, buf2send)
+                self.get_all_pubs(self.node_id, send_all_pubs)
             else:
-                matching_pubs_msg = discovery_pb2.LookupPubByTopicResp()
-                if self.dissemination == "Broker": matching_pubs_msg.publishers.extend(format_pubs([self.broker]))
-                else: matching_pubs_msg.publishers.extend(format_pubs(self.get_pubs_matching_topics(disc_req.topics)))
-                disc_resp.msg_type = discovery_pb2.LOOKUP_PUB_BY_TOPIC
-                disc_resp.resp.CopyFrom(matching_pubs_msg)
-            # send the message
-            send_message(self.rep, disc_resp)
+                def send_matching_pubs(matching_pubs, complete=True):
+                    matching_pubs_msg = discovery_pb2.LookupPubByTopicResp()
+                    matching_pubs_msg.publishers.extend(matching_pubs)
+                    disc_resp.msg_type = discovery_pb2.LOOKUP_PUB_BY_TOPIC
+                    disc_resp.resp.CopyFrom(matching_pubs_msg)
+                    buf2send = disc_resp.SerializeToString()
+                    # an answer that is missing topics (because their owners timed out) is not kept
+                    if complete: self.lookup_cache.put(key, buf2send, version)
+                    self.reply(requester, buf2send)
+                if self.dissemination == "Broker": send_matching_pubs(format_broker(self.broker, disc_req.topics.topiclist))
+                else: self.get_pubs_matching_topics(disc_req.topics, lambda matching_pubs, complete=True:
+                    send_matching_pubs(format_pubs(matching_pubs), complete))
         except Exception as e: handle_exception(e)
 
     """handle a registration with the discovery service"""
-    def handle_locate_request(self, location_info=None, success=None, matching_pubs=None, all_pubs=None):
+    def handle_locate_request(self, requester, location_info=None, success=None, matching_pubs=None, all_pubs=None, node=None, reg_count=None,
+                              partial=False):
         try:
             self.logger.debug("DistributedMW::handle_locate_request")
             # build the response message
@@ -243,24 +481,31 @@ class DistributedMW():
                 locate_resp.location_info.predecessor = location_info["predecessor"]
                 locate_resp.location_info.successor = location_info["successor"]
                 disc_resp.msg_type = discovery_pb2.LOCATE_NEW_NODE
-            if success == False or success == True: 
+            if success == False or success == True:
                 locate_resp.success = success
                 disc_resp.msg_type = discovery_pb2.LOCATE_HASH_TABLE
-            if matching_pubs: 
+            if matching_pubs != None:
                 self.logger.debug(f"DistributedMW::handle_locate_request - matching pubs: {matching_pubs}")
                 locate_resp.publishers.extend(matching_pubs)
                 disc_resp.msg_type = discovery_pb2.LOCATE_PUB_BY_TOPIC_HASH
-            if all_pubs:
+            if all_pubs != None:
                 self.logger.debug(f"DistributedMW::handle_locate_request - all pubs: {all_pubs}")
                 locate_resp.publishers.extend(all_pubs)
+                locate_resp.partial = partial
                 self.logger.debug(f"DistributedMW::handle_locate_request - locate resp: {locate_resp}")
                 disc_resp.msg_type = discovery_pb2.LOCATE_ALL_PUBS
+            if node:
+                locate_resp.node.CopyFrom(node)
+                disc_resp.msg_type = discovery_pb2.LOCATE_SUCCESSOR
+            if reg_count != None:
+                locate_resp.reg_count = reg_count
+                disc_resp.msg_type = discovery_pb2.LOCATE_REG_COUNT
             disc_resp.locate_resp.CopyFrom(locate_resp)
             # send the message
-            send_message(self.rep, disc_resp)
+            self.reply(requester, disc_resp)
         except Exception as e: handle_exception(e)
 
-    """We need to update our neigbor (predecessor or successor) 
+    """We need to update our neigbor (predecessor or successor)
     based on the information from the requesting node (our neighbor)"""
     def update_neighbor(self, which_neighbor, new_node):
         try:
@@ -273,35 +518,41 @@ class DistributedMW():
                 self.successor = new_node
                 self.logger.info(f"New successor node: {self.format_node_info(self.successor)}")
             else: self.logger.error("Unknown neighbor type.")
+            self.log_ring()
+            self.refresh_fingers(new_node)
         except Exception as e: handle_exception(e)
 
     """register the broker with our node and tell our neighbor to do the same"""
-    def register_broker(self, broker, start_node_id):
+    def register_broker(self, broker, start_node_id, callback):
         try:
             self.logger.debug("DistributedMW::register_broker")
             # update our broker with the incoming broker
+            self.log_record("broker", broker.SerializeToString())
             self.broker = broker
-            # tell our neighbor to update their broker
-            if self.successor.node_id != start_node_id:
-                self.talk_to_neighbor(neighbor=self.successor, broker=broker, start_node_id=start_node_id)
+            self.lookup_cache.invalidate()
+            # tell our neighbor to update their broker (and call back once they are done)
+            if self.successor and self.successor.node_id != start_node_id:
+                self.talk_to_neighbor(neighbor=self.successor, broker=broker, start_node_id=start_node_id,
+                                      callback=lambda result: callback())
+            else: callback()
         except Exception as e: handle_exception(e)
 
-    """update our reg count and tell our neighbor to do the same"""
-    def update_reg_count(self, start_node_id):
+    """add up the reg_counts from us to the end of the ring pass that started at start_node_id"""
+    def count_registrations(self, start_node_id, callback):
         try:
-            self.logger.debug("DistributedMW::update_reg_count")
-            # increase our reg_count by one
-            self.reg_count += 1
-            # tell our neighbor to update their reg_count
-            print(self.successor)
-            if self.successor.node_id != start_node_id:
-                self.talk_to_neighbor(neighbor=self.successor, start_node_id=start_node_id)
+            self.logger.debug("DistributedMW::count_registrations")
+            # ask our successor for the rest of the ring's count until reaching the starting node
+            if self.successor == None or self.successor.node_id == start_node_id: callback(self.reg_count)
+            else:
+                # a node that doesn't answer just makes the total come up short (so not ready yet)
+                self.talk_to_neighbor(neighbor=self.successor, start_node_id=start_node_id, reg_count=True,
+                                      callback=lambda reg_count: callback(self.reg_count + (reg_count or 0)))
         except Exception as e: handle_exception(e)
 
 # ======================================== OTHER HELPERS ======================================== #
     """convert the node info into the proper format"""
     def format_node_info(self, node_info):
-        self.logger.debug("DistributedMW::format_node_info")        
+        self.logger.debug("DistributedMW::format_node_info")
         try: return f"{node_info.node_id}:{node_info.ip}:{node_info.port}"
         except Exception as e: handle_exception(e)
 
@@ -322,21 +573,54 @@ class DistributedMW():
             self.successor.port = split_successor[2]
         except Exception as e: handle_exception(e)
 
+    """get a callback that collects count results and then hands all of them to done
+    (or whatever has been collected so far, once timeout seconds have passed)"""
+    def gather(self, count, done, timeout=None):
+        try:
+            results = []; state = {"finished": False}
+            def finish():
+                if state["finished"]: return
+                state["finished"] = True
+                done(results)
+            def collect(result):
+                if state["finished"]: return
+                results.append(result)
+                if len(results) == count: finish()
+            if timeout: self.deadlines.append({"at": time.time() + timeout, "finish": finish, "state": state})
+            if count == 0: finish()
+            return collect
+        except Exception as e: handle_exception(e)
+
     """registers registering apps based on the hash values of their topics"""
-    def register_topic_hashes(self, register_req, app_type):
+    def register_topic_hashes(self, register_req, app_type, callback):
         try:
             self.logger.debug("DistributedMW::register_topic_hashes")
-            # iterate through each topic in the register_req topiclist
+            # once every topic is stored, count the registration here (ISREADY adds up the whole ring)
+            def topics_stored(success):
+                self.reg_count += 1
+                self.log_record("reg_count", str(self.reg_count).encode())
+                # recount right away so that anyone waiting on ISREADY hears about it
+                if self.ring_count: self.ring_count["counted"] = 0
+                callback()
+            # hash every topic in the register_req topiclist and place them all in one go
+            self.determine_topic_locations(self.topic_infos(register_req, app_type), topics_stored)
+        except Exception as e: handle_exception(e)
+
+    """get the topic infos (with the hash of each topic) to store or drop a registering app"""
+    def topic_infos(self, register_req, app_type, remove=False):
+        try:
+            topic_infos = []
             for topic in register_req.topiclist:
-                topic_hash = hash_func(self.bits_hash, topic)
-                self.determine_topic_location(topic, topic_hash, register_req.id, app_type)
-            # send commands to successor for them to update their reg_count var
-            self.reg_count += 1
-            self.talk_to_neighbor(neighbor=self.successor, start_node_id=self.node_id)
+                topic_info = discovery_pb2.LocateReq.TopicInfo()
+                topic_info.topic = topic; topic_info.topic_hash = hash_func(self.bits_hash, topic)
+                topic_info.app_type = app_type; topic_info.app_id.CopyFrom(register_req.id)
+                topic_info.remove = remove
+                topic_infos.append(topic_info)
+            return topic_infos
         except Exception as e: handle_exception(e)
 
     """handle a DHT node registration with the discovery service"""
-    def handle_dht_register(self, new_node):
+    def handle_dht_register(self, new_node, callback):
         try:
             self.logger.debug("DistributedMW::handle_dht_register")
             # Handle the case where we are the only node we know of
@@ -345,20 +629,19 @@ class DistributedMW():
                 self.predecessor = new_node; self.successor = new_node
                 self.logger.info(f"New predecessor node: {self.format_node_info(new_node)}")
                 self.logger.info(f"New successor node: {self.format_node_info(new_node)}")
+                self.log_ring()
+                self.refresh_fingers(new_node)
                 # We are both their predecessor and successor
                 predecessor = f"{self.node_id}:{self.addr}:{self.port}"
                 successor = f"{self.node_id}:{self.addr}:{self.port}"
-            else:
-                # Find out where to fit this node into the ring
-                location_info = self.determine_node_location(new_node)
-                predecessor = location_info["predecessor"]
-                successor = location_info["successor"]
-            # Return the predecessor and successor info to the new node
-            return {"predecessor": predecessor, "successor": successor}
+                # Return the predecessor and successor info to the new node
+                callback({"predecessor": predecessor, "successor": successor})
+            # Find out where to fit this node into the ring
+            else: self.determine_node_location(new_node, callback)
         except Exception as e: handle_exception(e)
 
     """responds to a registration request"""
-    def respond_to_register(self, dht_info):
+    def respond_to_register(self, requester, dht_info, feed=None, lease_ms=0):
         try:
             self.logger.debug("DistributedMW::respond_to_register")
             # build the response message
@@ -369,14 +652,25 @@ class DistributedMW():
               self.logger.debug(f"DistributedMW::respond_to_register - dht_info: {dht_info}")
               register_resp.neighbor_nodes.predecessor = dht_info["predecessor"]
               register_resp.neighbor_nodes.successor = dht_info["successor"]
+            if feed: register_resp.feed = feed
+            register_resp.lease_ms = lease_ms
             disc_resp.msg_type = discovery_pb2.REGISTER
             disc_resp.register_resp.CopyFrom(register_resp)
             # send the message
-            send_message(self.rep, disc_resp)
+            self.reply(requester, disc_resp)
+        except Exception as e: handle_exception(e)
+
+    """lets the node that passed on registry changes know that we got them"""
+    def respond_to_registry_update(self, requester):
+        try:
+            self.logger.debug("DistributedMW::respond_to_registry_update")
+            disc_resp = discovery_pb2.DiscoveryResp()
+            disc_resp.msg_type = discovery_pb2.REGISTRY_CHANGE
+            self.reply(requester, disc_resp)
         except Exception as e: handle_exception(e)
 
     """run the event loop where we expect to receive a reply to a sent request"""
-    def event_loop(self, neighbor_req=None):
+    def event_loop(self):
         try:
             self.logger.debug("DistributedMW::event_loop")
             while True:
@@ -386,20 +680,18 @@ class DistributedMW():
                 events = dict(self.poller.poll())
                 self.logger.debug(f"DistributedMW::event_loop - events: {events}")
                 if self.req in events: return self.handle_reply()
-                if neighbor_req and neighbor_req in events: 
-                    return self.handle_reply(neighbor_req)
         except Exception as e: handle_exception(e)
 
     """handle an incoming reply to a sent request"""
-    def handle_reply(self, neighbor_req=None):
+    def handle_reply(self, disc_resp=None):
         try:
             self.logger.debug("DistributedMW::handle_reply")
-            # let us first receive all the bytes
-            if neighbor_req: bytesRcvd = neighbor_req.recv()
-            else: bytesRcvd = self.req.recv()
-            # now use protobuf to deserialize the bytes
-            disc_resp = discovery_pb2.DiscoveryResp()
-            disc_resp.ParseFromString(bytesRcvd)
+            # let us first receive all the bytes (unless a neighbor's reply was already parsed)
+            if disc_resp == None:
+                bytesRcvd = self.req.recv()
+                # now use protobuf to deserialize the bytes
+                disc_resp = discovery_pb2.DiscoveryResp()
+                disc_resp.ParseFromString(bytesRcvd)
             self.logger.debug(f"DistributedMW::handle_reply - disc_resp: {disc_resp}")
             # Depending on the message type, the contents of the msg will differ
             if disc_resp.msg_type == discovery_pb2.REGISTER:
@@ -410,146 +702,203 @@ class DistributedMW():
                 return disc_resp.locate_resp.location_info
             elif disc_resp.msg_type == discovery_pb2.LOCATE_HASH_TABLE:
                 return disc_resp.locate_resp.success
-            elif disc_resp.msg_type == discovery_pb2.LOCATE_PUB_BY_TOPIC_HASH or \
-                disc_resp.msg_type == discovery_pb2.LOCATE_ALL_PUBS:
+            elif disc_resp.msg_type == discovery_pb2.LOCATE_PUB_BY_TOPIC_HASH:
                 return disc_resp.locate_resp.publishers
+            elif disc_resp.msg_type == discovery_pb2.LOCATE_ALL_PUBS:
+                # along with whether every node from there to the end of the ring pass answered
+                return disc_resp.locate_resp.publishers, not disc_resp.locate_resp.partial
+            elif disc_resp.msg_type == discovery_pb2.LOCATE_SUCCESSOR:
+                return disc_resp.locate_resp.node
+            elif disc_resp.msg_type == discovery_pb2.LOCATE_REG_COUNT:
+                return disc_resp.locate_resp.reg_count
+            elif disc_resp.msg_type == discovery_pb2.REGISTRY_CHANGE:
+                return True
+            elif disc_resp.msg_type == discovery_pb2.HANDOFF:
+                return disc_resp.handoff_resp
             else: raise Exception("Unrecognized response message")
         except Exception as e: handle_exception(e)
 
     """Determine where the new node belongs. Update nodes in the ring in the process."""
-    def determine_node_location(self, new_node):
+    def determine_node_location(self, new_node, callback):
         try:
             self.logger.debug(f"DistributedMW::determine_node_location")
+            # every node that sees the new node on its way around the ring learns about it
+            self.refresh_fingers(new_node)
             # If the new_node ID is between our predecessor and us...
-            if ((self.predecessor.node_id < new_node.node_id < self.node_id) or
-                ((self.predecessor.node_id > self.node_id) and
-               (new_node.node_id < self.node_id or new_node.node_id > self.predecessor.node_id))):
-                # We tell our old predecessor to set this as their new successor
-                self.talk_to_neighbor(neighbor=self.predecessor, new_node=new_node, which_neighbor="successor")
+            if in_range(new_node.node_id, self.predecessor.node_id, self.node_id):
                 # Our old predecessor becomes the new nodes predecessor
                 predecessor = f"{self.predecessor.node_id}:{self.predecessor.ip}:{self.predecessor.port}"
+                # We become the new nodes successor
+                successor = f"{self.node_id}:{self.addr}:{self.port}"
+                # We tell our old predecessor to set this as their new successor
+                self.talk_to_neighbor(neighbor=self.predecessor, new_node=new_node, which_neighbor="successor",
+                                      callback=lambda result: callback({"predecessor": predecessor, "successor": successor}))
                 # The new node becomes our new predecessor
                 self.predecessor = new_node
                 self.logger.info(f"New predecessor node: {self.format_node_info(self.predecessor)}")
-                # We become the new nodes successor
-                successor = f"{self.node_id}:{self.addr}:{self.port}"
+                self.log_ring()
             # If the new_node ID is between us and our successor
-            elif ((self.node_id < new_node.node_id < self.successor.node_id) or
-                  ((self.successor.node_id < self.node_id) and
-                   (new_node.node_id > self.node_id or new_node.node_id < self.successor.node_id))):
-                # We tell our successor to set this as their new predecessor
-                self.talk_to_neighbor(neighbor=self.successor, new_node=new_node, which_neighbor="predecessor")
+            elif in_range(new_node.node_id, self.node_id, self.successor.node_id):
                 # We become the new nodes predecessor
                 predecessor = f"{self.node_id}:{self.addr}:{self.port}"
+                # Our old successor becomes the new nodes successor
+                successor = f"{self.successor.node_id}:{self.successor.ip}:{self.successor.port}"
+                # We tell our successor to set this as their new predecessor
+                self.talk_to_neighbor(neighbor=self.successor, new_node=new_node, which_neighbor="predecessor",
+                                      callback=lambda result: callback({"predecessor": predecessor, "successor": successor}))
                 # The new node becomes our new successor
                 self.successor = new_node
                 self.logger.info(f"New successor node: {self.format_node_info(self.successor)}")
-                # Our old successor becomes the new nodes successor
-                successor = f"{self.successor.node_id}:{self.successor.ip}:{self.successor.port}"
-            # If the new_node ID is below our predecessor...
-            elif new_node.node_id < self.predecessor.node_id:
-                # recursively iterate through the ring and return the result once it is found
-                location_info = self.talk_to_neighbor(neighbor=self.predecessor, new_node=new_node)
-                print(location_info)
-                predecessor = location_info.predecessor
-                successor = location_info.successor
-            # If the new_node is greater than our successor
-            else:
-                # recursively iterate through the ring and return the result once it is found
-                location_info = self.talk_to_neighbor(neighbor=self.successor, new_node=new_node)
-                predecessor = location_info.predecessor
-                successor = location_info.successor
-            return {"predecessor": predecessor, "successor": successor}
-        except Exception as e: handle_exception(e)
-
-    """Determine the proper node to store this hashed topic pub/sub in. 
-    Then use helper function to push the registering app to the hash_table on that node."""
-    def determine_topic_location(self, topic, topic_hash, app_id, app_type):
-        try:
-            self.logger.debug(f"DistributedMW::determine_topic_location")
-            topic_info = discovery_pb2.LocateReq().topic_info
-            # If the topic_hash is between our predecessor and us then we store it in our table
-            if ((self.predecessor and self.predecessor.node_id < topic_hash < self.node_id) or
-                ((self.predecessor.node_id > self.node_id) and
-               (topic_hash < self.node_id or topic_hash > self.predecessor.node_id))):
-                self.add_to_hash_table(topic_hash, app_id, app_type)
-                self.logger.debug(f"DistributedMW::determine_topic_location - stored {app_type}:{app_id.name} in hash table")
-                if topic: write_vis_command('Visualization/commands.txt', 'save', self.node_id, self.node_id, topic)
-                return True
+                self.log_ring()
+            # Otherwise jump as close to the new node as our finger table lets us
             else:
-                topic_info.topic = topic; topic_info.topic_hash = topic_hash 
-                topic_info.app_type = app_type; topic_info.app_id.name = app_id.name 
-                topic_info.app_id.ip = app_id.ip; topic_info.app_id.port = app_id.port
-                # If the topic_hash is below our predecessor then pass down
-                if topic_hash < self.predecessor.node_id:
-                    # recursively iterate through the ring and return the result once it is found
-                    result = self.talk_to_neighbor(neighbor=self.predecessor, topic_info=topic_info)
-                # If the topic_hash is greater than our successor then pass up
+                # recursively iterate through the ring and pass on the result once it is found
+                def located(location_info):
+                    if location_info: callback({"predecessor": location_info.predecessor, "successor": location_info.successor})
+                    else: callback(None)
+                self.talk_to_neighbor(neighbor=self.closest_preceding_node(new_node.node_id), new_node=new_node, callback=located)
+        except Exception as e: handle_exception(e)
+
+    """Determine the proper node to store each hashed topic pub/sub in. We store the ones
+    that we own and forward the rest in one batch per next hop (who split them up further)."""
+    def determine_topic_locations(self, topic_infos, callback):
+        try:
+            self.logger.debug(f"DistributedMW::determine_topic_locations")
+            batches = {}; changes = []
+            for topic_info in topic_infos:
+                # If the topic_hash is between our predecessor and us then we store (or drop) it in our table
+                if self.owns(topic_info.topic_hash):
+                    self.log_record("topic", topic_info.SerializeToString())
+                    if topic_info.remove: self.remove_from_hash_table(topic_info.topic_hash, topic_info.app_id, topic_info.app_type)
+                    else: self.add_to_hash_table(topic_info.topic_hash, topic_info.app_id, topic_info.app_type)
+                    self.logger.debug(f"DistributedMW::determine_topic_locations - {'dropped' if topic_info.remove else 'stored'} {topic_info.app_type}:{topic_info.app_id.name} in hash table")
+                    if topic_info.topic and not topic_info.remove: write_vis_command('Visualization/commands.txt', 'save', self.node_id, self.node_id, topic_info.topic)
+                    # as the owner of the topic we number its changes for the feed
+                    if topic_info.app_type == "PUB" and topic_info.topic:
+                        op = discovery_pb2.RegistryChange.REMOVE if topic_info.remove else discovery_pb2.RegistryChange.ADD
+                        changes.extend(registry_changes(op, topic_info.app_id, [topic_info.topic], self.feed_versions))
+                # otherwise group it with the other hashes that go through the same node
                 else:
-                    # recursively iterate through the ring and return the result once it is found
-                    result = self.talk_to_neighbor(neighbor=self.successor, topic_info=topic_info)
-                self.logger.debug(f"DistributedMW::determine_topic_location - success: {result}")
-                return result
+                    neighbor = self.next_hop(topic_info.topic_hash)
+                    batch = batches.setdefault(self.format_node_info(neighbor), {"neighbor": neighbor, "topic_infos": []})
+                    batch["topic_infos"].append(topic_info)
+            if changes:
+                self.log_record("versions", json.dumps({change.topic: change.version for change in changes}).encode())
+                self.announce_changes(changes, self.node_id)
+            # pass on the result once every batch has been stored by its owners
+            stored = self.gather(len(batches), lambda results: callback(all(results)))
+            for batch in batches.values():
+                self.talk_to_neighbor(neighbor=batch["neighbor"], topic_infos=batch["topic_infos"], callback=stored)
         except Exception as e: handle_exception(e)
 
     """adds a registering app to the hash_table on this node"""
     def add_to_hash_table(self, topic_hash, app_id, app_type):
         try:
             self.logger.debug(f"DistributedMW::add_to_hash_table")
+            self.lookup_cache.invalidate()
             if topic_hash not in self.hash_table:
                 self.hash_table[topic_hash] = {}
             if app_type in self.hash_table[topic_hash]:
-                self.hash_table[topic_hash][app_type].append(app_id)
+                # an app that registers again (after its lease ran out somewhere) is only kept once
+                apps = self.hash_table[topic_hash][app_type]
+                apps[:] = [app for app in apps if app.name != app_id.name or not app.name]
+                apps.append(app_id)
             else:
                 self.hash_table[topic_hash][app_type] = [app_id]
         except Exception as e: handle_exception(e)
 
+    """takes a deregistering app out of the hash_table on this node"""
+    def remove_from_hash_table(self, topic_hash, app_id, app_type):
+        try:
+            self.logger.debug(f"DistributedMW::remove_from_hash_table")
+            self.lookup_cache.invalidate()
+            apps = self.hash_table.get(topic_hash, {}).get(app_type)
+            if apps: apps[:] = [app for app in apps if app.name != app_id.name]
+            # an entry dropped while our range is being handed to us stays dropped
+            if self.handoff: self.handoff.setdefault("removed", set()).add((topic_hash, app_type, app_id.name))
+        except Exception as e: handle_exception(e)
+
+    """publish registry changes on our feed and pass them on around the ring (until they are
+    back at the node they started from, which is the owner of their topics)"""
+    def announce_changes(self, changes, start_node_id):
+        try:
+            self.logger.debug("DistributedMW::announce_changes")
+            publish_changes(self.logger, self.feed, changes)
+            # whatever lookups we answered before may have a pub too many (or too few) now
+            self.lookup_cache.invalidate()
+            if self.successor == None or self.successor.node_id == start_node_id: return
+            disc_req = discovery_pb2.DiscoveryReq()
+            disc_req.msg_type = discovery_pb2.REGISTRY_CHANGE
+            disc_req.registry_update.changes.extend(changes)
+            disc_req.registry_update.start_node_id = start_node_id
+            self.send_to_node(self.successor, disc_req, lambda result: None)
+        except Exception as e: handle_exception(e)
+
     """get all of the pubs in the ring that publish on any of the given topics"""
-    def get_pubs_matching_topics(self, topics):
-        try: 
+    def get_pubs_matching_topics(self, topics, callback):
+        try:
             self.logger.debug("DistributedMW::get_pubs_matching_topics")
-            # First, set up the topiclist and matching_pubs variables
-            topiclist = list(topics.topiclist); matching_pubs = []
-            # Check each sub topic to see if we have a pub for it
-            for topic in topiclist:
-                topic_hash = hash_func(self.bits_hash, topic)
-                matching_pubs.extend(self.get_pubs_matching_topic(topic_hash, self.node_id))
-            return matching_pubs
-        except Exception as e: handle_exception(e)
-    
-    """get the pubs that publish on the given topic"""
-    def get_pubs_matching_topic(self, topic_hash, start_node_id):
-        try: 
+            # First, set up the topic hashes (a topic listed twice is only looked up once)
+            topic_hashes = dict.fromkeys(hash_func(self.bits_hash, topic) for topic in topics.topiclist)
+            # merge the pubs from every topic that answered in time, keeping one entry per pub
+            def merge(results):
+                matching_pubs = {}
+                for pubs in results:
+                    for pub in pubs or []: matching_pubs.setdefault(pub.name, pub)
+                self.logger.debug(f"DistributedMW::get_pubs_matching_topics - {len(results)}/{len(topic_hashes)} topics answered")
+                complete = len(results) == len(topic_hashes) and None not in results
+                callback(list(matching_pubs.values()), complete)
+            # Ask the owners of every sub topic for their pubs all at once
+            found = self.gather(len(topic_hashes), merge, timeout=self.lookup_timeout)
+            for topic_hash in topic_hashes:
+                self.get_pubs_matching_topic(topic_hash, self.node_id, found)
+        except Exception as e: handle_exception(e)
+
+    """get the pubs that publish on the given topic (from our own hash table when the node that is
+    taking the hash over from us is asking, as it does not have all of them yet)"""
+    def get_pubs_matching_topic(self, topic_hash, start_node_id, callback, handing_off=False):
+        try:
             self.logger.debug("DistributedMW::get_pubs_matching_topic")
-            if topic_hash in self.hash_table and 'PUB' in self.hash_table[topic_hash]:
-                return self.hash_table[topic_hash]['PUB']
-            elif start_node_id == self.successor.node_id:
-                return []
-            elif topic_hash < self.node_id:
-                # add to the list of pubs by asking our predecessor
-                return self.talk_to_neighbor(neighbor=self.predecessor, topic_hash=topic_hash, start_node_id=start_node_id)
+            # only the owner of the hash can have pubs for it
+            if handing_off or self.owns(topic_hash):
+                own_pubs = self.hash_table.get(topic_hash, {}).get('PUB', [])
+                if handing_off or not self.awaiting_handoff(topic_hash): return callback(own_pubs)
+                # the entries of the hash are still on their way to us, so add the ones our successor
+                # has to ours (leaving out the ones that were dropped by us in the meantime)
+                def merge(their_pubs):
+                    if their_pubs == None: return callback(None)
+                    removed = self.handoff.get("removed", set()) if self.handoff else set()
+                    matching_pubs = {pub.name: pub for pub in their_pubs if (topic_hash, 'PUB', pub.name) not in removed}
+                    matching_pubs.update((pub.name, pub) for pub in self.hash_table.get(topic_hash, {}).get('PUB', []))
+                    callback(list(matching_pubs.values()))
+                self.talk_to_neighbor(neighbor=self.successor, topic_hash=topic_hash, start_node_id=start_node_id,
+                                      handing_off=True, callback=merge)
             else:
-                # add to the list of pubs by asking our successor
-                return self.talk_to_neighbor(neighbor=self.successor, topic_hash=topic_hash, start_node_id=start_node_id)
+                # add to the list of pubs by asking the next node on the way to the owner
+                self.talk_to_neighbor(neighbor=self.next_hop(topic_hash), topic_hash=topic_hash,
+                                      start_node_id=start_node_id, callback=callback)
         except Exception as e: handle_exception(e)
 
-    """get all of the pubs in the DHT ring"""
-    def get_all_pubs(self, start_node_id):
+    """get all of the pubs in the DHT ring (and call back with whether every node on it answered)"""
+    def get_all_pubs(self, start_node_id, callback):
         try:
             self.logger.debug("DistributedMW::get_all_pubs")
             # ask successor for all their pubs recursively until reaching starting node
-            if self.successor.node_id == start_node_id: return self.get_own_pubs()
+            if self.successor == None or self.successor.node_id == start_node_id: callback(self.get_own_pubs(), True)
             else:
-                all_pubs = self.talk_to_neighbor(neighbor=self.successor, start_node_id=start_node_id, all_pubs=True)
-                all_pubs.extend(self.get_own_pubs())
-                self.logger.debug(f"DistributedMW::get_all_pubs - all pubs: {all_pubs}")
-                if self.node_id != start_node_id: return all_pubs
-                else: return format_pubs(all_pubs)
+                def add_own_pubs(answer):
+                    # our successor timing out leaves out the rest of the ring
+                    their_pubs, complete = answer if answer != None else ([], False)
+                    all_pubs = list(their_pubs)
+                    all_pubs.extend(self.get_own_pubs())
+                    self.logger.debug(f"DistributedMW::get_all_pubs - all pubs: {all_pubs}, complete: {complete}")
+                    callback(all_pubs, complete)
+                self.talk_to_neighbor(neighbor=self.successor, start_node_id=start_node_id, all_pubs=True, callback=add_own_pubs)
         except Exception as e: handle_exception(e)
 
     """get all of the pubs in our own hash table"""
     def get_own_pubs(self):
-        try: 
+        try:
             self.logger.debug("DistributedMW::get_own_pubs")
             own_pubs = []
             for topic_hash in self.hash_table:
@@ -559,55 +908,327 @@ class DistributedMW():
             return own_pubs
         except Exception as e: handle_exception(e)
 
-    """send a message to the given neighbor and wait for a response"""
-    def talk_to_neighbor(self, neighbor, new_node=None, which_neighbor=None, broker=None,
-                         topic_info=None, topic_hash=None, start_node_id=None, all_pubs=False):
+# ======================================== FINGER TABLE ======================================== #
+    """check if the given hash falls in our part of the ring (predecessor, us]"""
+    def owns(self, hash_val):
+        try: return self.predecessor == None or in_range(hash_val, self.predecessor.node_id, self.node_id, include_end=True)
+        except Exception as e: handle_exception(e)
+
+    """get the info for this node in the same format as our neighbors"""
+    def own_node_info(self):
+        try:
+            node = discovery_pb2.ID()
+            node.node_id = self.node_id; node.ip = self.addr; node.port = self.port
+            return node
+        except Exception as e: handle_exception(e)
+
+    """get the start of the interval covered by finger i"""
+    def finger_start(self, i):
+        try: return (self.node_id + 2**i) % 2**self.bits_hash
+        except Exception as e: handle_exception(e)
+
+    """fill in our finger table (from finger i on) by asking the ring for the successor of each finger start"""
+    def build_finger_table(self, i=1):
+        try:
+            self.logger.debug("DistributedMW::build_finger_table")
+            self.finger_table[0] = self.successor
+            # most fingers land on the same node as the finger before them, so reuse it
+            while i < self.bits_hash and in_range(self.finger_start(i), self.node_id, self.finger_table[i-1].node_id, include_end=True):
+                self.finger_table[i] = self.finger_table[i-1]; i += 1
+            if i == self.bits_hash: return self.logger.info(f"Finger table built: {self.format_finger_table()}")
+            # otherwise ask our successor where this finger goes and carry on from the next one
+            def located(node):
+                # once a finger wraps back around to us the rest of the table would too
+                if node == None or node.node_id == self.node_id:
+                    return self.logger.info(f"Finger table built: {self.format_finger_table()}")
+                self.finger_table[i] = node
+                self.build_finger_table(i + 1)
+            self.talk_to_neighbor(neighbor=self.successor, target_id=self.finger_start(i), callback=located)
+        except Exception as e: handle_exception(e)
+
+    """look up the successor of the next finger start once every interval (seconds)"""
+    def fix_fingers(self, interval=1):
+        try:
+            if self.successor == None or time.time() - self.last_fix < interval: return
+            self.last_fix = time.time()
+            # walk through the fingers one at a time so that nodes that joined later are picked up
+            i = self.next_finger
+            self.next_finger = self.next_finger % (self.bits_hash - 1) + 1
+            def located(node):
+                if node and node.node_id != self.node_id: self.refresh_fingers(node)
+            self.find_successor(self.finger_start(i), located)
+        except Exception as e: handle_exception(e)
+
+    """point any finger that the given node is a closer successor for to that node"""
+    def refresh_fingers(self, node):
+        try:
+            self.logger.debug("DistributedMW::refresh_fingers")
+            if node.node_id == self.node_id: return
+            for i in range(self.bits_hash):
+                start = self.finger_start(i)
+                finger = self.finger_table[i]
+                # an empty finger means that we are currently its successor
+                end = finger.node_id if finger else self.node_id
+                if node.node_id == start or in_range(node.node_id, start, end):
+                    self.finger_table[i] = node
+        except Exception as e: handle_exception(e)
+
+    """find the node in our finger table that most closely precedes the given hash"""
+    def closest_preceding_node(self, hash_val):
+        try:
+            for finger in reversed(self.finger_table):
+                if finger and in_range(finger.node_id, self.node_id, hash_val): return finger
+            return self.successor
+        except Exception as e: handle_exception(e)
+
+    """get the node we should forward a request for the given hash to"""
+    def next_hop(self, hash_val):
+        try:
+            if in_range(hash_val, self.node_id, self.successor.node_id, include_end=True): return self.successor
+            else: return self.closest_preceding_node(hash_val)
+        except Exception as e: handle_exception(e)
+
+    """find the node that owns the given hash, routing through our fingers"""
+    def find_successor(self, target_id, callback):
+        try:
+            self.logger.debug("DistributedMW::find_successor")
+            if self.owns(target_id): callback(self.own_node_info())
+            elif in_range(target_id, self.node_id, self.successor.node_id, include_end=True): callback(self.successor)
+            # recursively iterate through the ring and pass on the result once it is found
+            else: self.talk_to_neighbor(neighbor=self.closest_preceding_node(target_id), target_id=target_id, callback=callback)
+        except Exception as e: handle_exception(e)
+
+    """convert the finger table into a readable format (skipping repeated fingers)"""
+    def format_finger_table(self):
+        try:
+            fingers = []
+            for i, finger in enumerate(self.finger_table):
+                if finger and (i == 0 or finger != self.finger_table[i-1]):
+                    fingers.append(f"{i}->{self.format_node_info(finger)}")
+            return fingers
+        except Exception as e: handle_exception(e)
+
+# ======================================== KEY HANDOFF ======================================== #
+    """ask our successor for the next chunk of the entries of the range we took over"""
+    def request_handoff(self, attempts=0):
+        try:
+            self.logger.debug("DistributedMW::request_handoff")
+            disc_req = discovery_pb2.DiscoveryReq()
+            disc_req.msg_type = discovery_pb2.HANDOFF
+            disc_req.handoff_req.start = self.handoff["start"]; disc_req.handoff_req.end = self.handoff["end"]
+            if self.handoff["after"] != None:
+                disc_req.handoff_req.after = self.handoff["after"]; disc_req.handoff_req.resume = True
+            disc_req.handoff_req.max_entries = self.handoff_chunk
+            self.send_to_node(self.successor, disc_req, lambda handoff_resp: self.handoff_received(handoff_resp, attempts))
+        except Exception as e: handle_exception(e)
+
+    """store a chunk of the entries of our range and ask for the next one (or let our successor drop the range)"""
+    def handoff_received(self, handoff_resp, attempts):
+        try:
+            self.logger.debug("DistributedMW::handoff_received")
+            if handoff_resp == None:
+                # ask for the same chunk again (a few times)
+                if attempts + 1 < self.handoff_retries: return self.request_handoff(attempts + 1)
+                self.logger.warning(f"Gave up on the handoff of our range after: {self.handoff['after']}")
+                self.handoff = None; return
+            removed = self.handoff.get("removed", set())
+            for topic_info in handoff_resp.entries:
+                # what was registered with (or dropped by) us since we took over is newer than what is handed over
+                apps = self.hash_table.get(topic_info.topic_hash, {}).get(topic_info.app_type, [])
+                if (topic_info.topic_hash, topic_info.app_type, topic_info.app_id.name) in removed or \
+                    any(app.name == topic_info.app_id.name for app in apps): continue
+                self.log_record("topic", topic_info.SerializeToString())
+                self.add_to_hash_table(topic_info.topic_hash, topic_info.app_id, topic_info.app_type)
+            if handoff_resp.versions:
+                # we number the changes of these topics from here on
+                versions = {topic: max(version, self.feed_versions.get(topic, 0)) for topic, version in handoff_resp.versions.items()}
+                self.log_record("versions", json.dumps(versions).encode())
+                self.feed_versions.update(versions)
+            self.handoff["chunks"] = self.handoff.get("chunks", 0) + 1
+            self.handoff["entries"] = self.handoff.get("entries", 0) + len(handoff_resp.entries)
+            if not handoff_resp.done:
+                # carry on after this chunk (from here, even if we are restarted)
+                self.handoff["after"] = handoff_resp.last
+                self.log_record("handoff", json.dumps({key: self.handoff[key] for key in ("start", "end", "after")}).encode())
+                return self.request_handoff()
+            self.logger.info(f"Took over {self.handoff['entries']} hash table entries from our successor " +
+                             f"in {self.handoff['chunks']} chunk(s)")
+            self.log_record("handoff_done", b"")
+            # our successor can let go of the range now
+            self.release_range(self.handoff["start"], self.handoff["end"])
+            self.handoff = None
+        except Exception as e: handle_exception(e)
+
+    """check if the entries of the given hash may still be on their way to us from our successor
+    (the range is handed over in ring order, so the hashes up to the last one we got are all in)"""
+    def awaiting_handoff(self, topic_hash):
+        try:
+            if not self.handoff: return False
+            start, end, after = self.handoff["start"], self.handoff["end"], self.handoff["after"]
+            if not in_range(topic_hash, start, end, include_end=True): return False
+            distance = lambda hash_val: (hash_val - start) % 2**self.bits_hash
+            return after == None or distance(topic_hash) > distance(after)
+        except Exception as e: handle_exception(e)
+
+    """let our successor drop the range we took over (telling it again if it does not answer)"""
+    def release_range(self, start, end, attempts=0):
+        try:
+            self.logger.debug("DistributedMW::release_range")
+            disc_req = discovery_pb2.DiscoveryReq()
+            disc_req.msg_type = discovery_pb2.HANDOFF
+            disc_req.handoff_req.start = start; disc_req.handoff_req.end = end
+            disc_req.handoff_req.release = True
+            def released(handoff_resp):
+                if handoff_resp == None and attempts + 1 < self.handoff_retries: self.release_range(start, end, attempts + 1)
+            self.send_to_node(self.successor, disc_req, released)
+        except Exception as e: handle_exception(e)
+
+    """hand a chunk of the entries of a range (in ring order, after the given hash) to the node that
+    took it over from us (or drop the range once it has all of them)"""
+    def handle_handoff(self, requester, handoff_req):
+        try:
+            self.logger.debug("DistributedMW::handle_handoff")
+            start, end = handoff_req.start, handoff_req.end
+            disc_resp = discovery_pb2.DiscoveryResp()
+            disc_resp.msg_type = discovery_pb2.HANDOFF
+            if handoff_req.release:
+                self.log_record("drop_range", json.dumps({"start": start, "end": end}).encode())
+                dropped = self.drop_range(start, end)
+                self.logger.info(f"Handed over {dropped} hash table entries to our predecessor")
+                disc_resp.handoff_resp.done = True
+                return self.reply(requester, disc_resp)
+            # the hashes of the range in ring order, carrying on after the last one handed over
+            distance = lambda topic_hash: (topic_hash - start) % 2**self.bits_hash
+            after = distance(handoff_req.after) if handoff_req.resume else 0
+            hashes = sorted((topic_hash for topic_hash in self.hash_table if in_range(topic_hash, start, end, include_end=True)
+                             and distance(topic_hash) > after), key=distance)
+            entries = disc_resp.handoff_resp.entries; done = True
+            for topic_hash in hashes:
+                # a chunk ends on a whole hash
+                if len(entries) >= max(1, handoff_req.max_entries): done = False; break
+                for app_type, app_ids in self.hash_table[topic_hash].items():
+                    for app_id in app_ids:
+                        topic_info = entries.add()
+                        topic_info.topic_hash = topic_hash; topic_info.app_type = app_type
+                        topic_info.app_id.CopyFrom(app_id)
+                disc_resp.handoff_resp.last = topic_hash
+            if done:
+                # the new owner numbers the changes of these topics from where we left off
+                for topic, version in self.feed_versions.items():
+                    if in_range(hash_func(self.bits_hash, topic), start, end, include_end=True):
+                        disc_resp.handoff_resp.versions[topic] = version
+            disc_resp.handoff_resp.done = done
+            self.reply(requester, disc_resp)
+        except Exception as e: handle_exception(e)
+
+    """drop the entries (and feed versions) of a range that another node took over from us"""
+    def drop_range(self, start, end):
+        try:
+            hashes = [topic_hash for topic_hash in self.hash_table if in_range(topic_hash, start, end, include_end=True)]
+            dropped = sum(len(app_ids) for topic_hash in hashes for app_ids in self.hash_table[topic_hash].values())
+            for topic_hash in hashes: del self.hash_table[topic_hash]
+            for topic in [topic for topic in self.feed_versions if in_range(hash_func(self.bits_hash, topic), start, end, include_end=True)]:
+                del self.feed_versions[topic]
+            if hashes: self.lookup_cache.invalidate()
+            return dropped
+        except Exception as e: handle_exception(e)
+
+# ======================================== PENDING REQUESTS ======================================== #
+    """send a request to another DHT node and remember what to do with its reply"""
+    def send_to_node(self, node, disc_req, callback):
+        try:
+            self.last_request_id += 1
+            disc_req.request_id = self.last_request_id
+            sent_on = self.neighbor_pool.send(node, disc_req.SerializeToString())
+            self.pending[disc_req.request_id] = {"callback": callback, "node": sent_on, "sent": time.time()}
+        except Exception as e: handle_exception(e)
+
+    """match a reply from another DHT node to the request that is waiting on it"""
+    def handle_neighbor_reply(self, socket):
+        try:
+            self.logger.debug("DistributedMW::handle_neighbor_reply")
+            frames = socket.recv_multipart()
+            disc_resp = discovery_pb2.DiscoveryResp()
+            disc_resp.ParseFromString(frames[-1])
+            request = self.pending.pop(disc_resp.request_id, None)
+            if request == None:
+                return self.logger.debug(f"DistributedMW::handle_neighbor_reply - dropped late reply: {disc_resp.request_id}")
+            self.neighbor_pool.succeeded(request["node"])
+            request["callback"](self.handle_reply(disc_resp))
+        except Exception as e: handle_exception(e)
+
+    """give up on requests that other nodes did not answer in time"""
+    def expire_pending_requests(self):
+        try:
+            now = time.time(); timeout = self.neighbor_pool.timeout / 1000
+            expired = [id for id, request in self.pending.items() if now - request["sent"] > timeout]
+            for id in expired:
+                request = self.pending.pop(id)
+                self.neighbor_pool.failed(request["node"])
+                # let whoever was waiting carry on without an answer
+                request["callback"](None)
+            # gathers that are past their deadline carry on with the results they have
+            overdue = [deadline for deadline in self.deadlines if deadline["at"] <= now]
+            self.deadlines = [deadline for deadline in self.deadlines if deadline["at"] > now and not deadline["state"]["finished"]]
+            for deadline in overdue: deadline["finish"]()
+        except Exception as e: handle_exception(e)
+
+    """get how long (ms) we can wait on the poller before the next deadline is due"""
+    def poll_timeout(self):
+        try:
+            # the next lease timer tick is due at the latest
+            lease_timeout = self.lease_timers.timeout(time.monotonic())
+            timeout = 1000 if lease_timeout == None else min(1000, int(lease_timeout * 1000) + 1)
+            if not self.deadlines: return timeout
+            next_deadline = min(deadline["at"] for deadline in self.deadlines)
+            return max(0, min(timeout, int((next_deadline - time.time()) * 1000)))
+        except Exception as e: handle_exception(e)
+
+    """send a message to the given neighbor and call back with its response"""
+    def talk_to_neighbor(self, neighbor, new_node=None, which_neighbor=None, broker=None, topic_infos=None,
+                         topic_hash=None, start_node_id=None, all_pubs=False, target_id=None, reg_count=False, handing_off=False,
+                         callback=None):
         try:
             self.logger.debug("DistributedMW::talk_to_neighbor")
-            # set up the neighbor_req
-            context = zmq.Context()  # returns a singleton object
-            neighbor_req = context.socket(zmq.REQ)
-            connect_str = f"tcp://{neighbor.ip}:{neighbor.port}"
-            self.poller.register(neighbor_req, zmq.POLLIN)
-            neighbor_req.connect(connect_str)
             # build the request message
             next_id = hash_func(self.bits_hash, f'{neighbor.ip}:{neighbor.port}')
             disc_req = discovery_pb2.DiscoveryReq()
-            if which_neighbor or start_node_id and not topic_hash and not all_pubs:
-                return self.send_update_request(disc_req, neighbor_req, new_node, which_neighbor, broker, start_node_id, next_id)
+            if which_neighbor or broker:
+                self.send_update_request(disc_req, neighbor, new_node, which_neighbor, broker, start_node_id, next_id, callback)
             else:
-                return self.send_locate_request(disc_req, neighbor_req, new_node, topic_info, topic_hash, start_node_id, all_pubs, next_id)
+                self.send_locate_request(disc_req, neighbor, new_node, topic_infos, topic_hash, start_node_id, all_pubs, target_id, reg_count,
+                                         handing_off, next_id, callback)
         except Exception as e: handle_exception(e)
 
-    """send an update message to the given neighbor and wait for a response"""
-    def send_update_request(self, disc_req, neighbor_req, new_node, which_neighbor, broker, start_node_id, next_id):
+    """send an update message to the given neighbor and call back once it responds"""
+    def send_update_request(self, disc_req, neighbor, new_node, which_neighbor, broker, start_node_id, next_id, callback):
         try:
             self.logger.debug("DistributedMW::send_update_request")
             update_req = discovery_pb2.UpdateReq()
             if which_neighbor: update_req.which_neighbor = which_neighbor
-            if start_node_id: 
-                write_vis_command('Visualization/commands.txt', 'request', self.node_id, next_id, 'Update IS_READY') 
+            if start_node_id:
+                write_vis_command('Visualization/commands.txt', 'request', self.node_id, next_id, 'Update IS_READY')
                 update_req.start_node_id = start_node_id
-            if broker: 
+            if broker:
                 update_req.new_node.name = broker.name
                 update_req.new_node.ip = broker.ip
                 update_req.new_node.port = broker.port
+                update_req.new_node.shards = broker.shards
+                update_req.new_node.snapshot_port = broker.snapshot_port
             elif new_node:
-                write_vis_command('Visualization/commands.txt', 'request', self.node_id, next_id, 'Update Neighbor') 
+                write_vis_command('Visualization/commands.txt', 'request', self.node_id, next_id, 'Update Neighbor')
                 update_req.new_node.node_id = new_node.node_id
                 update_req.new_node.ip = new_node.ip
                 update_req.new_node.port = new_node.port
             disc_req.msg_type = discovery_pb2.UPDATE_NODE
             disc_req.update_req.CopyFrom(update_req)
-            # send the message
-            send_message(neighbor_req, disc_req)
-            # get response to clear the socket but we don't care about it right now
-            self.event_loop(neighbor_req)
-            return True
+            # send the message over our pooled connection; the response only tells us they are done
+            self.send_to_node(neighbor, disc_req, callback)
         except Exception as e: handle_exception(e)
 
-    """send a locate message to the given neighbor and wait for a response"""
-    def send_locate_request(self, disc_req, neighbor_req, new_node, topic_info, topic_hash, start_node_id, all_pubs, next_id):
+    """send a locate message to the given neighbor and call back with its response"""
+    def send_locate_request(self, disc_req, neighbor, new_node, topic_infos, topic_hash, start_node_id, all_pubs, target_id, reg_count,
+                            handing_off, next_id, callback):
         try:
             self.logger.debug("DistributedMW::send_locate_request")
             locate_req = discovery_pb2.LocateReq()
@@ -616,26 +1237,105 @@ class DistributedMW():
                 locate_req.new_node.node_id = new_node.node_id
                 locate_req.new_node.ip = new_node.ip
                 locate_req.new_node.port = new_node.port
-            if topic_info:
-                write_vis_command('Visualization/commands.txt', 'request', self.node_id, next_id, 'Register Topic') 
-                locate_req.topic_info.topic = topic_info.topic
-                locate_req.topic_info.topic_hash = topic_info.topic_hash
-                locate_req.topic_info.app_type = topic_info.app_type
-                locate_req.topic_info.app_id.name = topic_info.app_id.name
-                locate_req.topic_info.app_id.ip = topic_info.app_id.ip
-                locate_req.topic_info.app_id.port = topic_info.app_id.port
+            if topic_infos:
+                write_vis_command('Visualization/commands.txt', 'request', self.node_id, next_id, 'Register Topic')
+                locate_req.topic_infos.extend(topic_infos)
                 disc_req.msg_type = discovery_pb2.LOCATE_HASH_TABLE
             elif topic_hash:
-                write_vis_command('Visualization/commands.txt', 'request', self.node_id, next_id, 'Locate Publisher') 
+                write_vis_command('Visualization/commands.txt', 'request', self.node_id, next_id, 'Locate Publisher')
                 locate_req.topic_info.topic_hash = topic_hash
+                locate_req.handing_off = handing_off
                 disc_req.msg_type = discovery_pb2.LOCATE_PUB_BY_TOPIC_HASH
             elif all_pubs: disc_req.msg_type = discovery_pb2.LOCATE_ALL_PUBS
-            else: 
-                write_vis_command('Visualization/commands.txt', 'request', self.node_id, next_id, 'Locate Node Placement') 
+            elif reg_count:
+                write_vis_command('Visualization/commands.txt', 'request', self.node_id, next_id, 'Count IS_READY')
+                disc_req.msg_type = discovery_pb2.LOCATE_REG_COUNT
+            elif target_id != None:
+                write_vis_command('Visualization/commands.txt', 'request', self.node_id, next_id, 'Locate Successor')
+                locate_req.target_id = target_id
+                disc_req.msg_type = discovery_pb2.LOCATE_SUCCESSOR
+            else:
+                write_vis_command('Visualization/commands.txt', 'request', self.node_id, next_id, 'Locate Node Placement')
                 disc_req.msg_type = discovery_pb2.LOCATE_NEW_NODE
             disc_req.locate_req.CopyFrom(locate_req)
-            # send the message
-            send_message(neighbor_req, disc_req)
-            # get response
-            return self.event_loop(neighbor_req)
+            # send the message over our pooled connection and handle the response when it arrives
+            self.send_to_node(neighbor, disc_req, callback)
+        except Exception as e: handle_exception(e)
+
+# ======================================== REGISTRY LOG ======================================== #
+    """append a record to the registry log (if we keep one) before the change it records is applied"""
+    def log_record(self, kind, payload):
+        try:
+            if self.registry_log: self.registry_log.append(kind, payload)
+        except Exception as e: handle_exception(e)
+
+    """compact the registry log into a snapshot when it is time (between requests, once
+    every change that has been logged has also been applied)"""
+    def compact_registry_log(self):
+        try:
+            if self.registry_log and self.registry_log.due(): self.registry_log.compact(self.snapshot_records())
+        except Exception as e: handle_exception(e)
+
+    """log our neighbors (whenever either of them changes)"""
+    def log_ring(self):
+        try:
+            if self.predecessor == None or self.successor == None: return
+            self.log_record("ring", json.dumps({"predecessor": self.format_node_info(self.predecessor),
+                                                "successor": self.format_node_info(self.successor)}).encode())
+        except Exception as e: handle_exception(e)
+
+    """get the records that rebuild our part of the registry as it is now (for a snapshot)"""
+    def snapshot_records(self):
+        try:
+            records = [("feed", self.feed_addr.encode()), ("versions", json.dumps(self.feed_versions).encode()),
+                       ("reg_count", str(self.reg_count).encode())]
+            if self.predecessor and self.successor:
+                records.append(("ring", json.dumps({"predecessor": self.format_node_info(self.predecessor),
+                                                    "successor": self.format_node_info(self.successor)}).encode()))
+            if self.broker: records.append(("broker", self.broker.SerializeToString()))
+            for topic_hash, apps in self.hash_table.items():
+                for app_type, app_ids in apps.items():
+                    for app_id in app_ids:
+                        topic_info = discovery_pb2.LocateReq.TopicInfo()
+                        topic_info.topic_hash = topic_hash; topic_info.app_type = app_type
+                        topic_info.app_id.CopyFrom(app_id)
+                        records.append(("topic", topic_info.SerializeToString()))
+            records.extend(("lease", pub.SerializeToString()) for pub in self.leases.values())
+            if self.handoff:
+                records.append(("handoff", json.dumps({key: self.handoff[key] for key in ("start", "end", "after")}).encode()))
+            return records
+        except Exception as e: handle_exception(e)
+
+    """apply the records read back from the registry log (a snapshot's and then the log's)"""
+    def restore(self, records):
+        try:
+            self.logger.debug("DistributedMW::restore")
+            resumed = False
+            for kind, payload in records:
+                if kind == "topic":
+                    topic_info = discovery_pb2.LocateReq.TopicInfo(); topic_info.ParseFromString(payload)
+                    if topic_info.remove: self.remove_from_hash_table(topic_info.topic_hash, topic_info.app_id, topic_info.app_type)
+                    else: self.add_to_hash_table(topic_info.topic_hash, topic_info.app_id, topic_info.app_type)
+                elif kind == "versions": self.feed_versions.update(json.loads(payload))
+                elif kind == "reg_count": self.reg_count = int(payload)
+                elif kind == "broker":
+                    self.broker = discovery_pb2.ID(); self.broker.ParseFromString(payload)
+                elif kind == "lease":
+                    # a leased pub gets a whole lease from now to check back in with us
+                    pub = discovery_pb2.RegisterReq(); pub.ParseFromString(payload)
+                    self.leases[pub.id.name] = pub
+                    self.lease_timers.schedule(pub.id.name, time.monotonic() + pub.lease_ms / 1000)
+                elif kind == "lease_end":
+                    name = payload.decode()
+                    if self.leases.pop(name, None): self.lease_timers.cancel(name)
+                # a handoff that did not finish carries on after the last chunk we got
+                elif kind == "handoff": self.handoff = json.loads(payload); resumed = True
+                elif kind == "handoff_done": self.handoff = None; resumed = False
+                elif kind == "drop_range":
+                    handed = json.loads(payload)
+                    self.drop_range(handed["start"], handed["end"])
+            entries = sum(len(app_ids) for apps in self.hash_table.values() for app_ids in apps.values())
+            if records: self.logger.info(f"Restored {entries} hash table " +
+                                         f"entries, {len(self.leases)} lease(s) and a reg_count of {self.reg_count}")
+            if resumed: self.logger.info(f"Resuming the handoff of our range after: {self.handoff['after']}")
         except Exception as e: handle_exception(e)
@@ -0,0 +1,63 @@
+###############################################
+# Author: Patrick Muradaz
+# Vanderbilt University
+# Purpose: Cache of serialized lookup responses
+# Semester: Spring 2023
+###############################################
+#
+# After startup the registry rarely changes, yet every LOOKUP_ALL_PUBS and
+# LOOKUP_PUB_BY_TOPIC rebuilds (and in the DHT, re-collects) the same answer.
+# The cache keeps the serialized response for each normalized lookup and is
+# versioned: any registry mutation bumps the version and drops the entries,
+# and an answer that was being built while the registry changed is not kept.
+#
+# Import statements
+import sys, os
+sys.path.append(os.getcwd())
+from Apps.Common.common import handle_exception
+
+"""Lookup Cache class"""
+class LookupCache():
+
+    """constructor"""
+    def __init__(self, logger):
+        self.logger = logger  # internal logger for print statements
+        self.version = 0      # bumped on every registry mutation
+        self.entries = {}     # lookup key -> serialized DiscoveryResp
+        self.hits = 0         # lookups answered from the cache
+        self.misses = 0       # lookups that had to be built
+
+    """get the cache key for a lookup (the same topics in any order/repetition share a key)"""
+    def key(self, disc_req, return_all_pubs):
+        try:
+            if return_all_pubs: return ("ALL",)
+            return ("TOPICS",) + tuple(sorted(set(disc_req.topics.topiclist)))
+        except Exception as e: handle_exception(e)
+
+    """get the serialized response for the given key (None if it has to be built)"""
+    def get(self, key):
+        try:
+            buf = self.entries.get(key)
+            if buf == None: self.misses += 1
+            else: self.hits += 1
+            self.logger.debug(f"LookupCache::get - hits: {self.hits}; misses: {self.misses}")
+            return buf
+        except Exception as e: handle_exception(e)
+
+    """store the serialized response for the given key if the registry has not changed since version"""
+    def put(self, key, buf, version):
+        try:
+            if version == self.version: self.entries[key] = buf
+        except Exception as e: handle_exception(e)
+
+    """drop every cached response (called whenever the registry changes)"""
+    def invalidate(self):
+        try:
+            self.version += 1
+            self.entries.clear()
+        except Exception as e: handle_exception(e)
+
+    """get the hit/miss counters"""
+    def stats(self):
+        try: return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries), "version": self.version}
+        except Exception as e: handle_exception(e)
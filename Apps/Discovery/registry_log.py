@@ -0,0 +1,159 @@
+###############################################
+# Author: Patrick Muradaz
+# Vanderbilt University
+# Purpose: Write-ahead log and snapshots of a discovery node's registry
+# Semester: Spring 2023
+###############################################
+#
+# Every change to a discovery node's registry is appended to a write-ahead log
+# before it is applied (or answered), so that a restarted node gets back all of
+# its registrations instead of having every pub/sub register again (which in the
+# DHT means walking the ring again).
+#
+# A record is (kind, payload): the middleware decides what the kinds are and
+# how their payloads are encoded. Each record has a sequence number and a crc,
+# so a record that was only half written when we went down (the last one) is
+# spotted and dropped. Once enough records have been appended (and applied, the
+# middleware only checks whether we are due between requests), the middleware
+# hands us the records that rebuild its current state and we write them out as
+# a snapshot (next to it first, so a reader never sees half of it) and start the
+# log over. The snapshot says which record it goes up to, so the records of a
+# log that did not get started over (we went down in between) are skipped.
+#
+# On restart both files are memory-mapped and the records are read straight out
+# of the mapping (no reading the files into memory first).
+#
+# Import statements
+import sys, os, mmap, struct, time, zlib
+sys.path.append(os.getcwd())
+from Apps.Common.common import handle_exception
+
+MAGIC = b"DSNP"                       # start of a snapshot file
+SNAPSHOT = struct.Struct("<4sHQI")    # magic, version, last log record it covers, number of records
+RECORD = struct.Struct("<IQHI")       # crc (of the rest), sequence number, kind length, payload length
+
+"""Registry Log class"""
+class RegistryLog():
+
+    """constructor"""
+    def __init__(self, logger, path, snapshot_every=1000, fsync=False):
+        self.logger = logger      # internal logger for print statements
+        self.path = path          # the log is at path.wal and the snapshot at path.snap
+        self.snapshot_every = snapshot_every # records appended before the log is compacted into a snapshot
+        self.fsync = fsync        # whether every record is synced to disk (not just handed to the OS)
+        self.wal = None           # the log file (opened for appending once we have recovered)
+        self.seq = 0              # sequence number of the last record appended
+        self.appended = 0         # records appended since the last snapshot
+
+    """read the records of the snapshot and then the log (dropping a torn record at the end of the log)"""
+    def recover(self):
+        try:
+            self.logger.debug("RegistryLog::recover")
+            started = time.perf_counter()
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            records = []; covered = 0
+            with Mapping(self.path + ".snap") as data:
+                if data:
+                    magic, version, covered, number = SNAPSHOT.unpack_from(data, 0)
+                    if magic != MAGIC: raise Exception(f"{self.path}.snap is not a registry snapshot")
+                    snapshot, offset = self.read(data, SNAPSHOT.size)
+                    if len(snapshot) != number: raise Exception(f"{self.path}.snap is missing records")
+                    records.extend((kind, payload) for seq, kind, payload in snapshot)
+            self.seq = covered; valid = 0
+            with Mapping(self.path + ".wal") as data:
+                if data:
+                    wal, valid = self.read(data, 0)
+                    for seq, kind, payload in wal:
+                        if seq <= covered: continue
+                        records.append((kind, payload)); self.seq = seq; self.appended += 1
+                    if valid < len(data): self.logger.warning(f"Dropping a torn record at the end of: {self.path}.wal")
+            # start appending right after the last good record
+            self.wal = open(self.path + ".wal", "ab")
+            self.wal.truncate(valid)
+            if records:
+                self.logger.info(f"Recovered {len(records)} registry record(s) from {self.path} " +
+                                 f"in {(time.perf_counter() - started) * 1000:.1f} ms")
+            return records
+        except Exception as e: handle_exception(e)
+
+    """read the records from offset on (as (seq, kind, payload)), stopping at the first one that is
+    cut short or fails its crc, and get the offset up to which they are good"""
+    def read(self, data, offset):
+        try:
+            records = []; view = memoryview(data)
+            while offset + RECORD.size <= len(data):
+                crc, seq, kind_length, payload_length = RECORD.unpack_from(data, offset)
+                end = offset + RECORD.size + kind_length + payload_length
+                if end > len(data) or zlib.crc32(view[offset + 4:end]) != crc: break
+                start = offset + RECORD.size
+                records.append((seq, bytes(view[start:start + kind_length]).decode(), bytes(view[start + kind_length:end])))
+                offset = end
+            view.release()
+            return records, offset
+        except Exception as e: handle_exception(e)
+
+    """encode a record"""
+    def encode(self, seq, kind, payload):
+        try:
+            kind = kind.encode()
+            body = RECORD.pack(0, seq, len(kind), len(payload))[4:] + kind + payload
+            return struct.pack("<I", zlib.crc32(body)) + body
+        except Exception as e: handle_exception(e)
+
+    """append a record to the log"""
+    def append(self, kind, payload):
+        try:
+            self.seq += 1; self.appended += 1
+            self.wal.write(self.encode(self.seq, kind, payload))
+            # hand it to the OS so it survives us going down (and to the disk if it has to survive the machine)
+            self.wal.flush()
+            if self.fsync: os.fsync(self.wal.fileno())
+        except Exception as e: handle_exception(e)
+
+    """whether it is time to compact the log into a snapshot (the snapshot covers every record
+    appended so far, so the records it is made from must have all of them applied)"""
+    def due(self):
+        try: return self.wal != None and self.appended >= self.snapshot_every
+        except Exception as e: handle_exception(e)
+
+    """write a snapshot of the given records (that rebuild the current state) and start the log over"""
+    def compact(self, records):
+        try:
+            self.logger.debug("RegistryLog::compact")
+            parts = [SNAPSHOT.pack(MAGIC, 1, self.seq, len(records))]
+            parts.extend(self.encode(0, kind, payload) for kind, payload in records)
+            with open(self.path + ".snap.tmp", "wb") as f:
+                f.write(b"".join(parts))
+                f.flush(); os.fsync(f.fileno())
+            os.replace(self.path + ".snap.tmp", self.path + ".snap")
+            # the snapshot covers everything in the log now
+            self.wal.truncate(0); self.appended = 0
+            self.logger.info(f"Compacted the registry log into a snapshot of {len(records)} record(s)")
+        except Exception as e: handle_exception(e)
+
+    """close the log"""
+    def close(self):
+        try:
+            if self.wal: self.wal.close()
+        except Exception as e: handle_exception(e)
+
+"""a read-only memory mapping of a file (None if there is no file, or it is empty)"""
+class Mapping():
+
+    """constructor"""
+    def __init__(self, path):
+        self.path = path    # the file to map
+        self.file = None    # the open file
+        self.data = None    # the mapping
+
+    """map the file"""
+    def __enter__(self):
+        if not os.path.exists(self.path) or not os.path.getsize(self.path): return None
+        self.file = open(self.path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.data
+
+    """unmap the file"""
+    def __exit__(self, *exc):
+        if self.data: self.data.close()
+        if self.file: self.file.close()
@@ -0,0 +1,114 @@
+###############################################
+# Author: Patrick Muradaz
+# Vanderbilt University
+# Purpose: Checks that the registry log recovers everything across compactions
+# Semester: Spring 2023
+###############################################
+#
+# Every registry change is logged before it is applied, and the log is only
+# compacted into a snapshot once the changes it covers have been applied. These
+# checks log (and compact) more changes than fit between two snapshots and make
+# sure that a restart gets every one of them back: first for the log itself, and
+# then for the centralized and distributed middlewares (with snapshots every few
+# changes, so that the last change lands on a compaction for one of them).
+#
+# Run with pytest, or on its own: python3 Apps/Discovery/registry_log_test.py
+#
+# Import statements
+import sys, os, argparse, logging, tempfile
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from Apps.Common import discovery_pb2
+from Apps.Discovery.registry_log import RegistryLog
+from Apps.Discovery.centralized_mw import CentralizedMW
+from Apps.Discovery.distributed_mw import DistributedMW
+
+logger = logging.getLogger("RegistryLogTest")
+
+"""the command line arguments a discovery node would have been started with"""
+def discovery_args(state_dir, snapshot_every=3):
+    return argparse.Namespace(addr="127.0.0.1", port="*", knownnode="127.0.0.1:1", state_dir=state_dir,
+                              snapshot_every=snapshot_every, fsync=False)
+
+"""a pub registration"""
+def pub(i):
+    register_req = discovery_pb2.RegisterReq()
+    register_req.role = discovery_pb2.RegisterReq().Role.PUBLISHER
+    register_req.id.name = f"pub{i}"; register_req.id.ip = "127.0.0.1"; register_req.id.port = str(7000 + i)
+    register_req.topiclist.extend([f"weather{i % 3}", f"humidity{i % 5}"])
+    return register_req
+
+"""log, apply and (when due) compact changes past several snapshots and get all of them back"""
+def test_log_recovers_across_compactions():
+    with tempfile.TemporaryDirectory() as state_dir:
+        registry_log = RegistryLog(logger, os.path.join(state_dir, "log"), snapshot_every=3)
+        assert registry_log.recover() == []
+        state = []
+        for i in range(10):
+            registry_log.append("item", str(i).encode())
+            state.append(("item", str(i).encode()))
+            if registry_log.due(): registry_log.compact(list(state))
+        registry_log.close()
+        assert RegistryLog(logger, os.path.join(state_dir, "log"), snapshot_every=3).recover() == state
+
+"""register (and deregister) pubs with a centralized discovery service past several snapshots and restart it"""
+def test_centralized_recovers_across_compactions():
+    for snapshot_every in range(2, 8): check_centralized(snapshot_every)
+
+def check_centralized(snapshot_every):
+    with tempfile.TemporaryDirectory() as state_dir:
+        def start():
+            mw = CentralizedMW(logger, "Direct")
+            mw.configure(discovery_args(state_dir, snapshot_every))
+            # what listen does before it waits for requests
+            mw.pubs = []; mw.subs = []; mw.numpubs = 1; mw.numsubs = 1
+            mw.restore(mw.recovered)
+            return mw
+        mw = start()
+        for i in range(8):
+            mw.handle_register([b"pub"], pub(i))
+            mw.compact_registry_log()
+        mw.handle_deregister([b"pub"], pub(2))
+        mw.compact_registry_log()
+        restarted = start()
+        assert restarted.pub_entries == mw.pub_entries and len(mw.pub_entries) == 7
+        assert restarted.topic_index == mw.topic_index
+        assert restarted.feed_versions == mw.feed_versions
+        assert len(restarted.pubs) == len(mw.pubs)
+
+"""store (and drop) pubs in a DHT node's hash table past several snapshots and restart it"""
+def test_distributed_recovers_across_compactions():
+    for snapshot_every in range(2, 8): check_distributed(snapshot_every)
+
+def check_distributed(snapshot_every):
+    with tempfile.TemporaryDirectory() as state_dir:
+        # storing a topic also writes a visualization command (relative to where we run)
+        cwd = os.getcwd(); os.chdir(state_dir); os.makedirs("Visualization")
+        try:
+            def start():
+                mw = DistributedMW(logger, "Direct")
+                mw.configure(discovery_args(state_dir, snapshot_every))
+                # a ring of one (what register_dht and listen do first)
+                mw.bits_hash = 48; mw.node_id = 1; mw.finger_table = [None] * mw.bits_hash
+                mw.hash_table = {}; mw.numpubs = 1; mw.numsubs = 1
+                mw.restore(mw.recovered)
+                return mw
+            mw = start()
+            for i in range(8):
+                mw.register_topic_hashes(pub(i), "PUB", lambda: None)
+                mw.compact_registry_log()
+            mw.determine_topic_locations(mw.topic_infos(pub(2), "PUB", remove=True), lambda success: None)
+            mw.compact_registry_log()
+            restarted = start()
+            names = lambda hash_table: {topic_hash: sorted(app.name for app in apps["PUB"]) for topic_hash, apps in hash_table.items()}
+            assert names(restarted.hash_table) == names(mw.hash_table)
+            assert sum(len(pubs) for pubs in names(mw.hash_table).values()) == 7 * 2
+            assert restarted.feed_versions == mw.feed_versions
+            assert restarted.reg_count == mw.reg_count == 8
+        finally: os.chdir(cwd)
+
+"""Main entry point"""
+if __name__ == "__main__":
+    test_log_recovers_across_compactions()
+    test_centralized_recovers_across_compactions()
+    test_distributed_recovers_across_compactions()
+    print("Registry log checks passed.")
@@ -0,0 +1,88 @@
+###############################################
+# Author: Patrick Muradaz
+# Vanderbilt University
+# Purpose: Hierarchical timer wheel for registration leases
+# Semester: Spring 2023
+###############################################
+#
+# Every leased registration has a timer that is pushed back on every heartbeat,
+# so timers are started and cancelled far more often than they go off. A timer
+# wheel makes both O(1): time is cut into ticks, and a timer goes in the slot of
+# the tick it is due on. One wheel of slots only covers so many ticks, so there
+# are a few levels of them, each slot of a level covering a whole turn of the
+# level below. Timers that are further out go in a higher level and are moved
+# down a level (cascaded) once the time they are due on comes within its reach.
+#
+# Import statements
+import sys, os, math
+sys.path.append(os.getcwd())
+from Apps.Common.common import handle_exception
+
+"""Timer Wheel class"""
+class TimerWheel():
+
+    """constructor"""
+    def __init__(self, now, tick=0.1, slots=64, levels=4):
+        self.tick = tick          # seconds per tick
+        self.slots = slots        # slots per level
+        self.levels = levels      # levels (the top one covers tick * slots^levels seconds)
+        self.wheels = [[set() for _ in range(slots)] for _ in range(levels)] # level -> slot -> keys
+        self.timers = {}          # key -> (tick it is due on, level, slot)
+        self.current = int(now / tick) # the last tick that has been handled
+
+    """start (or restart) the timer of the given key to go off at the given time (in seconds)"""
+    def schedule(self, key, deadline):
+        try:
+            self.cancel(key)
+            self.place(key, max(math.ceil(deadline / self.tick), self.current + 1))
+        except Exception as e: handle_exception(e)
+
+    """stop the timer of the given key (if it has one)"""
+    def cancel(self, key):
+        try:
+            timer = self.timers.pop(key, None)
+            if timer: self.wheels[timer[1]][timer[2]].discard(key)
+        except Exception as e: handle_exception(e)
+
+    """put the key in the slot of the lowest level that reaches the tick it is due on"""
+    def place(self, key, tick):
+        try:
+            delta = tick - self.current; level = 0
+            while level < self.levels - 1 and delta >= self.slots ** (level + 1): level += 1
+            slot = (tick // self.slots ** level) % self.slots
+            self.wheels[level][slot].add(key)
+            self.timers[key] = (tick, level, slot)
+        except Exception as e: handle_exception(e)
+
+    """move the clock up to the given time (in seconds) and get the keys whose timers went off"""
+    def advance(self, now):
+        try:
+            target = int(now / self.tick); expired = []
+            # nothing can go off, so skip straight there
+            if not self.timers: self.current = max(self.current, target)
+            while self.current < target:
+                self.current += 1
+                # bring the timers of the higher levels that are now within reach down a level
+                for level in range(1, self.levels):
+                    if self.current % self.slots ** level: break
+                    slot = (self.current // self.slots ** level) % self.slots
+                    keys = self.wheels[level][slot]; self.wheels[level][slot] = set()
+                    for key in keys: self.place(key, self.timers[key][0])
+                # then everything in this tick's slot goes off
+                slot = self.current % self.slots
+                keys = self.wheels[0][slot]; self.wheels[0][slot] = set()
+                for key in keys: del self.timers[key]
+                expired.extend(keys)
+            return expired
+        except Exception as e: handle_exception(e)
+
+    """get the seconds until the next tick (None if there are no timers to wait on)"""
+    def timeout(self, now):
+        try:
+            if not self.timers: return None
+            return max(0, (self.current + 1) * self.tick - now)
+        except Exception as e: handle_exception(e)
+
+    """the number of timers"""
+    def __len__(self):
+        return len(self.timers)
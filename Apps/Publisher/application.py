@@ -89,12 +89,14 @@ class PublisherAppln():
       self.logger.info("Publisher app registered.")
       # Keep checking with the discovery service if we are ready to go
       self.logger.info("Waiting for all ready from discovery service.")
-      while(not self.mw_obj.is_ready()): time.sleep(random.uniform(0.0, 1.0))  # sleep between calls
+      self.mw_obj.is_ready() # blocks until discovery tells us we are ready
       self.logger.info("All sub and pub apps registered and ready.")
       time.sleep(random.uniform(2.0, 2.5)) # sleep for a bit to not overwhelm system
       # Now disseminate on our topics
       self.logger.info("Disseminating info on our topics.")
       self.mw_obj.disseminate(self.iters, self.topiclist)
+      # let the subscribers (and broker) following discovery's change feed know we are gone
+      self.mw_obj.deregister(self.name, self.topiclist)
     except Exception as e: handle_exception(e)
 
 """Parse command line arguments"""
@@ -128,6 +130,34 @@ def parseCmdLineArgs():
     "-i", "--iters", type=int, default=1000, 
     help="number of publication iterations (default: 1000)"
   )
+  parser.add_argument(
+    "-b", "--batch", type=int, default=10000, 
+    help="publications of each topic to generate ahead of sending them (default: 10000)"
+  )
+  parser.add_argument(
+    "-s", "--size", type=int, default=0, 
+    help="bytes to pad or cut each payload to, 0 keeps them as generated (default: 0)"
+  )
+  parser.add_argument(
+    "-r", "--rate", type=float, default=0, 
+    help="publications per second to send on each topic, 0 sends as fast as we can (default: 0)"
+  )
+  parser.add_argument(
+    "--arrivals", default="token", choices=["token", "poisson"], 
+    help="evenly spaced (token) or poisson publications when paced (default: token)"
+  )
+  parser.add_argument(
+    "--burst", type=int, default=1, 
+    help="publications to send back to back each time when paced (default: 1)"
+  )
+  parser.add_argument(
+    "--schedule", default=None, 
+    help="csv file to save the schedule achieved when paced to (default: none)"
+  )
+  parser.add_argument(
+    "--lease", type=float, default=10,
+    help="seconds our registration lasts without a heartbeat, 0 keeps it for good (default: 10)"
+  )
   parser.add_argument(
     "-l", "--loglevel", type=int, default=logging.INFO, 
     choices=[
@@ -136,7 +166,10 @@ def parseCmdLineArgs():
     ], 
     help="logging level, choices 10,20,30,40,50: default 20=logging.INFO"
   )
-  return parser.parse_args()
+  args = parser.parse_args()
+  # the publications are generated in batches of this size (so an empty batch would never get any out)
+  if args.batch < 1: parser.error("argument -b/--batch: must be at least 1")
+  return args
 
 """Main program"""
 def main():
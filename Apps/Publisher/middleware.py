@@ -17,14 +17,19 @@
 #     service (when instructed) to see if it is fine to start dissemination
 # (4) It must do the actual dissemination activity of the topic data when 
 #     instructed by the 
+# (5) Our registration is leased: we keep it alive with heartbeats (from a
+#     thread of our own) for as long as we run, so if we crash discovery drops
+#     us and our subscribers stop trying to reach us.
 #
 # Import statements
 import sys, os, zmq
 sys.path.append(os.getcwd())
 from Apps.Common.common import handle_exception, \
-  disseminate, register, is_ready
+  disseminate, register, deregister, wait_until_ready
 from Apps.Common import discovery_pb2
 from Apps.Common.topic_selector import TopicSelector
+from Apps.Publisher.pacer import Pacer
+from Apps.Common.heartbeat import Heartbeat
 
 """Publisher Middleware class"""
 class PublisherMW():
@@ -37,6 +42,15 @@ class PublisherMW():
     self.poller = None    # used to wait on incoming replies
     self.addr = None      # our advertised IP address
     self.port = None      # port num where we are going to publish our topics
+    self.batch = None     # publications of each topic generated at a time (ahead of sending them)
+    self.payload_size = None # bytes each payload is padded or cut to (None keeps them as generated)
+    self.pacer = None     # paces our publications to a target rate (None sends as fast as we can)
+    self.schedule_file = None # where to save the schedule the pacer achieved (if anywhere)
+    self.deregister_timeout = 5000 # ms to wait on discovery to take us out of the registry
+    self.lease = None     # seconds our registration lasts without a heartbeat (None = for good)
+    self.heartbeat = None # sends the heartbeats that keep our lease alive
+    self.context = None   # the ZMQ context (for the heartbeat's socket)
+    self.discovery = None # the IP addr:port of the discovery service (for the heartbeats)
 
   """configure/initialize"""
   def configure(self, args):
@@ -44,12 +58,21 @@ class PublisherMW():
       self.logger.debug("PublisherMW::configure")
       # First retrieve our advertised IP addr and the publication port num
       self.port = args.port
+      self.batch = args.batch
+      self.payload_size = args.size or None
+      if args.rate: self.pacer = Pacer(self.logger, args.rate, args.arrivals, args.burst)
+      self.schedule_file = args.schedule
       self.addr = args.addr
+      self.lease = args.lease or None
+      self.discovery = args.discovery
       # Next setup ZMQ
-      context = zmq.Context()  # returns a singleton object
+      context = self.context = zmq.Context()  # returns a singleton object
       self.poller = zmq.Poller()
       # Now setup the sockets
       self.req = context.socket(zmq.REQ)
+      # let us send a new request even if discovery never answered the last one
+      self.req.setsockopt(zmq.REQ_RELAXED, 1)
+      self.req.setsockopt(zmq.REQ_CORRELATE, 1)
       self.pub = context.socket(zmq.PUB)
       self.poller.register(self.req, zmq.POLLIN)
       connect_str = "tcp://" + args.discovery
@@ -67,29 +90,47 @@ class PublisherMW():
       # First build a register req message
       register_req = discovery_pb2.RegisterReq()
       register(self.logger, register_req.PUBLISHER, name, 
-               self.addr, self.port, self.req, topiclist=topiclist)
+               self.addr, self.port, self.req, topiclist=topiclist, lease=self.lease)
       # now go to our event loop to receive a response to this request
-      return self.event_loop()
+      result = self.event_loop()
+      # keep our registration alive from here on
+      if self.lease:
+        self.heartbeat = Heartbeat(self.logger, register_req.PUBLISHER, name, self.addr, self.port, topiclist, self.lease)
+        self.heartbeat.start(self.context, self.discovery)
+      return result
     except Exception as e: handle_exception(e)
 
-  """check if the discovery service gives the green light to proceed"""
-  def is_ready(self):
+  """deregister with the discovery service using the common function
+  (we are on our way out, so we do not wait on discovery for long)"""
+  def deregister(self, name, topiclist):
+    try:
+      self.logger.debug("PublisherMW::deregister")
+      # a heartbeat after we are gone would only register us again
+      if self.heartbeat: self.heartbeat.stop()
+      register_req = discovery_pb2.RegisterReq()
+      deregister(self.logger, register_req.PUBLISHER, name,
+                 self.addr, self.port, self.req, topiclist=topiclist)
+      return self.event_loop(timeout=self.deregister_timeout)
+    except Exception as e: handle_exception(e)
+
+  """wait for the discovery service to give the green light to proceed
+  (returns False if it has not after timeout seconds, None waits for as long as it takes)"""
+  def is_ready(self, timeout=None):
     try:
       self.logger.debug("PublisherMW::is_ready")
-      is_ready(self.logger, self.req)
-      # now go to our event loop to receive a response to this request
-      return self.event_loop()
+      return wait_until_ready(self.logger, self.req, self.event_loop, timeout)
     except Exception as e: handle_exception(e)
 
   """run the event loop where we expect to receive a reply to a sent request"""
-  def event_loop(self):
+  def event_loop(self, timeout=None):
     try:
       self.logger.debug("PublisherMW::event_loop - run the event loop")
       while True:
-        # poll for events. We give it an infinite timeout.
+        # poll for events. We give it an infinite timeout unless told otherwise.
         # The return value is a socket to event mask mapping
-        events = dict(self.poller.poll())
+        events = dict(self.poller.poll(timeout=timeout))
         if self.req in events: return self.handle_reply()
+        if timeout != None: return None # nothing came back in time
     except Exception as e: handle_exception(e)
 
   """handle an incoming reply"""
@@ -102,7 +143,7 @@ class PublisherMW():
       disc_resp = discovery_pb2.DiscoveryResp()
       disc_resp.ParseFromString(bytesRcvd)
       # Depending on the message type, the contents of the msg will differ
-      if(disc_resp.msg_type == discovery_pb2.REGISTER):
+      if(disc_resp.msg_type == discovery_pb2.REGISTER or disc_resp.msg_type == discovery_pb2.DEREGISTER):
         if disc_resp.register_resp.result == discovery_pb2.RegisterResp().Result.FAILURE:
           raise Exception(disc_resp.register_resp.fail_reason) # return register error
         else: return disc_resp.register_resp.result # return response to register
@@ -116,11 +157,34 @@ class PublisherMW():
       try:
         self.logger.debug("PublisherMW::disseminate")
         ts = TopicSelector()
-        for i in range(iters):
-          # Here, we choose to disseminate on all topics that we publish.  
-          # Also, we don't care about their values. But in future assignments, this can change.
-          for topic in topiclist:
-            data = topic + ":" + ts.gen_publication(topic)
-            disseminate(self.logger, self.pub, data)
+        # the topic frames never change, so only encode them once
+        topic_frames = {topic: topic.encode('utf-8') for topic in topiclist}
+        if self.pacer: return self.disseminate_paced(ts, iters, topiclist, topic_frames)
+        for start in range(0, iters, self.batch):
+          # generate the next batch of payloads up front so that we only have to send them below
+          count = min(self.batch, iters - start)
+          payloads = {topic: ts.gen_publications(topic, count, self.payload_size) for topic in topiclist}
+          for i in range(count):
+            # Here, we choose to disseminate on all topics that we publish.  
+            # Also, we don't care about their values. But in future assignments, this can change.
+            for topic in topiclist:
+              disseminate(self.logger, self.pub, topic_frames[topic], payloads[topic][i])
+        self.logger.info("Dissemination finished. Exiting.")
+      except Exception as e: handle_exception(e)
+
+  """disseminate iters publications on each topic, each one when our pacer says it is due"""
+  def disseminate_paced(self, ts, iters, topiclist, topic_frames):
+      try:
+        self.logger.debug("PublisherMW::disseminate_paced")
+        # the first batch of payloads is generated before the clock starts
+        sent = {topic: 0 for topic in topiclist}
+        payloads = {topic: ts.gen_publications(topic, min(self.batch, iters), self.payload_size) for topic in topiclist}
+        for topic in self.pacer.schedule(topiclist, iters):
+          # generate the next batch of payloads of the topic once we have sent the last one
+          i = sent[topic] % self.batch
+          if i == 0 and sent[topic]: payloads[topic] = ts.gen_publications(topic, min(self.batch, iters - sent[topic]), self.payload_size)
+          disseminate(self.logger, self.pub, topic_frames[topic], payloads[topic][i])
+          sent[topic] += 1
+        self.pacer.report(topiclist, self.schedule_file)
         self.logger.info("Dissemination finished. Exiting.")
       except Exception as e: handle_exception(e)
@@ -0,0 +1,78 @@
+###############################################
+# Author: Patrick Muradaz
+# Vanderbilt University
+# Purpose: Open loop pacing of publications
+# Semester: Spring 2023
+###############################################
+#
+# To measure latency against load we need to offer a known load. The pacer
+# works out when each publication is due up front (a target rate per topic,
+# either evenly spaced like a token bucket or as Poisson arrivals, optionally
+# in bursts of several publications at once) and never moves that schedule:
+# if sending falls behind, the publications that are due go out right away
+# instead of the rest of the schedule sliding back. Both the time each
+# publication was due and the time it was actually sent are recorded, so
+# latencies can be taken from when a publication was due, which keeps a
+# stall from hiding the delay of everything queued up behind it.
+#
+# Import statements
+import sys, os, time, heapq, random
+from array import array
+sys.path.append(os.getcwd())
+from Apps.Common.common import handle_exception
+
+"""Pacer class"""
+class Pacer():
+
+  """constructor"""
+  def __init__(self, logger, rate, mode="token", burst=1, seed=None):
+    self.logger = logger    # internal logger for print statements
+    self.rate = rate        # target publications per second (per topic)
+    self.mode = mode        # "token" (evenly spaced) or "poisson" (exponential gaps)
+    self.burst = burst      # publications sent back to back each time (same average rate)
+    self.random = random.Random(seed) # for the poisson gaps
+    self.topics = array("H") # index into the topic list of each publication sent
+    self.due = array("q")    # ns (since the epoch) each publication was due
+    self.sent = array("q")   # ns (since the epoch) each publication was actually sent
+
+  """get the ns until the next burst is due"""
+  def gap(self):
+    try:
+      if self.mode == "poisson": return int(self.random.expovariate(self.rate / self.burst) * 1e9)
+      return int(self.burst / self.rate * 1e9)
+    except Exception as e: handle_exception(e)
+
+  """yield the topic of each publication to send (count per topic) when it is due"""
+  def schedule(self, topiclist, count):
+    try:
+      self.logger.debug("Pacer::schedule")
+      start = time.time_ns()
+      # (due time, topic index) of the next burst of each topic
+      bursts = [(start, i) for i in range(len(topiclist))]
+      left = [count] * len(topiclist)
+      while bursts:
+        due, i = heapq.heappop(bursts)
+        wait = due - time.time_ns()
+        if wait > 0: time.sleep(wait / 1e9)
+        for _ in range(min(self.burst, left[i])):
+          self.topics.append(i); self.due.append(due); self.sent.append(time.time_ns())
+          yield topiclist[i]
+        left[i] -= min(self.burst, left[i])
+        if left[i]: heapq.heappush(bursts, (due + self.gap(), i))
+    except Exception as e: handle_exception(e)
+
+  """log how the achieved schedule compares to the target (and save it as csv if given a path)"""
+  def report(self, topiclist, path=None):
+    try:
+      self.logger.debug("Pacer::report")
+      if not self.sent: return
+      lags = sorted(sent - due for sent, due in zip(self.sent, self.due))
+      seconds = max(self.sent[-1] - self.sent[0], 1) / 1e9
+      self.logger.info(f"Paced {len(self.sent)} publications at {len(self.sent) / seconds / len(topiclist):.1f}/s per topic " +
+                       f"(target {self.rate}/s, {self.mode}); lag behind schedule (ms) " +
+                       f"mean: {sum(lags) / len(lags) / 1e6:.3f}, p99: {lags[int(len(lags) * 0.99)] / 1e6:.3f}, max: {lags[-1] / 1e6:.3f}")
+      if path:
+        with open(path, "w") as f:
+          f.write("topic,due_ns,sent_ns\n")
+          for i, due, sent in zip(self.topics, self.due, self.sent): f.write(f"{topiclist[i]},{due},{sent}\n")
+    except Exception as e: handle_exception(e)
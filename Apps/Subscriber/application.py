@@ -59,6 +59,9 @@ class SubscriberAppln():
       # Now setup up our underlying middleware object
       self.mw_obj = SubscriberMW(self.logger)
       self.mw_obj.configure(args)      
+      # every publication of our topics comes to us (on whichever thread/process the middleware picks)
+      self.mw_obj.on_topic(self.handle_publication)
+      if args.batch > 1: self.mw_obj.on_batch(self.handle_batch)
       self.logger.info("Subscriber app configured.")
       dump(self.logger, "SubscriberAppln", self.addr, self.port, 
            name=self.name, topiclist=self.topiclist)
@@ -75,7 +78,7 @@ class SubscriberAppln():
       self.logger.info("Subscriber app registered.")
       # Keep checking with the discovery service if we are ready to go
       self.logger.info("Waiting for all ready from discovery service.")
-      while(not self.mw_obj.is_ready()): time.sleep(0.5)  # sleep between calls
+      self.mw_obj.is_ready() # blocks until discovery tells us we are ready
       self.logger.info("All sub and pub apps registered and ready.")
       time.sleep(random.uniform(0.0, 1.0)) # sleep for a bit to not overwhelm system
       # Now, find the publishers that match our topics
@@ -86,6 +89,18 @@ class SubscriberAppln():
       self.mw_obj.sub_to_pubs(pubs, self.topiclist)
     except Exception as e: handle_exception(e)
 
+  """handle a publication that came in on one of our topics"""
+  def handle_publication(self, topic, payload):
+    try: self.logger.info(f"Message from publisher: {topic}:{str(payload, 'UTF-8')}")
+    except Exception as e: handle_exception(e)
+
+  """handle a batch of publications that came in on our topics (in batch mode)"""
+  def handle_batch(self, batch):
+    try:
+      self.logger.debug(f"SubscriberAppln::handle_batch - {len(batch)} publications")
+      for topic, payload in batch: self.handle_publication(topic, payload)
+    except Exception as e: handle_exception(e)
+
 """Parse command line arguments"""
 def parseCmdLineArgs():
   # instantiate a ArgumentParser object
@@ -113,6 +128,38 @@ def parseCmdLineArgs():
     "-c", "--config", default="Apps/Common/config.ini", 
     help="configuration file (default: Apps/Common/config.ini)"
   )
+  parser.add_argument(
+    "--dispatch", default="inline", choices=["inline", "thread", "process"],
+    help="where publications are handled: on the receiving thread or a pool of threads/processes (default: inline)"
+  )
+  parser.add_argument(
+    "-w", "--workers", type=int, default=1,
+    help="threads/processes in the pool that handles publications (default: 1)"
+  )
+  parser.add_argument(
+    "--queue-size", type=int, default=1000,
+    help="publications queued for each worker before receiving waits for it (default: 1000)"
+  )
+  parser.add_argument(
+    "-b", "--batch", type=int, default=1,
+    help="most publications to receive and hand over at a time, 1 hands them over one by one (default: 1)"
+  )
+  parser.add_argument(
+    "--batch-wait", type=float, default=5,
+    help="most ms to spend draining a batch once its first publication is in (default: 5)"
+  )
+  parser.add_argument(
+    "--cache-ttl", type=float, default=30,
+    help="seconds a pub lookup is cached for, 0 looks up with discovery every time (default: 30)"
+  )
+  parser.add_argument(
+    "--cache-stale", type=float, default=300,
+    help="seconds past its ttl that a cached lookup is still used while it is refreshed (default: 300)"
+  )
+  parser.add_argument(
+    "--cache-file", default=None,
+    help="file to keep cached lookups in across restarts (default: none)"
+  )
   parser.add_argument(
     "-l", "--loglevel", type=int, default=logging.INFO, 
     choices=[
@@ -0,0 +1,232 @@
+###############################################
+# Author: Patrick Muradaz
+# Vanderbilt University
+# Purpose: Hands received publications to the subscriber's handlers
+# Semester: Spring 2023
+###############################################
+#
+# The subscriber middleware receives publications as fast as it can and hands
+# each one to the handler registered for its topic (or the default handler).
+# The handlers can run:
+#   - inline: on the receiving thread (a slow handler slows down receiving),
+#   - thread: on a pool of threads (good for handlers that wait on I/O),
+#   - process: on a pool of processes (good for CPU heavy handlers, as each
+#     process has its own GIL; handlers must be registered before we start).
+# A topic always goes to the same worker, so the publications of a topic are
+# handled in the order they were received. Each worker has a bounded queue: when
+# it is full, receiving waits for room (and ZMQ's high water marks push back on
+# the publishers from there), so a slow handler never makes us run out of memory.
+# The depth of each queue (and how often we had to wait on one) is kept track
+# of and logged every so often. A handler that raises is logged and the worker
+# carries on with the next publication (a worker that dies anyway is noticed
+# the next time we wait on its queue, instead of waiting on it forever).
+#
+# In batch mode a whole batch of publications is dispatched at once: it is split
+# up by worker (so a topic still goes to its own worker, in order) and each part
+# goes on its worker's queue as one item, so the queue depths count batches.
+# The batch goes to the batch handler if one is registered, otherwise each of
+# its publications goes to the handler of its topic.
+#
+# Import statements
+import sys, os, time, queue, threading, multiprocessing
+sys.path.append(os.getcwd())
+from Apps.Common.common import handle_exception, shard_of
+
+"""Dispatcher class"""
+class Dispatcher():
+
+  """constructor"""
+  def __init__(self, logger, mode="inline", workers=1, queue_size=1000, report_interval=10):
+    self.logger = logger          # internal logger for print statements
+    self.mode = mode              # "inline", "thread" or "process"
+    self.workers = workers        # threads/processes in the pool
+    self.queue_size = queue_size  # publications each worker's queue holds before receiving waits
+    self.report_interval = report_interval # seconds between logging the queue metrics (0 = never)
+    self.handlers = {}            # topic -> handler(topic, payload)
+    self.topic_workers = {}       # topic -> the worker that handles it (filled in as the topics are first seen)
+    self.default_handler = None   # handler for topics without one of their own
+    self.batch_handler = None     # handler(batch) for whole batches (in batch mode)
+    self.queues = []              # each worker's queue of (topic, payload) or Batch
+    self.pool = []                # the worker threads/processes
+    self.handled = []             # publications each worker has handled (shared with the processes)
+    self.dispatched = 0           # publications handed to a handler (or a queue)
+    self.waits = 0                # times receiving had to wait for room in a queue
+    self.max_depths = []          # deepest each worker's queue has been
+    self.last_report = time.monotonic()
+
+  """register the handler for a topic (all topics without one of their own if none is given)"""
+  def on_topic(self, handler, topic=None):
+    try:
+      if self.pool and self.mode == "process": raise Exception("Handlers must be registered before the process pool is started")
+      if topic == None: self.default_handler = handler
+      else: self.handlers[topic] = handler
+    except Exception as e: handle_exception(e)
+
+  """register the handler for whole batches (instead of handing out their publications one by one)"""
+  def on_batch(self, handler):
+    try:
+      if self.pool and self.mode == "process": raise Exception("Handlers must be registered before the process pool is started")
+      self.batch_handler = handler
+    except Exception as e: handle_exception(e)
+
+  """start the pool of workers (nothing to start when handling inline)"""
+  def start(self):
+    try:
+      self.logger.debug("Dispatcher::start")
+      if self.mode == "inline": return
+      self.max_depths = [0] * self.workers
+      for i in range(self.workers):
+        if self.mode == "process":
+          # the processes are forked, so they get the handlers as they are now
+          self.queues.append(multiprocessing.Queue(maxsize=self.queue_size))
+          self.handled.append(multiprocessing.Value("q", 0, lock=False))
+          worker = multiprocessing.Process(target=self.work, args=(i,), daemon=True)
+        else:
+          self.queues.append(queue.Queue(maxsize=self.queue_size))
+          self.handled.append(Counter())
+          worker = threading.Thread(target=self.work, args=(i,), daemon=True)
+        worker.start()
+        self.pool.append(worker)
+      self.logger.info(f"Handling publications on {self.workers} {self.mode}(s), queues of {self.queue_size}")
+    except Exception as e: handle_exception(e)
+
+  """hand a publication to its handler (right away when inline, otherwise to the queue of its topic's worker)"""
+  def dispatch(self, topic, payload):
+    try:
+      self.dispatched += 1
+      if self.report_interval and not self.dispatched % 1024 and time.monotonic() - self.last_report >= self.report_interval:
+        self.report()
+      if self.mode == "inline": return self.handle(topic, payload)
+      # a process gets a copy of the payload (the received frame stays with us)
+      if self.mode == "process": payload = bytes(payload)
+      i = self.topic_workers.get(topic)
+      if i == None: i = self.worker_of(topic)
+      self.enqueue(i, (topic, payload))
+    except Exception as e: handle_exception(e)
+
+  """hand a batch of publications to the batch handler (or each to the handler of its topic)
+  right away when inline, otherwise split up by worker and onto their queues"""
+  def dispatch_batch(self, batch):
+    try:
+      self.dispatched += len(batch)
+      if self.report_interval and time.monotonic() - self.last_report >= self.report_interval: self.report()
+      if self.mode == "inline": return self.handle_batch(batch)
+      if self.workers == 1: parts = {0: batch}
+      else:
+        parts, topic_workers = {}, self.topic_workers
+        for topic, payload in batch:
+          i = topic_workers.get(topic)
+          if i == None: i = self.worker_of(topic)
+          parts.setdefault(i, Batch()).append(topic, payload)
+      for i, part in parts.items():
+        # a process gets a copy of the payloads (the received frames stay with us)
+        if self.mode == "process": part.payloads = [bytes(payload) for payload in part.payloads]
+        self.enqueue(i, part)
+    except Exception as e: handle_exception(e)
+
+  """get the worker that handles the given topic (the topics are a small fixed set, so it is
+  only worked out the first time a topic is seen and then kept in topic_workers)"""
+  def worker_of(self, topic):
+    try:
+      i = self.topic_workers[topic] = shard_of(topic, self.workers) if self.workers > 1 else 0
+      return i
+    except Exception as e: handle_exception(e)
+
+  """put an item (a publication or a batch) on the given worker's queue"""
+  def enqueue(self, i, item):
+    try:
+      try: self.queues[i].put_nowait(item)
+      except queue.Full:
+        # wait for the worker to make room (which holds up receiving, and in turn the publishers)
+        self.waits += 1
+        while True:
+          try: self.queues[i].put(item, timeout=1); break
+          except queue.Full:
+            if not self.pool[i].is_alive(): raise Exception(f"Dispatcher worker {i} ({self.mode}) is no longer running")
+      depth = self.queues[i].qsize()
+      if depth > self.max_depths[i]: self.max_depths[i] = depth
+    except Exception as e: handle_exception(e)
+
+  """hand a publication to the handler of its topic"""
+  def handle(self, topic, payload):
+    try:
+      handler = self.handlers.get(topic, self.default_handler)
+      if handler: handler(topic, payload)
+    except Exception as e: handle_exception(e)
+
+  """hand a batch to the batch handler (or each of its publications to the handler of its topic)"""
+  def handle_batch(self, batch):
+    try:
+      if self.batch_handler: return self.batch_handler(batch)
+      for topic, payload in batch: self.handle(topic, payload)
+    except Exception as e: handle_exception(e)
+
+  """handle the publications in the given worker's queue until told to stop (on the worker's thread/process)"""
+  def work(self, i):
+    try:
+      publications, handled = self.queues[i], self.handled[i]
+      while True:
+        publication = publications.get()
+        if publication == None: return
+        # a handler that raises costs us its publication(s), not the worker
+        try:
+          if isinstance(publication, Batch): self.handle_batch(publication)
+          else: self.handle(*publication)
+        except Exception: self.logger.exception(f"Handler raised on worker {i}, carrying on")
+        handled.value += len(publication) if isinstance(publication, Batch) else 1
+    except Exception as e: handle_exception(e)
+
+  """get the queue metrics: the depth of each worker's queue (now and at its deepest) and the publications handled"""
+  def metrics(self):
+    try:
+      return {"mode": self.mode, "dispatched": self.dispatched, "waits": self.waits,
+              "depths": [publications.qsize() for publications in self.queues],
+              "max_depths": list(self.max_depths),
+              "handled": [handled.value for handled in self.handled]}
+    except Exception as e: handle_exception(e)
+
+  """log the queue metrics"""
+  def report(self):
+    try:
+      self.last_report = time.monotonic()
+      metrics = self.metrics()
+      self.logger.info(f"Dispatched {metrics['dispatched']} publications ({metrics['mode']}), waited on a full queue " +
+                       f"{metrics['waits']} times; queue depths: {metrics['depths']}, deepest: {metrics['max_depths']}")
+    except Exception as e: handle_exception(e)
+
+  """let the workers finish what is in their queues and stop them"""
+  def stop(self):
+    try:
+      self.logger.debug("Dispatcher::stop")
+      for publications in self.queues: publications.put(None)
+      for worker in self.pool: worker.join()
+      self.pool = []
+    except Exception as e: handle_exception(e)
+
+"""a batch of publications (the topics and payloads in the order they were received)"""
+class Batch():
+
+  """constructor"""
+  def __init__(self):
+    self.topics = []      # the topic of each publication
+    self.payloads = []    # the payload of each publication
+
+  """add a publication to the batch"""
+  def append(self, topic, payload):
+    self.topics.append(topic)
+    self.payloads.append(payload)
+
+  """the number of publications in the batch"""
+  def __len__(self):
+    return len(self.topics)
+
+  """go through the publications as (topic, payload)"""
+  def __iter__(self):
+    return zip(self.topics, self.payloads)
+
+"""a count with the same .value as a multiprocessing.Value (for the thread pool)"""
+class Counter():
+
+  """constructor"""
+  def __init__(self):
+    self.value = 0
@@ -21,13 +21,38 @@
 # (5) On receipt of a subscription, determine which topic it is and let the 
 #     application level handle the incoming data. To that end, you may need to 
 #     make an upcall to the application-level object.
+# (6) A sharded broker is given its own SUB socket per shard, filtering on just
+#     the topics that shard carries (discovery tells us which those are).
+# (7) If the broker keeps the last values of its topics, we fetch a snapshot of
+#     ours once we are subscribed and hand those out first. The live stream then
+#     carries sequence numbers, so whatever the snapshot already covered is
+#     dropped (and anything we missed in between is noticed). The sequence
+#     numbers come with the epoch of the broker's start, so when it changes the
+#     broker restarted and we start over from its new numbers (and snapshot).
+# (8) With direct dissemination, discovery gives us a registry change feed when
+#     we register. We follow it (for our topics) from before our lookup on, and
+#     connect to pubs that register later and disconnect from pubs that leave.
+#     Each topic's changes are numbered, so if we miss one we look up again.
+# (9) Lookups are answered from a local cache while they are fresh (and while
+#     they are stale for a while longer, as they are refreshed in the background,
+#     see Apps/Common/endpoint_cache.py). If a refresh finds other pubs than we
+#     are connected to, we connect to/disconnect from them.
+# (10) Each publication is handed to the handler the application registered for
+#     its topic, inline or on a pool of threads/processes (see dispatcher.py).
+# (11) In batch mode, once a publication is in we drain whatever else is already
+#     waiting (without blocking, up to a batch size or a time limit), decode the
+#     batch in one go and hand it over as a whole, which spreads the per call
+#     overhead of receiving and dispatching over the whole batch.
 #
 # Import statements
-import sys, os, zmq, json
+import sys, os, zmq, json, time
+from collections import deque
 sys.path.append(os.getcwd())
 from Apps.Common.common import handle_exception, \
-  send_message, register, is_ready
+  send_message, register, wait_until_ready
 from Apps.Common import discovery_pb2
+from Apps.Common.endpoint_cache import EndpointCache
+from Apps.Subscriber.dispatcher import Dispatcher, Batch
 
 """Subscriber Middleware class"""
 class SubscriberMW():
@@ -37,7 +62,28 @@ class SubscriberMW():
     self.logger = logger  # internal logger for print statements
     self.req = None       # will be a ZMQ REQ socket for register with discovery
     self.sub = None       # will be a ZMQ REQ socket for subscriptions
+    self.subs = []        # every SUB socket we receive on (self.sub and/or one per broker shard)
+    self.ready_subs = []  # the SUB sockets that have publications waiting from the last poll
+    self.context = None   # the ZMQ context (to make a socket per broker shard)
     self.poller = None    # used to wait on incoming subscriptions
+    self.sub_poller = None # used to wait on publications when we have more than one SUB socket
+    self.snapshot_values = deque() # (topic, payload) from broker snapshots, handed out before the live stream
+    self.seqs = {}        # topic -> sequence number of the last publication we got (from a broker with a last value cache)
+    self.epochs = {}      # topic -> epoch of the broker start that numbered it
+    self.snapshot_addrs = {} # topic -> the snapshot endpoint of the broker that carries it
+    self.snapshot_timeout = 5000 # ms to wait for a snapshot before going on without it
+    self.feed = None      # will be a ZMQ SUB socket for discovery's registry change feed (if we get one)
+    self.feed_addr = None # where discovery publishes its registry changes
+    self.feed_versions = {} # topic -> version of the last registry change we applied
+    self.pub_addrs = {}   # address -> SUB socket of every publisher (or broker shard) we are connected to
+    self.topiclist = None # the topics we subscribe to
+    self.endpoint_cache = None # our cache of lookups (None looks up with discovery every time)
+    self.discovery = None # the IP addr:port of the discovery service (for the cache's refresher)
+    self.dispatcher = None # hands each publication to the application's handler for its topic
+    self.batch_size = 1   # most publications received (and handed over) at a time (1 = one by one)
+    self.batch_wait = 0.005 # most seconds spent draining a batch once its first publication is in
+    self.topic_names = {} # topic frame -> topic (so each topic is only decoded once in batch mode)
+    self.drain_turn = 0   # the SUB socket that was drained first for the last batch
     self.addr = None      # advertised IP address (might not be necessary)
     self.port = None      # port num (might not be necessary)
     self.name = None      # the name of this publisher
@@ -50,18 +96,42 @@ class SubscriberMW():
       self.port = args.port
       self.addr = args.addr
       self.name = args.name
+      self.discovery = args.discovery
+      if args.cache_ttl: self.endpoint_cache = EndpointCache(self.logger, args.cache_ttl, args.cache_stale, args.cache_file)
+      self.dispatcher = Dispatcher(self.logger, args.dispatch, args.workers, args.queue_size)
+      self.batch_size = args.batch
+      self.batch_wait = args.batch_wait / 1000
       # setup ZMQ
-      context = zmq.Context()
+      self.context = zmq.Context()
       self.poller = zmq.Poller()
+      self.sub_poller = zmq.Poller()
       # Now setup the sockets
-      self.req = context.socket(zmq.REQ)
-      self.sub = context.socket(zmq.SUB)
+      self.req = self.context.socket(zmq.REQ)
+      # let us send a new request even if discovery never answered the last one
+      self.req.setsockopt(zmq.REQ_RELAXED, 1)
+      self.req.setsockopt(zmq.REQ_CORRELATE, 1)
+      self.sub = self.context.socket(zmq.SUB)
       self.poller.register(self.req, zmq.POLLIN)
       connect_str = "tcp://" + args.discovery
       self.req.connect(connect_str)
       self.logger.debug(f"DiscoveryMW::configure - connected to: {connect_str}")
     except Exception as e: handle_exception(e)
 
+  """register the application's handler(topic, payload) for the publications of a topic
+  (or of every topic without a handler of its own if no topic is given)"""
+  def on_topic(self, handler, topic=None):
+    try:
+      self.logger.debug("SubscriberMW::on_topic")
+      self.dispatcher.on_topic(handler, topic)
+    except Exception as e: handle_exception(e)
+
+  """register the application's handler(batch) for the batches of publications (in batch mode)"""
+  def on_batch(self, handler):
+    try:
+      self.logger.debug("SubscriberMW::on_batch")
+      self.dispatcher.on_batch(handler)
+    except Exception as e: handle_exception(e)
+
   """register with the discovery service"""
   def register(self, name, topiclist):
     try:
@@ -74,19 +144,23 @@ class SubscriberMW():
       return self.event_loop()
     except Exception as e: handle_exception(e)
 
-  """check if the discovery service gives the green light to proceed"""
-  def is_ready(self):
+  """wait for the discovery service to give the green light to proceed
+  (returns False if it has not after timeout seconds, None waits for as long as it takes)"""
+  def is_ready(self, timeout=None):
     try:
-      self.logger.debug("PublisherMW::is_ready")
-      is_ready(self.logger, self.req)
-      # now go to our event loop to receive a response to this request
-      return self.event_loop()
+      self.logger.debug("SubscriberMW::is_ready")
+      return wait_until_ready(self.logger, self.req, self.event_loop, timeout)
     except Exception as e: handle_exception(e)
 
-  """locate all of the publishers that we care about"""
-  def locate_pubs(self, topiclist):
+  """locate all of the publishers that we care about (from our cache unless told otherwise)"""
+  def locate_pubs(self, topiclist, cached=True):
     try:
       self.logger.debug("SubscriberMW::locate_pubs")
+      # follow the changes from here on, so none that happen after the lookup are missed
+      if self.feed_addr and not self.feed: self.follow_feed(topiclist)
+      if self.endpoint_cache and cached:
+        publishers = self.endpoint_cache.get(self.endpoint_cache.key(topiclist))
+        if publishers != None: return publishers
       # build the request message
       disc_req = discovery_pb2.DiscoveryReq()
       getpubs_msg = discovery_pb2.LookupPubByTopicReq()
@@ -99,6 +173,7 @@ class SubscriberMW():
       # now go to our event loop to receive a response to this request
       self.logger.debug("SubscriberMW::locate_pubs - now wait for reply")
       publishers = self.event_loop()
+      if self.endpoint_cache: self.endpoint_cache.put(self.endpoint_cache.key(topiclist), publishers)
       return publishers
     except Exception as e: handle_exception(e)
 
@@ -110,36 +185,227 @@ class SubscriberMW():
       for topic in topiclist:
         self.logger.debug(f"SubscriberMW::sub_to_pubs - topic: {topic}")
         self.sub.setsockopt(zmq.SUBSCRIBE, topic.encode('utf-8'))
+      self.topiclist = topiclist
+      # start the handlers before any of our threads (so that a process pool is forked from just this one)
+      self.dispatcher.start()
+      # pubs that show up later through the feed are connected on self.sub
+      if self.feed: self.sub_socket()
+      # keep our lookup fresh in the background (and follow what it finds if we connect to pubs directly)
+      if self.endpoint_cache:
+        self.sub_poller.register(self.endpoint_cache.start(self.context, self.discovery, self.name), zmq.POLLIN)
       # Then subscribe to each publisher we care about
       for pub in pubs:
         p = json.loads(pub)
         pub_addr = f"tcp://{p['ip']}:{p['port']}"
-        self.sub.connect(pub_addr)
+        if pub_addr in self.pub_addrs: continue
+        self.pub_addrs[pub_addr] = self.sub_socket(p.get("topics"))
+        self.pub_addrs[pub_addr].connect(pub_addr)
         self.logger.info(f"Subscribed to publisher: {pub_addr}")
+        # now that we are subscribed, catch up on what was published before we got here
+        if "snapshot" in p: self.fetch_snapshot(f"tcp://{p['ip']}:{p['snapshot']}", p.get("topics") or topiclist)
       # Then listen from messages from our subscriptions
       self.listen_to_pubs()      
     except Exception as e: handle_exception(e)
 
+  """get the SUB socket to connect to a publisher on (a broker shard
+  only carries the given topics, so it gets a socket that filters on just those)"""
+  def sub_socket(self, topics=None):
+    try:
+      sub = self.sub
+      if topics:
+        sub = self.context.socket(zmq.SUB)
+        for topic in topics: sub.setsockopt(zmq.SUBSCRIBE, topic.encode('utf-8'))
+      if sub not in self.subs:
+        self.subs.append(sub)
+        self.sub_poller.register(sub, zmq.POLLIN)
+      return sub
+    except Exception as e: handle_exception(e)
+
+  """subscribe to the registry changes of the given topics on discovery's change feed"""
+  def follow_feed(self, topiclist):
+    try:
+      self.logger.debug("SubscriberMW::follow_feed")
+      self.feed = self.context.socket(zmq.SUB)
+      for topic in topiclist: self.feed.setsockopt(zmq.SUBSCRIBE, topic.encode('utf-8'))
+      self.feed.connect(self.feed_addr)
+      self.sub_poller.register(self.feed, zmq.POLLIN)
+      self.logger.info(f"Following registry changes on: {self.feed_addr}")
+    except Exception as e: handle_exception(e)
+
+  """apply a change from the registry change feed to our connections
+  (if we missed one of the topic's changes, we look up all of our pubs again)"""
+  def apply_change(self):
+    try:
+      self.logger.debug("SubscriberMW::apply_change")
+      change = discovery_pb2.RegistryChange()
+      change.ParseFromString(self.feed.recv_multipart()[-1])
+      last = self.feed_versions.get(change.topic)
+      self.feed_versions[change.topic] = change.version
+      if last != None and change.version != last + 1:
+        self.logger.warning(f"Missed registry changes of topic: {change.topic}, looking up our pubs again")
+        return self.resync(self.locate_pubs(self.topiclist, cached=False))
+      if self.endpoint_cache: self.endpoint_cache.apply(change)
+      pub_addr = f"tcp://{change.publisher.ip}:{change.publisher.port}"
+      # a pub that registered again somewhere else is moved over to its new address
+      if change.op == discovery_pb2.RegistryChange.UPDATE:
+        prev_addr = f"tcp://{change.previous.ip}:{change.previous.port}"
+        if prev_addr != pub_addr and prev_addr in self.pub_addrs:
+          self.pub_addrs.pop(prev_addr).disconnect(prev_addr)
+          self.logger.info(f"Unsubscribed from publisher: {prev_addr}")
+      # the feed has a change for each topic of a pub, only the first one does anything
+      if change.op != discovery_pb2.RegistryChange.REMOVE and pub_addr not in self.pub_addrs:
+        self.sub.connect(pub_addr); self.pub_addrs[pub_addr] = self.sub
+        self.logger.info(f"Subscribed to publisher: {pub_addr}")
+      elif change.op == discovery_pb2.RegistryChange.REMOVE and pub_addr in self.pub_addrs:
+        self.pub_addrs.pop(pub_addr).disconnect(pub_addr)
+        self.logger.info(f"Unsubscribed from publisher: {pub_addr}")
+    except Exception as e: handle_exception(e)
+
+  """connect to/disconnect from whatever has changed in the given (looked up again) pubs"""
+  def resync(self, pubs):
+    try:
+      self.logger.debug("SubscriberMW::resync")
+      pubs = {f"tcp://{p['ip']}:{p['port']}": p for p in map(json.loads, pubs)}
+      added = [pub_addr for pub_addr in pubs if pub_addr not in self.pub_addrs]
+      removed = [pub_addr for pub_addr in self.pub_addrs if pub_addr not in pubs]
+      for pub_addr in removed: self.pub_addrs.pop(pub_addr).disconnect(pub_addr)
+      for pub_addr in added:
+        self.pub_addrs[pub_addr] = self.sub_socket(pubs[pub_addr].get("topics"))
+        self.pub_addrs[pub_addr].connect(pub_addr)
+      self.logger.info(f"Resynced publishers: {len(added)} added, {len(removed)} removed")
+    except Exception as e: handle_exception(e)
+
+  """get the last values of the given topics from a broker's snapshot endpoint
+  (leaving out those that are no newer than the given epoch and sequence number frame)"""
+  def fetch_snapshot(self, snapshot_addr, topics, after=None):
+    try:
+      self.logger.debug("SubscriberMW::fetch_snapshot")
+      for topic in topics: self.snapshot_addrs[topic] = snapshot_addr
+      req = self.context.socket(zmq.REQ)
+      req.setsockopt(zmq.LINGER, 0)
+      req.connect(snapshot_addr)
+      req.send_multipart([topic.encode('utf-8') for topic in topics])
+      if not req.poll(timeout=self.snapshot_timeout):
+        self.logger.warning(f"No snapshot from: {snapshot_addr}")
+        return req.close()
+      # the number of values and then a topic, payload and epoch and sequence number frame for each of them
+      frames = req.recv_multipart(copy=False)[1:]
+      for i in range(0, len(frames), 3):
+        topic, seq_frame = frames[i].bytes.decode('utf-8'), frames[i + 2].bytes
+        epoch, seq = seq_frame[:8], int.from_bytes(seq_frame[8:], "big")
+        if after and epoch == after[:8] and seq <= int.from_bytes(after[8:], "big"): continue
+        self.snapshot_values.append((topic, frames[i + 1].buffer))
+        self.seqs[topic] = seq; self.epochs[topic] = epoch
+      self.logger.info(f"Got {len(frames) // 3} last values from: {snapshot_addr}")
+      req.close()
+    except Exception as e: handle_exception(e)
+
+  """check the epoch and sequence number frame of a live publication of the given topic
+  (False if a snapshot already gave it to us, so it should be dropped)"""
+  def in_sequence(self, topic, seq_frame):
+    try:
+      epoch, seq = seq_frame[:8], int.from_bytes(seq_frame[8:], "big")
+      last = self.seqs.get(topic)
+      if last != None and epoch != self.epochs.get(topic):
+        # the broker numbers each topic from 1 again when it restarts, so start over from this publication
+        # (and catch up on anything newer that the new broker already has)
+        self.logger.warning(f"Broker of topic: {topic} restarted (at {seq}, we were at {last}), resyncing from its snapshot")
+        self.seqs[topic] = seq; self.epochs[topic] = epoch
+        if topic in self.snapshot_addrs: self.fetch_snapshot(self.snapshot_addrs[topic], [topic], after=seq_frame)
+        return True
+      if last != None and seq <= last: return False
+      if last != None and seq > last + 1:
+        self.logger.warning(f"Missed {seq - last - 1} publications of topic: {topic}")
+      self.seqs[topic] = seq; self.epochs[topic] = epoch
+      return True
+    except Exception as e: handle_exception(e)
+
   """listen to all of our subscribed publishers"""
   def listen_to_pubs(self):
     try:
-      self.logger.debug("BrokerMW::listen_to_pubs")
+      self.logger.debug("SubscriberMW::listen_to_pubs")
+      while self.batch_size > 1:
+        # receive whatever messages are waiting and hand them to the application together
+        self.dispatcher.dispatch_batch(self.recv_batch())
+      while True:
+        # receive messages from the publishers and hand them to the application
+        topic, payload = self.recv_publication()
+        self.dispatcher.dispatch(topic, payload)
+    except Exception as e: handle_exception(e)
+
+  """receive the next publication as (topic, payload), where the payload
+  is a memoryview onto the received frame (nothing is copied or decoded)"""
+  def recv_publication(self):
+    try:
+      if self.snapshot_values: return self.snapshot_values.popleft()
       while True:
-        # receive messages from the publishers
-        message_bytes = self.sub.recv_multipart()
-        message = str(message_bytes[0], 'UTF-8')
-        self.logger.info(f"Message from publisher: {message}")
+        sub = self.subs[0] if len(self.subs) == 1 else self.sub; flags = 0
+        if len(self.sub_poller.sockets) > 1:
+          # take turns between the sockets that had something waiting
+          if not self.ready_subs: self.ready_subs = [s for s, _ in self.sub_poller.poll()]
+          sub = self.ready_subs.pop()
+          if sub == self.feed: self.apply_change(); continue
+          if self.endpoint_cache and sub == self.endpoint_cache.changed:
+            pubs = self.endpoint_cache.get(self.endpoint_cache.recv_changed())
+            if pubs != None: self.resync(pubs)
+            continue
+          # the socket may have been drained since it was polled (by a batch), so never block on it
+          flags = zmq.NOBLOCK
+        try: frames = sub.recv_multipart(flags, copy=False)
+        except zmq.Again: continue
+        topic = frames[0].bytes.decode('utf-8')
+        # a broker with a last value cache adds a sequence number frame
+        if len(frames) > 2 and not self.in_sequence(topic, frames[2].bytes): continue
+        return topic, frames[1].buffer
+    except Exception as e: handle_exception(e)
+
+  """receive the next batch of publications: wait for one and then drain the ones that are already
+  waiting without blocking, until we have batch_size of them or have been at it for batch_wait
+  (the payloads after the first are bytes rather than memoryviews)"""
+  def recv_batch(self):
+    try:
+      batch = Batch()
+      while self.snapshot_values and len(batch) < self.batch_size: batch.append(*self.snapshot_values.popleft())
+      if batch: return batch
+      # block for the first one (this also takes care of registry changes)
+      batch.append(*self.recv_publication())
+      deadline = time.monotonic() + self.batch_wait
+      # take the frames of everything that is waiting, one socket after the other (starting from a different
+      # one each time). The frames are small, so copying them beats a zero copy frame object for each one.
+      received = []; left = self.batch_size - 1
+      self.drain_turn = (self.drain_turn + 1) % len(self.subs)
+      for sub in self.subs[self.drain_turn:] + self.subs[:self.drain_turn]:
+        recv, more = sub.recv, sub.getsockopt
+        while left > 0:
+          try: topic_frame = recv(zmq.NOBLOCK)
+          except zmq.Again: break
+          payload = recv()
+          # a broker with a last value cache adds a sequence number frame
+          received.append((topic_frame, payload, recv() if more(zmq.RCVMORE) else None))
+          left -= 1
+          if not left % 64 and time.monotonic() >= deadline: left = 0
+      # whatever was polled on these sockets has been taken care of (and anything left on them gets polled again)
+      self.ready_subs = [sub for sub in self.ready_subs if sub not in self.subs]
+      # then decode them all in one go
+      names = self.topic_names
+      for topic_frame, payload, seq in received:
+        topic = names.get(topic_frame)
+        if topic == None: topic = names[topic_frame] = topic_frame.decode('utf-8')
+        if seq != None and not self.in_sequence(topic, seq): continue
+        batch.append(topic, payload)
+      return batch
     except Exception as e: handle_exception(e)
 
   """run event loop where we expect to receive replies to sent requests"""
-  def event_loop(self):
+  def event_loop(self, timeout=None):
     try:
       self.logger.debug("BrokerMW::event_loop - run the event loop")
       while True:
-        # poll for events. We give it an infinite timeout.
+        # poll for events. We give it an infinite timeout unless told otherwise.
         # The return value is a socket to event mask mapping
-        events = dict(self.poller.poll())
+        events = dict(self.poller.poll(timeout=timeout))
         if self.req in events: return self.handle_reply()
+        if timeout != None: return None # nothing came back in time
     except Exception as e: handle_exception(e)
             
   """handle an incoming reply"""
@@ -155,7 +421,8 @@ class SubscriberMW():
       if(disc_resp.msg_type == discovery_pb2.REGISTER):
         if disc_resp.register_resp.result == discovery_pb2.RegisterResp().Result.FAILURE:
           raise Exception(disc_resp.register_resp.fail_reason) # return register error
-        else: return disc_resp.register_resp.result # return response to register
+        self.feed_addr = disc_resp.register_resp.feed or None # where to follow the registry changes (if anywhere)
+        return disc_resp.register_resp.result # return response to register
       elif(disc_resp.msg_type == discovery_pb2.ISREADY):
         return disc_resp.is_ready.reply # response to is_ready request
       elif(disc_resp.msg_type == discovery_pb2.LOOKUP_PUB_BY_TOPIC):
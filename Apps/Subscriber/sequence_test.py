@@ -0,0 +1,92 @@
+###############################################
+# Author: Patrick Muradaz
+# Vanderbilt University
+# Purpose: Checks that the subscriber keeps up with a broker's sequence numbers
+# Semester: Spring 2023
+###############################################
+#
+# A broker with a last value cache stamps each publication with the epoch of
+# its start and a per topic sequence number. The subscriber drops what the
+# snapshot already gave it, but a restarted broker numbers its topics from 1
+# again. These checks stamp publications with a cache, restart it (with fewer
+# publications behind it than it is restarted with) and make sure that the
+# subscriber gets every publication exactly once, with its snapshot served by
+# the broker's own snapshot handler.
+#
+# Run with pytest, or on its own: python3 Apps/Subscriber/sequence_test.py
+#
+# Import statements
+import sys, os, logging, threading, zmq
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from Apps.Broker.last_value_cache import LastValueCache
+from Apps.Broker.middleware import BrokerMW
+from Apps.Subscriber.middleware import SubscriberMW
+
+logger = logging.getLogger("SequenceTest")
+
+"""answer snapshot requests from the given worker's cache (swapped out to restart it) until stopped"""
+def serve_snapshots(worker, stop):
+    broker = BrokerMW(logger)
+    while not stop.is_set():
+        if worker["snapshot"].poll(timeout=10): broker.send_snapshot(worker)
+
+"""a subscriber that got its snapshot from the given worker's snapshot endpoint"""
+def subscriber(snapshot_addr, topic):
+    mw = SubscriberMW(logger)
+    mw.context = zmq.Context.instance()
+    mw.fetch_snapshot(snapshot_addr, [topic])
+    return mw
+
+"""hand the given publications to the subscriber as if they came in live (what it
+hands out in the order it would, the snapshot values it was given first)"""
+def receive(mw, topic, publications):
+    received = []
+    for payload, seq_frame in publications:
+        while mw.snapshot_values: received.append(bytes(mw.snapshot_values.popleft()[1]))
+        if mw.in_sequence(topic, seq_frame): received.append(payload)
+    while mw.snapshot_values: received.append(bytes(mw.snapshot_values.popleft()[1]))
+    return received
+
+"""publish on the given topic through the given cache"""
+def publish(lvc, topic, payloads):
+    return [(payload, lvc.stamp(topic, payload)) for payload in payloads]
+
+"""check a subscriber against a cache that is restarted with fewer publications behind it than after it"""
+def test_restart_drops_nothing():
+    context = zmq.Context.instance()
+    worker = {"snapshot": context.socket(zmq.ROUTER), "lvc": LastValueCache(logger, depth=10)}
+    port = worker["snapshot"].bind_to_random_port("tcp://127.0.0.1")
+    stop = threading.Event(); server = threading.Thread(target=serve_snapshots, args=(worker, stop), daemon=True)
+    server.start()
+    try:
+        # the subscriber joins after the first two publications and then gets the third live
+        topic, before = "weather", publish(worker["lvc"], "weather", [b"a1", b"a2"])
+        mw = subscriber(f"tcp://127.0.0.1:{port}", topic)
+        received = receive(mw, topic, before + publish(worker["lvc"], topic, [b"a3"]))
+        assert received == [b"a1", b"a2", b"a3"]
+        # the broker restarts and numbers the topic from 1 again (well under where it was)
+        worker["lvc"] = LastValueCache(logger, depth=10)
+        after = publish(worker["lvc"], topic, [b"b1", b"b2", b"b3", b"b4", b"b5"])
+        # the subscriber only sees the first one live before it resyncs from the new snapshot
+        received = receive(mw, topic, after)
+        assert received == [b"b1", b"b2", b"b3", b"b4", b"b5"]
+        # and carries on with the new broker's numbers from there
+        assert receive(mw, topic, publish(worker["lvc"], topic, [b"b6"])) == [b"b6"]
+    finally:
+        stop.set(); server.join()
+        worker["snapshot"].close(linger=0)
+
+"""a publication that the snapshot already gave us (from the same broker start) is still dropped"""
+def test_snapshot_overlap_dropped():
+    mw = SubscriberMW(logger)
+    lvc = LastValueCache(logger)
+    frames = [lvc.stamp("weather", payload) for payload in (b"a1", b"a2", b"a3")]
+    # the snapshot had the second publication
+    mw.seqs["weather"] = int.from_bytes(frames[1][8:], "big"); mw.epochs["weather"] = frames[1][:8]
+    assert [mw.in_sequence("weather", seq_frame) for seq_frame in frames] == [False, False, True]
+
+"""Main entry point"""
+if __name__ == "__main__":
+    test_restart_drops_nothing()
+    test_snapshot_overlap_dropped()
+    print("Sequence checks passed.")
@@ -20,8 +20,6 @@ import logging  # for logging. Use it in place of print statements.
 import random  # needed in the topic selection using random numbers
 import atexit # needed to handle exiting cleanly
 
-from datetime import datetime
-
 
 # Import our topic selector. Feel free to use alternate way to
 # get your topics of interest
@@ -29,6 +27,8 @@ from topic_selector import TopicSelector
 
 # Now import our CS6381 Middleware
 from CS6381_MW.ActiveSubscriberMW import SubscriberMW
+from CS6381_MW.Common import now_ns, hop_latencies
+from CS6381_MW.Histogram import HistogramRecorder
 
 # import any other packages you need.
 
@@ -52,6 +52,7 @@ class SubscriberAppln ():
         self.latencies = []
         self.output = None
         self.num_topics = None # number of topics to select
+        self.stats = None  # latency histograms (ns) of our phases and of what we receive
 
     ########################################
     # configure/initialize
@@ -75,6 +76,7 @@ class SubscriberAppln ():
             config.read(args.config)
             self.lookup = config["Discovery"]["Strategy"]
             self.dissemination = config["Dissemination"]["Strategy"]
+            self.stats = HistogramRecorder(f'PA2_DEMO/stats/{self.name}_{self.lookup}.hist')
 
             # Now get our topic list of interest
             self.logger.debug(
@@ -126,11 +128,14 @@ class SubscriberAppln ():
             self.logger.info(f"SubscriberAppln - Looking up publishers for: {self.topicList}")
 
             pub_addressses = []
-            lookup_fname = f'PA2_DEMO/stats/{self.name}_{self.lookup}_lookup.csv'
 
             for topic in self.topicList:
 
+                lookup_start = now_ns()
+
                 new_addresses = self.mw_obj.lookup([topic])
+
+                self.stats.record("lookup", now_ns() - lookup_start)
                 
                 for address in new_addresses:
                     pub_addressses.append(address)
@@ -149,8 +154,8 @@ class SubscriberAppln ():
                 result = self.mw_obj.event_loop()
                 self.logger.info(f"SubscriberAppln::driver - Received {result}")
                 
-                # latency = str(datetime.now() - datetime.strptime(result.timestamp, "%m/%d/%Y, %H:%M:%S.%f"))
-                # self.logger.info(f"SubscriberAppln - (latency: {latency.split(':')[-1]}) Received {result}")
+                for hop, ns in hop_latencies(result, self.mw_obj.received_ns).items():
+                    self.stats.record(hop, ns)
                 
         except Exception as e:
             raise e
@@ -16,13 +16,13 @@ import sys    # for syspath and system exception
 import time   # for sleep
 import zmq  # ZMQ sockets
 
-from datetime import datetime
 from kazoo.client import KazooClient
 from kazoo.exceptions import NodeExistsError
 
 # import serialization logic
 from CS6381_MW import discovery_pb2
 from CS6381_MW import topic_pb2
+from CS6381_MW.Common import now_ns
 
 
 class BrokerMW ():
@@ -313,6 +313,8 @@ class BrokerMW ():
             topic_msg.topic = topic
             topic_msg.content = content.content
             topic_msg.timestamp = content.timestamp
+            topic_msg.broker_in = content.broker_in
+            topic_msg.broker_out = now_ns()
 
             buf2send = topic_msg.SerializeToString()
             self.pub.send_multipart([topic, buf2send])
@@ -329,6 +331,7 @@ class BrokerMW ():
 
             # let us first receive all the bytes
             mp_message = self.sub.recv_multipart ()
+            received_ns = now_ns()
 
             topic = mp_message[0]
             bytesRcvd = mp_message[1]
@@ -336,8 +339,7 @@ class BrokerMW ():
             # now use protobuf to deserialize the bytes
             message = topic_pb2.topicMessage()
             message.ParseFromString (bytesRcvd)
-
-            latency = datetime.now() - datetime.strptime(message.timestamp, "%m/%d/%Y, %H:%M:%S.%f")
+            message.broker_in = received_ns
 
             return [topic, message]
 
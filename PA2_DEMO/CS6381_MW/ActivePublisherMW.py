@@ -18,12 +18,12 @@ from kazoo.client import KazooClient
 
 from zk_tools import unpack_znode_val, pack_znode_val
 
-from datetime import datetime
 import time
 
 # import serialization logic
 from CS6381_MW import discovery_pb2
 from CS6381_MW import topic_pb2
+from CS6381_MW.Common import now_ns
 
 class PublisherMW ():
 
@@ -262,7 +262,7 @@ class PublisherMW ():
             topic_msg = topic_pb2.topicMessage()
             topic_msg.topic = topic
             topic_msg.content = content
-            topic_msg.timestamp = datetime.now().strftime("%m/%d/%Y, %H:%M:%S.%f")
+            topic_msg.timestamp = now_ns()
 
             buf2send = topic_msg.SerializeToString()
 
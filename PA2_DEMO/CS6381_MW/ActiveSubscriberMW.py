@@ -6,7 +6,6 @@ import zmq  # ZMQ sockets
 import sys
 import time
 
-from datetime import datetime
 from kazoo.client import KazooClient
 from kazoo.exceptions import NodeExistsError
 
@@ -15,6 +14,7 @@ from zk_tools import unpack_znode_val, pack_znode_val
 # import serialization logic
 from CS6381_MW import discovery_pb2
 from CS6381_MW import topic_pb2
+from CS6381_MW.Common import now_ns
 
 ##################################
 #       Subscriber Middleware class
@@ -31,6 +31,7 @@ class SubscriberMW ():
         self.poller = None  # used to wait on incoming replies
         self.addr = None  # our advertised IP address
         self.port = None  # port num where we are going to look for topics?
+        self.received_ns = None  # when the last topic message was received (see Common.now_ns)
         self.name = None
         self.zk_addr = None
         self.disc_addr = None
@@ -312,6 +313,7 @@ class SubscriberMW ():
 
             # let us first receive all the bytes
             mp_message = self.sub.recv_multipart()
+            self.received_ns = now_ns()
 
             topic = mp_message[0]
             bytesRcvd = mp_message[1]
@@ -319,7 +321,6 @@ class SubscriberMW ():
             # now use protobuf to deserialize the bytes
             message = topic_pb2.topicMessage()
             message.ParseFromString(bytesRcvd)
-            latency = datetime.now() - datetime.strptime(message.timestamp, "%m/%d/%Y, %H:%M:%S.%f")
 
             return message
 
@@ -28,11 +28,10 @@ import configparser  # for configuration parsing
 import logging  # for logging. Use it in place of print statements.
 import zmq  # ZMQ sockets
 
-from datetime import datetime
-
 # import serialization logic
 from CS6381_MW import discovery_pb2
 from CS6381_MW import topic_pb2
+from CS6381_MW.Common import now_ns, hop_latencies
 
 # import any other packages you need.
 
@@ -378,6 +377,8 @@ class BrokerMW ():
 			topic_msg.topic = topic
 			topic_msg.content = content.content
 			topic_msg.timestamp = content.timestamp
+			topic_msg.broker_in = content.broker_in
+			topic_msg.broker_out = now_ns()
 
 			# now let us stringify the buffer and print it. This is actually a sequence of bytes and not
 			# a real string
@@ -402,6 +403,7 @@ class BrokerMW ():
 
 			# let us first receive all the bytes
 			mp_message = self.sub.recv_multipart ()
+			received_ns = now_ns()
 
 			topic = mp_message[0]
 			bytesRcvd = mp_message[1]
@@ -412,8 +414,9 @@ class BrokerMW ():
 
 			print(f'Received a message from publisher: {message.timestamp} {message.topic}')
 
-			latency = datetime.now() - datetime.strptime(message.timestamp, "%m/%d/%Y, %H:%M:%S.%f")
-			print(f'LATENCY WAS: {latency}')
+			latency = hop_latencies(message, received_ns)["total"]
+			message.broker_in = received_ns
+			print(f'LATENCY WAS: {latency / 1e6:.3f} ms')
 			print(f'CONTENT WAS: {message.content}')
 
 			return [topic, message]
@@ -15,3 +15,26 @@
 # the role we are playing and any other common things that we need across
 # all our middleware objects. Make sure then to import this file in those files once
 # some content is added here that is needed by others. 
+
+import time
+
+#################################################################
+# the clock every hop of a topic message is stamped with: ns on the
+# monotonic clock, which is shared by every process on a host (as it is
+# for all the mininet hosts) and is never set back like the wall clock
+#################################################################
+def now_ns():
+    return time.monotonic_ns()
+
+#################################################################
+# the ns a topic message spent on each hop, from its timestamps and
+# the time it was received (now if not given)
+#################################################################
+def hop_latencies(message, received_ns=None):
+    received_ns = received_ns or now_ns()
+    if not message.broker_in:
+        return {"pub_to_sub": received_ns - message.timestamp, "total": received_ns - message.timestamp}
+    return {"pub_to_broker": message.broker_in - message.timestamp,
+            "broker": message.broker_out - message.broker_in,
+            "broker_to_sub": received_ns - message.broker_out,
+            "total": received_ns - message.timestamp}
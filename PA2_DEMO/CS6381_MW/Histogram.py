@@ -0,0 +1,201 @@
+###############################################
+#
+# Author: Patrick Muradaz
+# Vanderbilt University
+#
+# Purpose: Latency histograms for the experiments
+#
+# Created: Spring 2023
+#
+###############################################
+
+# Instead of appending a line to a csv file for every sample, each process keeps
+# a histogram per phase (register, isready, lookup, end to end, each hop, ...)
+# in memory. The buckets are HDR style: exact below 256 and then 128 buckets per
+# power of two, so every value is kept to within 1% using a fixed ~60KB per
+# histogram no matter how many samples go in, and recording a sample is just an
+# index calculation. The histograms are written out every so often (and at exit)
+# to a small binary file, and the files of all our processes can be merged to
+# get the percentiles of the whole experiment (see stats/hist_merge.py).
+
+import os
+import time
+import atexit
+import struct
+from array import array
+
+SUB_BITS = 8                   # values below 2^SUB_BITS get a bucket each
+SUB_COUNT = 1 << SUB_BITS
+HALF_COUNT = SUB_COUNT >> 1    # buckets per power of two above that
+BUCKETS = SUB_COUNT + (64 - SUB_BITS) * HALF_COUNT
+MAGIC = b"HIST"                # start of a histogram file
+HEADER = struct.Struct("<4sHH")        # magic, version, number of histograms
+ENTRY = struct.Struct("<H32sQQQQI")    # name length, name, count, min, max, total, nonzero buckets
+
+##################################
+#       Histogram class
+##################################
+class Histogram ():
+
+    ########################################
+    # constructor
+    ########################################
+    def __init__(self):
+        self.counts = array("Q", bytes(8 * BUCKETS))  # samples per bucket
+        self.count = 0      # samples recorded
+        self.min = 0        # smallest sample recorded
+        self.max = 0        # largest sample recorded
+        self.total = 0      # sum of the samples (for the mean)
+
+    ########################################
+    # the bucket a (non negative int) value falls in
+    ########################################
+    @staticmethod
+    def index(value):
+        if value < SUB_COUNT:
+            return value
+        shift = value.bit_length() - SUB_BITS
+        return SUB_COUNT + (shift - 1) * HALF_COUNT + (value >> shift) - HALF_COUNT
+
+    ########################################
+    # the largest value that falls in a bucket
+    ########################################
+    @staticmethod
+    def highest_value(index):
+        if index < SUB_COUNT:
+            return index
+        shift = (index - SUB_COUNT) // HALF_COUNT + 1
+        top = (index - SUB_COUNT) % HALF_COUNT + HALF_COUNT
+        return ((top + 1) << shift) - 1
+
+    ########################################
+    # record a sample (negative ones, from clocks being off, count as 0)
+    ########################################
+    def record(self, value, count=1):
+        value = max(int(value), 0)
+        self.counts[self.index(value)] += count
+        if not self.count or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self.count += count
+        self.total += value * count
+
+    ########################################
+    # add the samples of another histogram to ours
+    ########################################
+    def merge(self, other):
+        for index, count in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        if other.count and (not self.count or other.min < self.min):
+            self.min = other.min
+        self.max = max(self.max, other.max)
+        self.count += other.count
+        self.total += other.total
+
+    ########################################
+    # the value that percent percent of the samples are at or below
+    ########################################
+    def percentile(self, percent):
+        if not self.count:
+            return 0
+        target = max(1, int(round(self.count * percent / 100)))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self.highest_value(index), self.max)
+        return self.max
+
+    ########################################
+    # the usual stats of the samples
+    ########################################
+    def summary(self):
+        return {"count": self.count, "min": self.min,
+                "mean": self.total / self.count if self.count else 0,
+                "p50": self.percentile(50), "p99": self.percentile(99),
+                "p99.9": self.percentile(99.9), "max": self.max}
+
+##################################
+#       Histogram Recorder class
+##################################
+class HistogramRecorder ():
+
+    ########################################
+    # constructor
+    ########################################
+    def __init__(self, path, flush_interval=10):
+        self.path = path                      # file the histograms are written to
+        self.flush_interval = flush_interval  # seconds between writes
+        self.histograms = {}                  # phase name -> Histogram
+        self.last_flush = time.monotonic()
+        atexit.register(self.flush)
+
+    ########################################
+    # record a sample of the given phase (writing the histograms out if it is time)
+    ########################################
+    def record(self, phase, value):
+        histogram = self.histograms.get(phase)
+        if histogram is None:
+            histogram = self.histograms[phase] = Histogram()
+        histogram.record(value)
+        if time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    ########################################
+    # write every histogram to our file (only the buckets that are in use)
+    ########################################
+    def flush(self):
+        self.last_flush = time.monotonic()
+        if not self.histograms:
+            return
+        parts = [HEADER.pack(MAGIC, 1, len(self.histograms))]
+        for phase, histogram in self.histograms.items():
+            used = array("Q")
+            for index, count in enumerate(histogram.counts):
+                if count:
+                    used.extend((index, count))
+            name = phase.encode("utf-8")[:32]
+            parts.append(ENTRY.pack(len(name), name, histogram.count, histogram.min,
+                                    histogram.max, histogram.total, len(used) // 2))
+            parts.append(used.tobytes())
+        # write it next to the file first so a reader never sees half of it
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path + ".tmp", "wb") as file:
+            file.write(b"".join(parts))
+        os.replace(self.path + ".tmp", self.path)
+
+########################################
+# read the histograms of a file written by a HistogramRecorder
+########################################
+def load_histograms(path):
+    with open(path, "rb") as file:
+        data = file.read()
+    magic, version, number = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise Exception(f"{path} is not a histogram file")
+    offset = HEADER.size
+    histograms = {}
+    for _ in range(number):
+        length, name, count, minimum, maximum, total, used = ENTRY.unpack_from(data, offset)
+        offset += ENTRY.size
+        pairs = array("Q")
+        pairs.frombytes(data[offset:offset + 16 * used])
+        offset += 16 * used
+        histogram = Histogram()
+        for i in range(0, len(pairs), 2):
+            histogram.counts[pairs[i]] = pairs[i + 1]
+        histogram.count, histogram.min, histogram.max, histogram.total = count, minimum, maximum, total
+        histograms[name[:length].decode("utf-8")] = histogram
+    return histograms
+
+########################################
+# merge the histograms of several files (phase by phase)
+########################################
+def merge_histograms(paths):
+    merged = {}
+    for path in paths:
+        for phase, histogram in load_histograms(path).items():
+            merged.setdefault(phase, Histogram()).merge(histogram)
+    return merged
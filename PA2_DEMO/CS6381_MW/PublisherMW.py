@@ -32,11 +32,10 @@ import configparser  # for configuration parsing
 import logging  # for logging. Use it in place of print statements.
 import zmq  # ZMQ sockets
 
-from datetime import datetime
-
 # import serialization logic
 from CS6381_MW import discovery_pb2
 from CS6381_MW import topic_pb2
+from CS6381_MW.Common import now_ns
 
 # import any other packages you need.
 
@@ -329,7 +328,7 @@ class PublisherMW ():
             topic_msg=topic_pb2.topicMessage()
             topic_msg.topic=topic
             topic_msg.content=content
-            topic_msg.timestamp=datetime.now().strftime("%m/%d/%Y, %H:%M:%S.%f")
+            topic_msg.timestamp=now_ns()
 
             buf2send=topic_msg.SerializeToString()
 
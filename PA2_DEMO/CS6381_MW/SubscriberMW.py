@@ -4,11 +4,10 @@
 # import the needed packages
 import zmq  # ZMQ sockets
 
-from datetime import datetime
-
 # import serialization logic
 from CS6381_MW import discovery_pb2
 from CS6381_MW import topic_pb2
+from CS6381_MW.Common import now_ns
 
 ##################################
 #       Subscriber Middleware class
@@ -25,6 +24,7 @@ class SubscriberMW ():
         self.poller = None  # used to wait on incoming replies
         self.addr = None  # our advertised IP address
         self.port = None  # port num where we are going to look for topics?
+        self.received_ns = None  # when the last topic message was received (see Common.now_ns)
 
     ########################################
     # configure/initialize
@@ -286,6 +286,7 @@ class SubscriberMW ():
 
             # let us first receive all the bytes
             mp_message = self.sub.recv_multipart()
+            self.received_ns = now_ns()
 
             topic = mp_message[0]
             bytesRcvd = mp_message[1]
@@ -293,7 +294,6 @@ class SubscriberMW ():
             # now use protobuf to deserialize the bytes
             message = topic_pb2.topicMessage()
             message.ParseFromString(bytesRcvd)
-            latency = datetime.now() - datetime.strptime(message.timestamp, "%m/%d/%Y, %H:%M:%S.%f")
 
             return message
 
@@ -58,6 +58,8 @@ from topic_selector import TopicSelector
 
 # Now import our CS6381 Middleware
 from CS6381_MW.PublisherMW import PublisherMW
+from CS6381_MW.Common import now_ns
+from CS6381_MW.Histogram import HistogramRecorder
 
 # import any other packages you need.
 
@@ -78,6 +80,7 @@ class PublisherAppln ():
     self.mw_obj = None # handle to the underlying Middleware object
     self.logger = logger  # internal logger for print statements
     self.num_topics = None # number of topics we want to publish
+    self.stats = None # latency histograms (ns) of our phases
 
   ########################################
   # configure/initialize
@@ -100,6 +103,7 @@ class PublisherAppln ():
       config.read (args.config)
       self.lookup = config["Discovery"]["Strategy"]
       self.dissemination = config["Dissemination"]["Strategy"]
+      self.stats = HistogramRecorder(f'PA2_DEMO/stats/{self.name}_{self.lookup}.hist')
     
       # Now get our topic list of interest
       self.logger.debug ("PublisherAppln::configure - selecting our topic list")
@@ -132,7 +136,7 @@ class PublisherAppln ():
       self.dump ()
 
       time.sleep(random.uniform(0, 1.0))
-      register_start = int(round(time.time() * 1000))
+      register_start = now_ns()
 
       # First ask our middleware to register ourselves with the discovery service
       self.logger.debug ("PublisherAppln::driver - register with the discovery service")
@@ -145,17 +149,11 @@ class PublisherAppln ():
       self.logger.debug (f"PublisherAppln::driver - result of registration: {result}")
       self.logger.info(f"PublisherAppln - Result of registration: {result}")
 
-      register_end = int(round(time.time() * 1000))
-      register_time = register_end - register_start
-
-      register_fname = f'PA2_DEMO/stats/{self.name}_{self.lookup}_register.csv'
-      with open(register_fname, 'a') as file:
-          file.write(f'{register_time}\n')
-            
+      self.stats.record("register", now_ns() - register_start)
 
       time.sleep(5)
 
-      is_ready_start = int(round(time.time() * 1000))
+      is_ready_start = now_ns()
 
       # Now keep checking with the discovery service if we are ready to go
       self.logger.debug ("PublisherAppln::driver - check if are ready to go")
@@ -164,14 +162,7 @@ class PublisherAppln ():
         time.sleep (5)  # sleep between calls so that we don't make excessive calls
         self.logger.debug ("PublisherAppln::driver - check again if are ready to go")
 
-      is_ready_end = int(round(time.time() * 1000))
-
-      is_ready_time = is_ready_end - is_ready_start
-
-      is_ready_fname = f'PA2_DEMO/stats/{self.name}_{self.lookup}_isready.csv'
-      with open(is_ready_fname, 'a') as file:
-          file.write(f'{is_ready_time}\n')
-
+      self.stats.record("isready", now_ns() - is_ready_start)
 
 
       time.sleep(5)
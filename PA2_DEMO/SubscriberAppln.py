@@ -35,8 +35,6 @@ import configparser  # for configuration parsing
 import logging  # for logging. Use it in place of print statements.
 import random  # needed in the topic selection using random numbers
 
-from datetime import datetime
-
 
 # Import our topic selector. Feel free to use alternate way to
 # get your topics of interest
@@ -44,6 +42,8 @@ from topic_selector import TopicSelector
 
 # Now import our CS6381 Middleware
 from CS6381_MW.SubscriberMW import SubscriberMW
+from CS6381_MW.Common import now_ns, hop_latencies
+from CS6381_MW.Histogram import HistogramRecorder
 
 # import any other packages you need.
 
@@ -67,6 +67,7 @@ class SubscriberAppln ():
         self.latencies = []
         self.output = None
         self.num_topics = None # number of topics to select
+        self.stats = None  # latency histograms (ns) of our phases and of what we receive
 
     ########################################
     # configure/initialize
@@ -90,6 +91,7 @@ class SubscriberAppln ():
             config.read(args.config)
             self.lookup = config["Discovery"]["Strategy"]
             self.dissemination = config["Dissemination"]["Strategy"]
+            self.stats = HistogramRecorder(f'PA2_DEMO/stats/{self.name}_{self.lookup}.hist')
 
             # Now get our topic list of interest
             self.logger.debug(
@@ -126,7 +128,7 @@ class SubscriberAppln ():
 
             time.sleep(random.uniform(1.2, 2.0))
 
-            register_start = int(round(time.time() * 1000))
+            register_start = now_ns()
 
             # First ask our middleware to register ourselves with the discovery service
             self.logger.info(f"SubscriberAppln - Attempting to register with Discovery service")
@@ -137,19 +139,13 @@ class SubscriberAppln ():
                 "SubscriberAppln::driver - result of registration".format(result))
             self.logger.info(f"SubscriberAppln - Result of registration: {result}")
 
-            register_end = int(round(time.time() * 1000))
-            register_time = register_end - register_start
-
-            register_fname = f'PA2_DEMO/stats/{self.name}_{self.lookup}_register.csv'
-            with open(register_fname, 'a') as file:
-                file.write(f'{register_time}\n')
-            
+            self.stats.record("register", now_ns() - register_start)
 
             # Now keep checking with the discovery service if we are ready to go
             self.logger.debug(
                 "SubscriberAppln::driver - check if are ready to go")
 
-            is_ready_start = int(round(time.time() * 1000))
+            is_ready_start = now_ns()
 
             while (not self.mw_obj.is_ready()):
                 self.logger.info(f"SubscriberAppln - Sending is_ready request")
@@ -159,14 +155,7 @@ class SubscriberAppln ():
                 self.logger.debug(
                     "SubscriberAppln::driver - check again if are ready to go")
             
-            is_ready_end = int(round(time.time() * 1000))
-            is_ready_time = is_ready_end - is_ready_start
-
-            is_ready_fname = f'PA2_DEMO/stats/{self.name}_{self.lookup}_isready.csv'
-            with open(is_ready_fname, 'a') as file:
-                file.write(f'{is_ready_time}\n')
-
-            # TODO: Write reg_time_ms and is_ready_time_ms to a file
+            self.stats.record("isready", now_ns() - is_ready_start)
 
             self.logger.info(f"SubscriberAppln - System is ready!")
 
@@ -178,19 +167,14 @@ class SubscriberAppln ():
             self.logger.info(f"SubscriberAppln - Looking up publishers for: {self.topicList}")
 
             pub_addressses = []
-            lookup_fname = f'PA2_DEMO/stats/{self.name}_{self.lookup}_lookup.csv'
 
             for topic in self.topicList:
 
-                lookup_start = int(round(time.time() * 1000))
+                lookup_start = now_ns()
 
                 new_addresses = self.mw_obj.lookup([topic])
 
-                lookup_end = int(round(time.time() * 1000))
-                lookup_time = lookup_end - lookup_start
-
-                with open(lookup_fname, 'a') as file:
-                    file.write(f'{lookup_time}\n')
+                self.stats.record("lookup", now_ns() - lookup_start)
                 
                 for address in new_addresses:
                     pub_addressses.append(address)
@@ -216,8 +200,11 @@ class SubscriberAppln ():
                 result = self.mw_obj.event_loop()
                 self.logger.debug(f"SubscriberAppln::driver - Received {result}")
                 
-                latency = str(datetime.now() - datetime.strptime(result.timestamp, "%m/%d/%Y, %H:%M:%S.%f"))
-                self.logger.info(f"SubscriberAppln - (latency: {latency.split(':')[-1]}) Received {result}")
+                hops = hop_latencies(result, self.mw_obj.received_ns)
+                for hop, ns in hops.items():
+                    self.stats.record(hop, ns)
+                latency = ", ".join(f"{hop}: {ns / 1e6:.3f} ms" for hop, ns in hops.items())
+                self.logger.info(f"SubscriberAppln - (latency: {latency}) Received {result}")
                 
         except Exception as e:
             raise e
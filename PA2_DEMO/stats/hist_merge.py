@@ -0,0 +1,20 @@
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from CS6381_MW.Histogram import merge_histograms
+
+parser = argparse.ArgumentParser(description="Merge the latency histograms of multiple processes and print their percentiles")
+
+parser.add_argument('files', nargs='+', help="The .hist files written by the pubs and subs")
+
+args = parser.parse_args()
+
+# Merge the histograms of every process, phase by phase
+merged = merge_histograms(args.files)
+
+print(f'{"phase":<16}{"count":>10}{"mean ms":>12}{"p50 ms":>12}{"p99 ms":>12}{"p99.9 ms":>12}{"max ms":>12}')
+for phase, histogram in sorted(merged.items()):
+    s = histogram.summary()
+    print(f'{phase:<16}{s["count"]:>10}' + ''.join(f'{s[stat] / 1e6:>12.3f}' for stat in ['mean', 'p50', 'p99', 'p99.9', 'max']))